@@ -1,24 +1,34 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+import asyncio
+from typing import Any, Dict, List, Optional, Union
 
 from config.prompts import build_system_prompt
+from config.settings import settings
 from utils import action_parser
 from utils import model_client
+from utils.image_utils import Screenshot
+from utils.metrics import metrics
 from utils.session_store import session_store
 from utils.validators import validate_action, validate_model_config
 
 
+def _answer_complete(content: str) -> bool:
+    return action_parser.extract_answer_action(content) is not None
+
+
 class ExecutorAgent:
-    def run(
+    async def run(
         self,
         task: str,
         selected_skills: List[str],
         model_config: Optional[Dict[str, Any]],
-        screenshot: Optional[str],
+        screenshot: Optional[Union[str, Screenshot]],
         session_id: Optional[str],
         system_prompt_override: Optional[str] = None,
-    ) -> Dict[str, List[Dict[str, Any]]]:
+        commit_history: bool = True,
+    ) -> Dict[str, Any]:
+        """执行任务。commit_history=False 时不写入会话历史，需由调用方确认后再调用 commit_history。"""
         actions: List[Dict[str, Any]] = []
         effects: List[Dict[str, Any]] = []
 
@@ -26,53 +36,66 @@ class ExecutorAgent:
             valid, reason = validate_model_config(model_config)
             if not valid:
                 raise ValueError(f"模型配置无效: {reason}")
-            model_actions, model_effects = self._run_with_model(
+            model_actions, model_effects, raw = await self._run_with_model(
                 task,
                 screenshot,
                 model_config,
                 session_id,
                 system_prompt_override,
             )
+            if commit_history:
+                await self.commit_history(session_id, task, raw)
             actions.extend(model_actions)
             effects.extend(model_effects)
-            return {"actions": actions, "effects": effects}
+            return {"actions": actions, "effects": effects, "raw": raw}
         return {"actions": actions, "effects": effects}
 
-    def _run_with_model(
+    async def commit_history(self, session_id: Optional[str], task: str, raw: str) -> None:
+        await session_store.append_turn(session_id or "", task, raw)
+
+    async def _run_with_model(
         self,
         task: str,
-        screenshot: Optional[str],
+        screenshot: Optional[Union[str, Screenshot]],
         model_config: Dict[str, Any],
         session_id: Optional[str],
         system_prompt_override: Optional[str],
-    ) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    ) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]], str]:
         system_prompt = system_prompt_override or build_system_prompt()
 
-        history = session_store.get_history(session_id or "")
+        history = await session_store.get_history(session_id or "")
 
         content: List[Dict[str, Any]] = [{"type": "text", "text": task}]
-        if screenshot:
+        image = Screenshot.coerce(screenshot)
+        if image:
             content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{screenshot}"},
+                "image_url": {"url": await asyncio.to_thread(image.data_url)},
             })
 
         messages = [{"role": "system", "content": system_prompt}]
         messages.extend(history)
         messages.append({"role": "user", "content": content})
 
-        response = model_client.chat_completions(
-            base_url=model_config["base_url"],
-            api_key=model_config["api_key"],
-            model=model_config["model"],
-            messages=messages,
-        )
+        # 流式接收，<answer> 中的动作完整后立即结束生成
+        with metrics.timer("executor_latency_seconds"):
+            response = await model_client.achat_completions(
+                base_url=model_config["base_url"],
+                api_key=model_config["api_key"],
+                model=model_config["model"],
+                messages=messages,
+                stop_when=_answer_complete if settings.model_stream_actions else None,
+                config=model_config.get("config"),
+            )
         raw = model_client.extract_content(response) or ""
-        session_store.append_user(session_id or "", task)
-        session_store.append_assistant(session_id or "", raw)
-        _, action_text = action_parser.parse_response(raw)
+        action_text = action_parser.extract_answer_action(raw)
+        if action_text is not None:
+            if "</answer>" not in raw:
+                raw += "</answer>"
+        else:
+            _, action_text = action_parser.parse_response(raw)
         action = action_parser.parse_action(action_text)
         valid, reason = validate_action(action)
         if not valid:
             raise ValueError(f"动作无效: {reason}")
-        return [action], []
+        return [action], [], raw
@@ -1,18 +1,26 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import logging
+from contextvars import ContextVar
 from operator import add
 from time import perf_counter
-from typing import Annotated, Any, Dict, List, Optional, TypedDict
+from typing import Annotated, Any, Awaitable, Callable, Dict, List, Optional, TypedDict
 
 from agents.executor import ExecutorAgent
 from agents.planner import PlannerAgent
 from agents.xiaozhi import XiaozhiAgent
+from config.settings import settings
 from skills import anti_scam, doudizhu, photo_composition, translator  # noqa: F401
 from skills.effect_registry import validate_effects
 from skills.registry import registry
+from utils import token_usage
+from utils.image_utils import Screenshot
+from utils.metrics import metrics
 from utils.model_router import ModelRouter
 from utils.session_store import plan_cache
+from utils.tracing import span, traced
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +34,7 @@ except ImportError:  # pragma: no cover
 class AgentState(TypedDict):
     task: Annotated[str, lambda x, y: x or y]
     screenshot: Annotated[Optional[str], lambda x, y: x or y]
+    screenshot_image: Annotated[Optional[Screenshot], lambda x, y: x or y]
     translation_region: Annotated[Optional[Dict[str, Any]], lambda x, y: x or y]
     plan: Annotated[List[str], lambda x, y: y if y else x]
     selected_skills: Annotated[List[str], lambda x, y: y if y else x]
@@ -39,11 +48,12 @@ class AgentState(TypedDict):
     user_agents: Annotated[List[Dict[str, Any]], lambda x, y: y if y else x]
     user_skills: Annotated[List[Any], lambda x, y: y if y else x]
     selected_agent: Annotated[Optional[Dict[str, Any]], lambda x, y: y if y is not None else x]
-    pending_skills: Annotated[List[str], lambda x, y: y if y else x]
+    pending_skills: Annotated[List[str], lambda x, y: y]
     system_prompt_override: Annotated[Optional[str], lambda x, y: y if y is not None else x]
     manager_model: Annotated[Optional[Dict[str, Any]], lambda x, y: x or y]
     default_model: Annotated[Optional[Dict[str, Any]], lambda x, y: x or y]
     skip_planner: Annotated[bool, lambda x, y: y]
+    speculative_result: Annotated[Optional[Dict[str, Any]], lambda x, y: y]
 
 
 planner_agent = PlannerAgent()
@@ -51,77 +61,258 @@ executor_agent = ExecutorAgent()
 xiaozhi_agent = XiaozhiAgent()
 model_router = ModelRouter()
 
+# 编译后的图按注册表版本缓存，避免每个任务重复构建和编译
+_compiled_graph: Any = None
+_compiled_version: Optional[int] = None
+# 与编译图同时构建的内置技能执行器
+_skill_runners: Dict[str, Any] = {}
 
-def xiaozhi_entry(state: AgentState) -> AgentState:
-    return state
+# 中间结果回调：("actions" | "effects", 列表)，由 arun_task 按任务设置
+TaskEventHandler = Callable[[str, List[Dict[str, Any]]], Awaitable[None]]
+_event_handler: ContextVar[Optional[TaskEventHandler]] = ContextVar("task_event_handler", default=None)
+
+
+async def _emit(kind: str, items: List[Dict[str, Any]]) -> None:
+    """节点产生结果后立即推送给调用方，推送失败不影响任务执行。"""
+    handler = _event_handler.get()
+    if handler is None or not items:
+        return
+    try:
+        await handler(kind, items)
+    except Exception:
+        logger.exception("推送任务中间结果失败")
+
+
+async def xiaozhi_entry(state: AgentState) -> Dict[str, Any]:
+    return {}
+
+
+def _describe(*values: Any) -> str:
+    return hashlib.sha1("\0".join(str(value or "") for value in values).encode("utf-8")).hexdigest()[:16]
+
+
+def _plan_cache_scope(
+    user_skills: Optional[List[Any]],
+    user_agents: Optional[List[Dict[str, Any]]],
+    planner_model: Optional[Dict[str, Any]],
+) -> List[str]:
+    """规划结果取决于 Planner 模型，以及可选技能与智能体的名称和描述，它们共同构成缓存键的一部分。
+
+    修改技能或智能体描述后键随之变化，不会命中修改前的规划结果。
+    """
+    planner_model = planner_model or {}
+    scope = [f"planner:{planner_model.get('base_url')}|{planner_model.get('model')}"]
+    scope.extend(f"{skill.id}:{_describe(skill.name, skill.description)}" for skill in registry.all())
+    scope.extend(f"{skill.id}:{_describe(skill.name, skill.description)}" for skill in user_skills or [])
+    scope.extend(
+        f"agent:{agent.get('id')}:{_describe(agent.get('name'), agent.get('description'))}"
+        for agent in user_agents or []
+    )
+    return scope
+
+
+def _find_agent(user_agents: List[Dict[str, Any]], agent_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not agent_id:
+        return None
+    for agent in user_agents:
+        if str(agent.get("id")) == agent_id:
+            return agent
+    return None
+
+
+def _start_speculative_executor(state: AgentState) -> Optional[asyncio.Task]:
+    """与 Planner 并行，以默认提示词提前启动 Executor。"""
+    if not settings.speculative_executor or not state.get("model_config"):
+        return None
+    task = asyncio.create_task(
+        executor_agent.run(
+            state["task"],
+            [],
+            state.get("model_config"),
+            state.get("screenshot_image") or state.get("screenshot"),
+            state.get("session_id"),
+            state.get("system_prompt_override"),
+            commit_history=False,
+        )
+    )
+    # 被丢弃的推测结果不需要处理异常，这里读取一次避免 "exception was never retrieved"
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+def _plan_gates_executor(update: Dict[str, Any]) -> bool:
+    """规划结果会改变 Executor 的输入时（选中智能体或翻译技能），推测结果无效。"""
+    return bool(update.get("selected_agent")) or "translator" in (update.get("selected_skills") or [])
 
 
-def planner_node(state: AgentState) -> AgentState:
+@traced("graph.planner")
+async def planner_node(state: AgentState) -> Dict[str, Any]:
     # 如果有缓存则跳过规划
     if state.get("skip_planner"):
         logger.info("使用缓存的规划结果，跳过 Planner 调用")
-        return state
+        return {}
 
     planner_model = state.get("manager_model") or state.get("default_model")
-    result = planner_agent.run(
-        state["task"],
-        state.get("user_agents"),
-        planner_model,
-        state.get("user_skills", [])
-    )
-    state["plan"] = result["plan"]
-    state["selected_skills"] = result["skills"]
-    state["selected_agent"] = result.get("agent")
-    state["pending_skills"] = list(state["selected_skills"])
-
-    # 缓存规划结果
-    session_id = state.get("session_id")
-    if session_id:
-        plan_cache.set(
-            session_id,
+    decision, result = None, None
+    if planner_model:
+        # 本地路由置信度足够时不调用 Planner 模型，也不需要推测执行
+        decision, result = planner_agent.fast_path(
             state["task"],
-            state["plan"],
-            state["selected_skills"],
-            state.get("selected_agent"),
+            state.get("user_agents"),
+            state.get("user_skills", []),
         )
-        logger.info(f"已缓存 session {session_id} 的规划结果")
+    speculative = None
+    fast_path = result is not None
+    if fast_path:
+        metrics.incr("planner_fast_path_total")
+        logger.info(f"本地路由置信度 {decision['confidence']:.2f}，跳过 Planner 模型调用")
+    else:
+        speculative = _start_speculative_executor(state)
+        try:
+            result = await planner_agent.run(
+                state["task"],
+                state.get("user_agents"),
+                planner_model,
+                state.get("user_skills", [])
+            )
+        except BaseException:
+            if speculative:
+                speculative.cancel()
+            raise
+    if decision is not None:
+        planner_agent.log_routing(state["task"], decision, result, fast_path=fast_path)
+    update: Dict[str, Any] = {
+        "plan": result["plan"],
+        "selected_skills": result["skills"],
+        "selected_agent": result.get("agent"),
+        "pending_skills": list(result["skills"]),
+    }
 
-    return state
+    if speculative:
+        if _plan_gates_executor(update):
+            speculative.cancel()
+            metrics.incr("speculative_executor_discarded_total")
+            logger.info("规划结果需要覆盖 Executor 输入，丢弃推测执行结果")
+        else:
+            try:
+                update["speculative_result"] = await speculative
+                metrics.incr("speculative_executor_used_total")
+            except Exception as exc:
+                # 推测执行失败时交给 executor_node 正常重试
+                logger.warning(f"推测执行失败，回退到顺序执行: {exc}")
+
+    # 缓存 Planner 模型的规划结果（跨 session 共享）；本地路由和关键词回退结果不缓存，
+    # 避免模型调用失败时的回退结果在缓存有效期内被其他设备复用
+    if not fast_path and not result.get("fallback"):
+        selected_agent = update["selected_agent"]
+        await plan_cache.set(
+            state["task"],
+            _plan_cache_scope(state.get("user_skills"), state.get("user_agents"), planner_model),
+            update["plan"],
+            update["selected_skills"],
+            str(selected_agent.get("id")) if selected_agent else None,
+        )
 
+    return update
+
+
+@traced("graph.executor")
+async def executor_node(state: AgentState) -> Dict[str, Any]:
+    speculative_result = state.get("speculative_result")
+    if speculative_result is not None:
+        if "raw" in speculative_result:
+            await executor_agent.commit_history(state.get("session_id"), state["task"], speculative_result["raw"])
+        await _emit("actions", speculative_result["actions"])
+        await _emit("effects", speculative_result["effects"])
+        return {
+            "actions": speculative_result["actions"],
+            "effects": speculative_result["effects"],
+            "speculative_result": None,
+        }
 
-def executor_node(state: AgentState) -> AgentState:
     model_config = state.get("model_config")
     selected_agent = state.get("selected_agent")
     system_prompt_override = state.get("system_prompt_override")
     if selected_agent:
         model_config = selected_agent.get("model") or model_config
         system_prompt_override = selected_agent.get("system_prompt")
-        state["system_prompt_override"] = system_prompt_override
     if "translator" in (state.get("selected_skills") or []) and not selected_agent:
         model_config = None
-    result = executor_agent.run(
+    result = await executor_agent.run(
         state["task"],
         state["selected_skills"],
         model_config,
-        state.get("screenshot"),
+        state.get("screenshot_image") or state.get("screenshot"),
         state.get("session_id"),
         system_prompt_override,
     )
-    state["actions"] = result["actions"]
-    state["effects"] = result["effects"]
-    return state
+    await _emit("actions", result["actions"])
+    await _emit("effects", result["effects"])
+    return {
+        "actions": result["actions"],
+        "effects": result["effects"],
+        "system_prompt_override": system_prompt_override,
+    }
+
+
+async def _run_skill(skill: Any, skill_id: str, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    """执行单个技能，技能失败只记录在自己的 timing 中，不影响其他技能。"""
+    stats = {"cache_hits": 0}
+    context = {
+        **context,
+        "skill_id": skill_id,
+        "response_cache_ttl": getattr(skill, "response_cache_ttl_seconds", None),
+        "model_call_stats": stats,
+    }
+    start_time = perf_counter()
+    with token_usage.track() as usage:
+        try:
+            with span("graph.skill", **{"skill.id": skill_id}) as current:
+                result = await skill.analyze(task, context)
+                current.set_attribute("skill.cache_hits", stats["cache_hits"])
+        except Exception as exc:
+            execution_ms = int((perf_counter() - start_time) * 1000)
+            logger.exception(f"技能 {skill_id} 执行失败")
+            return {
+                "effects": [],
+                "skill_timings": [
+                    {
+                        "skill_id": skill_id,
+                        "execution_ms": execution_ms,
+                        "status": 0,
+                        "error": str(exc),
+                        **usage.as_dict(),
+                    }
+                ],
+            }
+
+    execution_ms = int((perf_counter() - start_time) * 1000)
+    effects_data = [effect.model_dump() for effect in result.effects]
+    is_valid, errors = validate_effects(effects_data)
+    if not is_valid:
+        logger.warning(f"技能 {skill_id} 产生了无效效果: {errors}")
+    return {
+        "effects": effects_data,
+        "skill_timings": [
+            {
+                "skill_id": skill_id,
+                "execution_ms": execution_ms,
+                "status": 1,
+                "cache_hits": stats["cache_hits"],
+                **usage.as_dict(),
+            }
+        ],
+    }
 
 
 def skill_node_factory(skill_id: str):
-    def run_skill(state: AgentState) -> AgentState:
+    async def run_skill(state: AgentState) -> Dict[str, Any]:
         # 只处理内置技能（用户技能由 user_skill_node 处理）
-        skill = registry.get(skill_id) if skill_id in [s.id for s in registry.all()] else None
-
-        if not skill:
+        try:
+            skill = registry.get(skill_id)
+        except KeyError:
             # 技能未找到，跳过
-            if state["pending_skills"] and state["pending_skills"][0] == skill_id:
-                state["pending_skills"].pop(0)
-            return state
+            return {"effects": [], "skill_timings": []}
 
         model_config = model_router.resolve_builtin_model(
             skill_id,
@@ -130,60 +321,17 @@ def skill_node_factory(skill_id: str):
         )
         context = {
             "screenshot": state.get("screenshot"),
+            "screenshot_image": state.get("screenshot_image"),
             "model_config": model_config.model_dump() if model_config else None,
             "translation_region": state.get("translation_region"),
         }
-
-        start_time = perf_counter()
-        try:
-            result = skill.analyze(state["task"], context)
-        except Exception:
-            execution_ms = int((perf_counter() - start_time) * 1000)
-            state.setdefault("skill_timings", []).append(
-                {"skill_id": skill_id, "execution_ms": execution_ms, "status": 0}
-            )
-            raise
-
-        execution_ms = int((perf_counter() - start_time) * 1000)
-        state.setdefault("skill_timings", []).append(
-            {"skill_id": skill_id, "execution_ms": execution_ms, "status": 1}
-        )
-
-        effects_data = [effect.model_dump() for effect in result.effects]
-        is_valid, errors = validate_effects(effects_data)
-        if not is_valid:
-            logger.warning(f"技能 {skill_id} 产生了无效效果: {errors}")
-        state["effects"].extend(effects_data)
-        if state["pending_skills"] and state["pending_skills"][0] == skill_id:
-            state["pending_skills"].pop(0)
-        return state
+        return await _run_skill(skill, skill_id, state["task"], context)
 
     return run_skill
 
 
-def skill_router_node(state: AgentState) -> AgentState:
-    return state
-
-
-def skill_route(state: AgentState) -> str:
-    if state["pending_skills"]:
-        skill_id = state["pending_skills"][0]
-        # 用户技能统一路由到 "user_skill" node
-        if skill_id.startswith("user:"):
-            return "user_skill"
-        return skill_id
-    return "xiaozhi_check"
-
-
-def user_skill_node(state: AgentState) -> AgentState:
-    """通用用户技能执行 node"""
-    if not state["pending_skills"]:
-        return state
-
-    skill_id = state["pending_skills"][0]
-    if not skill_id.startswith("user:"):
-        return state
-
+async def user_skill_node(state: AgentState, skill_id: str) -> Dict[str, Any]:
+    """通用用户技能执行"""
     # 从 user_skills 中查找技能
     skill = None
     for user_skill in state.get("user_skills", []):
@@ -193,8 +341,7 @@ def user_skill_node(state: AgentState) -> AgentState:
 
     if not skill:
         # 技能未找到，跳过
-        state["pending_skills"].pop(0)
-        return state
+        return {"effects": [], "skill_timings": []}
 
     # 解析模型配置：优先级 skill.model_config > agent.model > default_model
     skill_model = getattr(skill, "model_config", None)
@@ -207,70 +354,110 @@ def user_skill_node(state: AgentState) -> AgentState:
 
     context = {
         "screenshot": state.get("screenshot"),
+        "screenshot_image": state.get("screenshot_image"),
         "model_config": model_config.model_dump() if model_config else None,
         "translation_region": state.get("translation_region"),
     }
-
-    start_time = perf_counter()
-    try:
-        result = skill.analyze(state["task"], context)
-    except Exception:
-        execution_ms = int((perf_counter() - start_time) * 1000)
-        state.setdefault("skill_timings", []).append(
-            {"skill_id": skill_id, "execution_ms": execution_ms, "status": 0}
-        )
-        raise
-
-    execution_ms = int((perf_counter() - start_time) * 1000)
-    state.setdefault("skill_timings", []).append(
-        {"skill_id": skill_id, "execution_ms": execution_ms, "status": 1}
-    )
-
-    effects_data = [effect.model_dump() for effect in result.effects]
-    is_valid, errors = validate_effects(effects_data)
-    if not is_valid:
-        logger.warning(f"用户技能 {skill_id} 产生了无效效果: {errors}")
-    state["effects"].extend(effects_data)
-    state["pending_skills"].pop(0)
-    return state
-
-
-def xiaozhi_check(state: AgentState) -> AgentState:
+    return await _run_skill(skill, skill_id, state["task"], context)
+
+
+@traced("graph.skills")
+async def skills_node(state: AgentState) -> Dict[str, Any]:
+    """并发执行所有已选技能。
+
+    技能之间互不依赖，并发数受 skill_max_concurrency 限制；
+    效果按技能选择顺序合并，保证结果确定。
+    """
+    pending = list(state.get("pending_skills") or [])
+    if not pending:
+        return {"pending_skills": []}
+
+    semaphore = asyncio.Semaphore(max(1, settings.skill_max_concurrency))
+
+    async def run_one(skill_id: str) -> Dict[str, Any]:
+        queued_at = perf_counter()
+        async with semaphore:
+            metrics.observe("skill_queue_wait_seconds", perf_counter() - queued_at)
+            # 用户技能统一由 user_skill_node 执行
+            if skill_id.startswith("user:"):
+                update = await user_skill_node(state, skill_id)
+            else:
+                runner = _skill_runners.get(skill_id) or skill_node_factory(skill_id)
+                update = await runner(state)
+        # 每个技能完成即推送效果，不等待最慢的技能
+        await _emit("effects", update["effects"])
+        return update
+
+    results = await asyncio.gather(*(run_one(skill_id) for skill_id in pending))
+
+    effects: List[Dict[str, Any]] = []
+    skill_timings: List[Dict[str, Any]] = []
+    for result in results:
+        effects.extend(result["effects"])
+        skill_timings.extend(result["skill_timings"])
+    return {"effects": effects, "skill_timings": skill_timings, "pending_skills": []}
+
+
+async def xiaozhi_check(state: AgentState) -> Dict[str, Any]:
     verdict = xiaozhi_agent.evaluate(state["task"], state["plan"])
-    state["done"] = verdict["done"]
-    return state
+    return {"done": verdict["done"]}
 
 
 def build_graph() -> Any:
+    global _skill_runners
     if StateGraph is None:
         return None
+    _skill_runners = {skill.id: skill_node_factory(skill.id) for skill in registry.all()}
     graph = StateGraph(AgentState)
     graph.add_node("xiaozhi_entry", xiaozhi_entry)
     graph.add_node("planner", planner_node)
     graph.add_node("executor", executor_node)
+    graph.add_node("skills", skills_node)
     graph.add_node("xiaozhi_check", xiaozhi_check)
-    graph.add_node("skill_router", skill_router_node)
-    graph.add_node("user_skill", user_skill_node)  # 通用用户技能 node
-    for skill in registry.all():
-        graph.add_node(skill.id, skill_node_factory(skill.id))
     graph.set_entry_point("xiaozhi_entry")
     graph.add_edge("xiaozhi_entry", "planner")
     graph.add_edge("planner", "executor")
-    graph.add_edge("executor", "skill_router")
-    graph.add_edge("user_skill", "skill_router")  # 用户技能执行后回到 router
-    for skill in registry.all():
-        graph.add_edge(skill.id, "skill_router")
-    # skill_router 使用条件边路由到下一个技能或 xiaozhi_check，不需要无条件边
+    graph.add_edge("executor", "skills")
+    graph.add_edge("skills", "xiaozhi_check")
 
     def route(state: AgentState) -> str:
         return END if state.get("done") else "planner"
 
     graph.add_conditional_edges("xiaozhi_check", route)
-    graph.add_conditional_edges("skill_router", skill_route)
     return graph.compile()
 
 
-def run_task(payload: Dict[str, Any]) -> Dict[str, Any]:
+def get_graph() -> Any:
+    """获取已编译的图；技能注册表变化后才重新编译。"""
+    global _compiled_graph, _compiled_version
+    version = registry.version
+    if _compiled_version != version:
+        _compiled_graph = build_graph()
+        _compiled_version = version
+        metrics.incr("graph_compiles_total")
+        logger.info(f"已编译任务图 (技能注册表版本 {version})")
+    return _compiled_graph
+
+
+async def arun_task(payload: Dict[str, Any], on_event: Optional[TaskEventHandler] = None) -> Dict[str, Any]:
+    """异步执行任务图，模型调用期间不阻塞事件循环。
+
+    on_event 用于增量推送：Executor 完成后立即收到 ("actions", ...)，
+    每个技能完成后收到 ("effects", ...)；返回值仍包含完整结果。
+    返回值中的 token_usage 为整个任务（Planner、Executor、技能）的模型 token 用量，
+    skill_timings 中每一项另有该技能自己的用量。
+    """
+    token = _event_handler.set(on_event)
+    try:
+        with token_usage.track() as usage:
+            result = await _arun_task(payload)
+        result["token_usage"] = usage.as_dict()
+        return result
+    finally:
+        _event_handler.reset(token)
+
+
+async def _arun_task(payload: Dict[str, Any]) -> Dict[str, Any]:
     default_model = payload.get("default_model")
     manager_model = payload.get("manager_model")
     model_config = default_model or manager_model
@@ -278,13 +465,18 @@ def run_task(payload: Dict[str, Any]) -> Dict[str, Any]:
 
     task = payload.get("task", "")
     session_id = payload.get("session_id")
+    user_agents = payload.get("user_agents") or []
+    user_skills = payload.get("user_skills") or []
 
     # 尝试从缓存获取规划结果
-    cached_plan = plan_cache.get(session_id or "", task)
+    cached_plan = await plan_cache.get(task, _plan_cache_scope(user_skills, user_agents, manager_model or default_model))
+    if cached_plan:
+        logger.info("规划缓存命中")
 
     state: AgentState = {
         "task": task,
         "screenshot": payload.get("screenshot"),
+        "screenshot_image": Screenshot.coerce(payload.get("screenshot")),
         "translation_region": payload.get("translation_region"),
         "plan": cached_plan["plan"] if cached_plan else [],
         "selected_skills": cached_plan["selected_skills"] if cached_plan else [],
@@ -295,17 +487,30 @@ def run_task(payload: Dict[str, Any]) -> Dict[str, Any]:
         "model_config": model_config,
         "builtin_models": builtin_models,
         "session_id": session_id,
-        "user_agents": payload.get("user_agents") or [],
-        "user_skills": payload.get("user_skills") or [],
-        "selected_agent": cached_plan["selected_agent"] if cached_plan else None,
+        "user_agents": user_agents,
+        "user_skills": user_skills,
+        "selected_agent": _find_agent(user_agents, cached_plan["selected_agent_id"]) if cached_plan else None,
         "pending_skills": list(cached_plan["selected_skills"]) if cached_plan else [],
         "system_prompt_override": None,
         "manager_model": manager_model,
         "default_model": default_model,
         "skip_planner": bool(cached_plan),
+        "speculative_result": None,
     }
-    graph = build_graph()
+    graph = get_graph()
     if graph:
-        result = graph.invoke(state)
+        result = await graph.ainvoke(state)
         return result
-    return xiaozhi_check(executor_node(planner_node(xiaozhi_entry(state))))
+    for node in (xiaozhi_entry, planner_node, executor_node, skills_node, xiaozhi_check):
+        update = await node(state)
+        for key, value in update.items():
+            if key in ("effects", "skill_timings"):
+                state[key] = state[key] + value
+            else:
+                state[key] = value
+    return state
+
+
+def run_task(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """arun_task 的同步包装，供没有事件循环的调用方（脚本、测试）使用。"""
+    return asyncio.run(arun_task(payload))
@@ -1,14 +1,21 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 import json
 import logging
 import re
 
+from config.settings import settings
 from skills.registry import registry
 from utils import model_client
+from utils.intent_classifier import get_intent_classifier
+from utils.keyword_matcher import KeywordMatcher
+from utils.metrics import metrics
+from utils.payload_log import get_payload_logger, log_payload
 
 logger = logging.getLogger(__name__)
+routing_logger = get_payload_logger("routing")
 
 
 TRANSLATOR_KEYWORDS = (
@@ -34,17 +41,31 @@ PHOTO_COMPOSITION_KEYWORDS = (
 )
 
 
+BUILTIN_SKILL_KEYWORDS = (
+    ("translator", TRANSLATOR_KEYWORDS),
+    ("anti_scam", ANTI_SCAM_KEYWORDS + ("scam",)),
+    ("doudizhu", DOUDIZHU_KEYWORDS + ("doudizhu",)),
+    ("photo_composition", PHOTO_COMPOSITION_KEYWORDS),
+)
+
+_IGNORED_CHARS = re.compile(r"[\s,。、!?！？;；:：]+")
+
+
 def _normalize_text(text: str) -> str:
     """将文本统一为小写并去除空白/标点，用于关键词匹配。"""
-    text = text.lower()
-    text = re.sub(r"\s+", "", text)
-    text = re.sub(r"[,。、!?！？;；:：]", "", text)
-    return text
+    return _IGNORED_CHARS.sub("", text.lower())
+
 
+_BUILTIN_ENTRIES = [
+    (keyword, skill_id) for skill_id, keywords in BUILTIN_SKILL_KEYWORDS for keyword in keywords
+]
 
-def _has_any(haystack: str, keywords: tuple[str, ...]) -> bool:
-    normalized = _normalize_text(haystack)
-    return any(keyword and _normalize_text(keyword) in normalized for keyword in keywords)
+
+@lru_cache(maxsize=256)
+def _skill_matcher(user_skill_names: Tuple[Tuple[str, str], ...]) -> KeywordMatcher:
+    """内置关键词 + 用户技能名称的匹配自动机，用户技能集合变化时重新构建。"""
+    entries = _BUILTIN_ENTRIES + [(name, skill_id) for skill_id, name in user_skill_names]
+    return KeywordMatcher(entries, normalize=_normalize_text)
 
 
 class PlannerAgent:
@@ -59,31 +80,21 @@ class PlannerAgent:
         return skill_ids
 
     def select_skills(self, task: str, user_skills: List[Any] = None) -> List[str]:
-        lowered = task.lower()
         selected: List[str] = []
         all_skill_ids = self._get_all_skill_ids(user_skills)
+        user_skill_names = tuple((skill.id, skill.name or "") for skill in user_skills or [])
+        # 一次扫描同时匹配内置技能关键词和用户技能名称
+        hits = _skill_matcher(user_skill_names).search(task)
 
         # 内置技能关键词匹配
-        if _has_any(lowered, TRANSLATOR_KEYWORDS):
-            if "translator" in all_skill_ids:
-                selected.append("translator")
-        if _has_any(lowered, ANTI_SCAM_KEYWORDS) or "scam" in lowered:
-            if "anti_scam" in all_skill_ids:
-                selected.append("anti_scam")
-        if _has_any(lowered, DOUDIZHU_KEYWORDS) or "doudizhu" in lowered:
-            if "doudizhu" in all_skill_ids:
-                selected.append("doudizhu")
-        if _has_any(lowered, PHOTO_COMPOSITION_KEYWORDS):
-            if "photo_composition" in all_skill_ids:
-                selected.append("photo_composition")
+        for skill_id, _ in BUILTIN_SKILL_KEYWORDS:
+            if skill_id in hits and skill_id in all_skill_ids:
+                selected.append(skill_id)
 
         # 用户技能名称匹配
-        if user_skills:
-            for skill in user_skills:
-                if skill.id not in selected:
-                    skill_name_normalized = _normalize_text(skill.name)
-                    if skill_name_normalized in _normalize_text(lowered):
-                        selected.append(skill.id)
+        for skill_id, _ in user_skill_names:
+            if skill_id in hits and skill_id not in selected:
+                selected.append(skill_id)
 
         return selected
 
@@ -100,10 +111,73 @@ class PlannerAgent:
                 return agent
         return None
 
+    def route(
+        self,
+        task: str,
+        user_agents: Optional[List[dict]] = None,
+        user_skills: Optional[List[Any]] = None,
+    ) -> Dict[str, Any]:
+        """本地路由：关键词命中 + 意图分类器，给出技能选择及其置信度。
+
+        - 关键词唯一命中一个技能时置信度为 planner_keyword_confidence，分类器结论一致时两者合并
+        - 没有关键词命中时置信度为 0：分类器没有"不需要技能"的类别（训练样本只来自选中了技能的任务），
+          对普通的手机操作也总会给出某个技能，因此不能单独作为跳过 Planner 的依据
+        - 关键词命中多个技能、或关键词与分类器结论冲突时置信度降低
+        - 有用户智能体但名称未命中时置信度为 0（智能体只能由 Planner 模型按描述选择）
+        - 有用户技能但一个都未命中时置信度同样为 0（用户技能也可能需要按描述选择）
+        """
+        user_agents = user_agents or []
+        keyword_skills = self.select_skills(task, user_skills)
+        selected_agent = self.select_user_agent(task, user_agents)
+
+        label, label_confidence = None, 0.0
+        classifier = get_intent_classifier()
+        if classifier is not None:
+            label, label_confidence = classifier.predict(task)
+            if label not in self._get_all_skill_ids(user_skills):
+                label, label_confidence = None, 0.0
+
+        keyword_confidence = settings.planner_keyword_confidence if len(keyword_skills) == 1 else 0.0
+        if len(keyword_skills) > 1:
+            skills, confidence = keyword_skills, 0.0
+        elif keyword_skills and label in (None, keyword_skills[0]):
+            skills = keyword_skills
+            confidence = 1 - (1 - keyword_confidence) * (1 - label_confidence)
+        elif keyword_skills:
+            skills, confidence = keyword_skills, keyword_confidence * (1 - label_confidence)
+        else:
+            skills, confidence = ([label] if label else []), 0.0
+        if user_agents and not selected_agent:
+            confidence = 0.0
+        user_skill_ids = {skill.id for skill in user_skills or []}
+        if user_skill_ids and not user_skill_ids.intersection(skills):
+            confidence = 0.0
+
+        return {
+            "skills": skills,
+            "agent": selected_agent,
+            "confidence": confidence,
+            "keyword_skills": keyword_skills,
+            "classifier_label": label,
+            "classifier_confidence": label_confidence,
+        }
+
+    def fast_path(
+        self,
+        task: str,
+        user_agents: Optional[List[dict]] = None,
+        user_skills: Optional[List[Any]] = None,
+    ) -> tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """返回 (路由结果, 规划结果)；置信度达到阈值时规划结果非空，可跳过 Planner 模型调用"""
+        decision = self.route(task, user_agents, user_skills)
+        if not settings.planner_fast_path_enabled or decision["confidence"] < settings.planner_fast_path_threshold:
+            return decision, None
+        return decision, {"plan": self.plan(task), "skills": decision["skills"], "agent": decision["agent"]}
+
     def plan(self, task: str) -> List[str]:
         return [f"分析任务: {task}", "执行已选技能", "汇报动作"]
 
-    def run(
+    async def run(
         self,
         task: str,
         user_agents: Optional[List[dict]] = None,
@@ -114,7 +188,7 @@ class PlannerAgent:
         user_skills = user_skills or []
         if model_config and model_config.get("base_url") and model_config.get("api_key") and model_config.get("model"):
             logger.info(f"Planner 使用模型规划: {model_config.get('model')} @ {model_config.get('base_url')}")
-            selected = self._run_with_model(task, user_agents, model_config, user_skills)
+            selected = await self._run_with_model(task, user_agents, model_config, user_skills)
             if selected:
                 logger.info(f"Planner 模型规划成功, 选择技能: {selected.get('skills')}, 智能体: {selected.get('agent', {}).get('id') if selected.get('agent') else None}")
                 return selected
@@ -129,9 +203,31 @@ class PlannerAgent:
             "plan": self.plan(task),
             "skills": selected_skills,
             "agent": selected_agent,
+            # 关键词回退结果，调用方不应缓存
+            "fallback": True,
         }
 
-    def _run_with_model(
+    def log_routing(self, task: str, decision: Dict[str, Any], result: Dict[str, Any], fast_path: bool) -> None:
+        """记录本地路由与最终规划结果，用于离线评估路由准确率和调整阈值"""
+        agent = result.get("agent")
+        log_payload(
+            routing_logger,
+            "Planner 路由：",
+            {
+                "task": task,
+                "fast_path": fast_path,
+                "confidence": round(decision["confidence"], 4),
+                "route_skills": decision["skills"],
+                "keyword_skills": decision["keyword_skills"],
+                "classifier_label": decision["classifier_label"],
+                "classifier_confidence": round(decision["classifier_confidence"], 4),
+                "planner_skills": result.get("skills"),
+                "planner_agent": agent.get("id") if agent else None,
+            },
+            always_full=True,
+        )
+
+    async def _run_with_model(
         self,
         task: str,
         user_agents: List[dict],
@@ -167,12 +263,14 @@ class PlannerAgent:
             {"role": "user", "content": task},
         ]
         logger.debug(f"Planner 调用模型, 可用技能数={len(all_skills_data)}, 用户智能体数={len(agent_choices)}")
-        response = model_client.chat_completions(
-            base_url=model_config["base_url"],
-            api_key=model_config["api_key"],
-            model=model_config["model"],
-            messages=messages,
-        )
+        with metrics.timer("planner_latency_seconds"):
+            response = await model_client.achat_completions(
+                base_url=model_config["base_url"],
+                api_key=model_config["api_key"],
+                model=model_config["model"],
+                messages=messages,
+                config=model_config.get("config"),
+            )
         raw = model_client.extract_content(response) or ""
         logger.debug(f"Planner 模型原始响应 (前500字符): {raw[:500] if raw else '(空)'}")
 
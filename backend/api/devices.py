@@ -4,7 +4,7 @@ import json
 import logging
 from typing import Any, Literal
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Path
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, Response
 from pydantic import BaseModel, ConfigDict, Field
 from sqlalchemy import func, select
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
@@ -12,6 +12,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.connection import get_session
 from db.models import Device, ModelConfig
+from utils import cache_bus
+from utils.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -188,10 +190,16 @@ async def get_device(
 
 @router.get("/api/devices", response_model=list[DeviceResponse])
 async def list_devices(
+    response: Response,
     user_id: int | None = Query(None, description="按用户 ID 过滤"),
     status: Literal[1, 0] | None = Query(None, description="按状态过滤"),
+    order_by: Literal["last_seen", "device_id"] = Query(
+        "last_seen",
+        description="排序方式；device_id 升序时支持游标分页",
+    ),
     limit: int = Query(100, ge=1, le=500, description="最大返回数量"),
-    offset: int = Query(0, ge=0, description="跳过的结果数量"),
+    offset: int = Query(0, ge=0, description="跳过的结果数量（大表请改用 order_by=device_id + cursor）"),
+    cursor: str | None = Query(None, description=f"上一页响应头 {NEXT_CURSOR_HEADER} 中的游标"),
     session: AsyncSession = Depends(get_session),
 ) -> list[Device]:
     stmt = select(Device)
@@ -199,9 +207,25 @@ async def list_devices(
         stmt = stmt.where(Device.user_id == user_id)
     if status is not None:
         stmt = stmt.where(Device.status == status)
-    stmt = stmt.order_by(Device.last_seen.desc()).limit(limit).offset(offset)
+    if order_by == "last_seen":
+        # last_seen 随心跳变化，不适合作为游标
+        if cursor is not None:
+            raise HTTPException(status_code=400, detail="游标分页需要 order_by=device_id")
+        stmt = stmt.order_by(Device.last_seen.desc()).limit(limit).offset(offset)
+        result = await session.execute(stmt)
+        return list(result.scalars().all())
+
+    if cursor is not None and offset:
+        raise HTTPException(status_code=400, detail="cursor 与 offset 不能同时使用")
+    if cursor is not None:
+        (after_device_id,) = decode_cursor(cursor, 1)
+        stmt = stmt.where(Device.device_id > after_device_id)
+    stmt = stmt.order_by(Device.device_id).limit(limit).offset(offset)
     result = await session.execute(stmt)
-    return list(result.scalars().all())
+    devices = list(result.scalars().all())
+    if len(devices) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(devices[-1].device_id)
+    return devices
 
 
 @router.put("/api/devices/{device_id}", response_model=DeviceResponse)
@@ -308,6 +332,7 @@ async def set_device_default_model(
         logger.exception(f"为设备 {device_id} 设置默认模型时发生完整性错误")
         raise HTTPException(status_code=422, detail="设置默认模型失败: 违反数据库约束")
 
+    await cache_bus.invalidate_device(device_id)
     return _to_response(model_config)
 
 
@@ -373,6 +398,7 @@ async def set_device_manager_model(
         logger.exception(f"为设备 {device_id} 设置规划模型时发生完整性错误")
         raise HTTPException(status_code=422, detail="设置规划模型失败: 违反数据库约束")
 
+    await cache_bus.invalidate_device(device_id)
     return _to_response(model_config)
 
 
@@ -396,6 +422,7 @@ async def delete_device_manager_model(
         await session.delete(model_config)
         try:
             await session.commit()
+            await cache_bus.invalidate_device(device_id)
             logger.info(f"设备 {device_id} 的规划模型配置已删除")
         except SQLAlchemyError:
             await session.rollback()
@@ -1,14 +1,45 @@
 from __future__ import annotations
 
+import resource
+import sys
+
 from fastapi import APIRouter, HTTPException
 from sqlalchemy import text
 
 from db.connection import async_engine
 from db.redis_client import get_redis
+from utils.response_cache import skill_response_cache
+from utils.session_store import plan_cache, session_store
 
 router = APIRouter()
 
 
+def _rss_bytes() -> int:
+    """当前进程常驻内存；无法读取 /proc 时退回峰值 RSS。"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 单位为字节，Linux 为 KB
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _memory_stats() -> dict:
+    return {
+        "rss_bytes": _rss_bytes(),
+        "session_store": session_store.stats(),
+        "plan_cache": plan_cache.stats(),
+        "skill_response_cache": skill_response_cache.stats(),
+    }
+
+
+@router.get("/api/health/memory")
+async def health_memory() -> dict:
+    return {"memory": _memory_stats()}
+
+
 @router.get("/api/health/db")
 async def health_db() -> dict:
     try:
@@ -51,4 +82,5 @@ async def health_all() -> dict:
     if errors:
         raise HTTPException(status_code=503, detail={"status": results, "errors": errors})
 
+    results["memory"] = _memory_stats()
     return results
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from utils.device_config import device_config_cache
+from utils.metrics import metrics
+from utils.response_cache import skill_response_cache
+from utils.session_store import plan_cache
+
+router = APIRouter()
+
+_CACHES = {
+    "plan": plan_cache,
+    "device_config": device_config_cache,
+    "skill_response": skill_response_cache,
+}
+
+
+def _cache_stat(field: str) -> dict:
+    return {name: cache.stats()[field] for name, cache in _CACHES.items()}
+
+
+metrics.register_gauge("cache_hit_ratio", lambda: _cache_stat("hit_ratio"), label="cache", help_text="本进程缓存命中率")
+metrics.register_gauge("cache_entries", lambda: _cache_stat("entries"), label="cache", help_text="本进程缓存条目数")
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -12,6 +12,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.connection import get_session
 from db.models import ModelConfig
+from utils import cache_bus
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -202,6 +203,7 @@ async def create_model_config(
         await session.rollback()
         logger.exception("创建模型配置时发生完整性错误")
         raise HTTPException(status_code=422, detail="创建模型配置失败: 违反数据库约束")
+    await cache_bus.invalidate_device(config.owner_device_id)
     return _to_response(config)
 
 
@@ -218,6 +220,7 @@ async def update_model_config(
         updates["config"] = _dump_config_value(updates["config"])
 
     config = await _get_model_config_or_404(session, config_id)
+    previous_owner = config.owner_device_id
     for key, value in updates.items():
         setattr(config, key, value)
 
@@ -228,6 +231,9 @@ async def update_model_config(
         await session.rollback()
         logger.exception(f"更新模型配置 {config_id} 时发生完整性错误")
         raise HTTPException(status_code=422, detail="更新模型配置失败: 违反数据库约束")
+    await cache_bus.invalidate_device(previous_owner)
+    if config.owner_device_id != previous_owner:
+        await cache_bus.invalidate_device(config.owner_device_id)
     return _to_response(config)
 
 
@@ -244,4 +250,5 @@ async def delete_model_config(
         await session.rollback()
         logger.exception(f"删除模型配置 {config_id} 时发生完整性错误")
         raise HTTPException(status_code=422, detail="删除模型配置失败: 违反数据库约束")
+    await cache_bus.invalidate_device(config.owner_device_id)
     return {"status": "deleted", "id": config_id}
@@ -12,7 +12,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.connection import get_session
 from db.models import Skill
-from skills.user_loader import clear_user_skills_cache
+from utils import cache_bus
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -117,10 +117,7 @@ async def create_skill(
         raise HTTPException(status_code=422, detail="创建技能失败: 违反数据库约束")
 
     # 清除设备或全局缓存
-    if skill.owner_device_id:
-        clear_user_skills_cache(skill.owner_device_id)
-    else:
-        clear_user_skills_cache()
+    await cache_bus.invalidate_device(skill.owner_device_id or None)
 
     return skill
 
@@ -151,7 +148,7 @@ async def update_skill(
         raise HTTPException(status_code=422, detail="更新技能失败: 违反数据库约束")
 
     # 清除技能所有者缓存
-    clear_user_skills_cache(skill.owner_device_id or device_id)
+    await cache_bus.invalidate_device(skill.owner_device_id or device_id)
 
     return skill
 
@@ -174,6 +171,6 @@ async def delete_skill(
         raise HTTPException(status_code=422, detail="删除技能失败: 违反数据库约束")
 
     # 清除技能所有者缓存
-    clear_user_skills_cache(skill.owner_device_id or device_id)
+    await cache_bus.invalidate_device(skill.owner_device_id or device_id)
 
     return {"status": "deleted", "skill_id": skill_id}
@@ -4,14 +4,17 @@ import logging
 from datetime import datetime
 from typing import Any, Literal
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Path
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, ConfigDict, Field
-from sqlalchemy import case, func, select
+from sqlalchemy import and_, func, or_, select
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.connection import get_session
-from db.models import DeviceSession, UsageLog
+from db.models import DeviceSession, SkillInvocation, UsageLog
+from db.usage_rollups import query_usage_stats
+from utils.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, stream_export
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -23,6 +26,9 @@ class UsageLogCreate(BaseModel):
     status: Literal[1, 0]
     task_text: str | None = None
     execution_ms: int | None = Field(None, ge=0)
+    prompt_tokens: int = Field(0, ge=0)
+    completion_tokens: int = Field(0, ge=0)
+    cached_tokens: int = Field(0, ge=0)
 
 
 class UsageLogResponse(BaseModel):
@@ -34,6 +40,9 @@ class UsageLogResponse(BaseModel):
     task_text: str | None
     status: int
     execution_ms: int | None
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
     created_at: Any
 
 
@@ -47,9 +56,25 @@ class UsageLogStatsResponse(BaseModel):
     success_count: int
     failure_count: int
     avg_execution_ms: float | None
+    p50_execution_ms: float | None
+    p95_execution_ms: float | None
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
     top_skills: list[TopSkill]
 
 
+class TokenUsageGroup(BaseModel):
+    key: str
+    count: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    total_tokens: int
+    avg_tokens: float
+    cached_ratio: float
+
+
 class DeviceSessionCreate(BaseModel):
     session_id: str = Field(..., min_length=1, max_length=36)
     device_id: str = Field(..., min_length=1, max_length=36)
@@ -87,6 +112,9 @@ async def create_usage_log(
         status=payload.status,
         task_text=payload.task_text,
         execution_ms=payload.execution_ms,
+        prompt_tokens=payload.prompt_tokens,
+        completion_tokens=payload.completion_tokens,
+        cached_tokens=payload.cached_tokens,
     )
     session.add(usage_log)
     try:
@@ -99,31 +127,80 @@ async def create_usage_log(
     return usage_log
 
 
+def _usage_log_filters(
+    device_id: str | None,
+    skill_id: str | None,
+    status: int | None,
+    start_date: datetime | None,
+    end_date: datetime | None,
+) -> list[Any]:
+    filters = []
+    if device_id is not None:
+        filters.append(UsageLog.device_id == device_id)
+    if skill_id is not None:
+        filters.append(UsageLog.skill_id == skill_id)
+    if status is not None:
+        filters.append(UsageLog.status == status)
+    if start_date is not None:
+        filters.append(UsageLog.created_at >= start_date)
+    if end_date is not None:
+        filters.append(UsageLog.created_at <= end_date)
+    return filters
+
+
 @router.get("/api/usage-logs", response_model=list[UsageLogResponse])
 async def list_usage_logs(
+    response: Response,
     device_id: str | None = Query(None, description="按设备 ID 过滤"),
     skill_id: str | None = Query(None, description="按技能 ID 过滤"),
     status: Literal[1, 0] | None = Query(None, description="按状态过滤"),
     start_date: datetime | None = Query(None, description="筛选在此日期之后创建的日志"),
     end_date: datetime | None = Query(None, description="筛选在此日期之前创建的日志"),
     limit: int = Query(100, ge=1, le=500, description="最大返回数量"),
-    offset: int = Query(0, ge=0, description="跳过的结果数量"),
+    offset: int = Query(0, ge=0, description="跳过的结果数量（大表请改用 cursor）"),
+    cursor: str | None = Query(None, description=f"上一页响应头 {NEXT_CURSOR_HEADER} 中的游标"),
     session: AsyncSession = Depends(get_session),
 ) -> list[UsageLog]:
-    stmt = select(UsageLog)
-    if device_id is not None:
-        stmt = stmt.where(UsageLog.device_id == device_id)
-    if skill_id is not None:
-        stmt = stmt.where(UsageLog.skill_id == skill_id)
-    if status is not None:
-        stmt = stmt.where(UsageLog.status == status)
-    if start_date is not None:
-        stmt = stmt.where(UsageLog.created_at >= start_date)
-    if end_date is not None:
-        stmt = stmt.where(UsageLog.created_at <= end_date)
-    stmt = stmt.order_by(UsageLog.created_at.desc()).limit(limit).offset(offset)
+    """按 (created_at, id) 倒序返回日志。
+
+    还有下一页时在响应头 X-Next-Cursor 中返回游标，按游标翻页的开销与页码无关。
+    """
+    if cursor is not None and offset:
+        raise HTTPException(status_code=400, detail="cursor 与 offset 不能同时使用")
+    stmt = select(UsageLog).where(*_usage_log_filters(device_id, skill_id, status, start_date, end_date))
+    if cursor is not None:
+        created_at, log_id = decode_cursor(cursor, 2)
+        stmt = stmt.where(
+            or_(
+                UsageLog.created_at < created_at,
+                and_(UsageLog.created_at == created_at, UsageLog.id < log_id),
+            )
+        )
+    stmt = stmt.order_by(UsageLog.created_at.desc(), UsageLog.id.desc()).limit(limit).offset(offset)
     result = await session.execute(stmt)
-    return list(result.scalars().all())
+    logs = list(result.scalars().all())
+    if len(logs) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(logs[-1].created_at, logs[-1].id)
+    return logs
+
+
+@router.get("/api/usage-logs/export")
+async def export_usage_logs(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format", description="导出格式"),
+    device_id: str | None = Query(None, description="按设备 ID 过滤"),
+    skill_id: str | None = Query(None, description="按技能 ID 过滤"),
+    status: Literal[1, 0] | None = Query(None, description="按状态过滤"),
+    start_date: datetime | None = Query(None, description="筛选在此日期之后创建的日志"),
+    end_date: datetime | None = Query(None, description="筛选在此日期之前创建的日志"),
+) -> StreamingResponse:
+    """流式导出日志（按 id 升序），不在内存中组装完整结果"""
+    columns = list(UsageLogResponse.model_fields)
+    stmt = (
+        select(*(getattr(UsageLog, column) for column in columns))
+        .where(*_usage_log_filters(device_id, skill_id, status, start_date, end_date))
+        .order_by(UsageLog.id)
+    )
+    return stream_export(stmt, columns, export_format, "usage_logs")
 
 
 @router.get("/api/usage-logs/stats", response_model=UsageLogStatsResponse)
@@ -134,47 +211,92 @@ async def get_usage_log_stats(
     end_date: datetime | None = Query(None, description="筛选在此日期之前创建的日志"),
     session: AsyncSession = Depends(get_session),
 ) -> UsageLogStatsResponse:
-    filters = []
-    if device_id is not None:
-        filters.append(UsageLog.device_id == device_id)
-    if skill_id is not None:
-        filters.append(UsageLog.skill_id == skill_id)
-    if start_date is not None:
-        filters.append(UsageLog.created_at >= start_date)
-    if end_date is not None:
-        filters.append(UsageLog.created_at <= end_date)
-
-    stats_stmt = select(
-        func.count(UsageLog.id).label("total_count"),
-        func.sum(case((UsageLog.status == 1, 1), else_=0)).label("success_count"),
-        func.sum(case((UsageLog.status == 0, 1), else_=0)).label("failure_count"),
-        func.avg(UsageLog.execution_ms).label("avg_execution_ms"),
+    stats = await query_usage_stats(
+        session,
+        device_id=device_id,
+        skill_id=skill_id,
+        start_date=start_date,
+        end_date=end_date,
     )
-    if filters:
-        stats_stmt = stats_stmt.where(*filters)
-    stats_row = (await session.execute(stats_stmt)).one()
+    counters = stats.counters
+    top_skills = sorted(stats.skill_counts.items(), key=lambda item: item[1], reverse=True)[:10]
 
-    avg_execution_ms = stats_row.avg_execution_ms
-    if avg_execution_ms is not None:
-        avg_execution_ms = float(avg_execution_ms)
-
-    top_stmt = select(
-        UsageLog.skill_id,
-        func.count(UsageLog.id).label("count"),
+    return UsageLogStatsResponse(
+        total_count=counters["total_count"],
+        success_count=counters["success_count"],
+        failure_count=counters["failure_count"],
+        avg_execution_ms=stats.avg_execution_ms,
+        p50_execution_ms=stats.percentile(0.5),
+        p95_execution_ms=stats.percentile(0.95),
+        prompt_tokens=counters["prompt_tokens"],
+        completion_tokens=counters["completion_tokens"],
+        cached_tokens=counters["cached_tokens"],
+        top_skills=[TopSkill(skill_id=skill, count=count) for skill, count in top_skills],
     )
-    if filters:
-        top_stmt = top_stmt.where(*filters)
-    top_stmt = top_stmt.group_by(UsageLog.skill_id).order_by(func.count(UsageLog.id).desc()).limit(10)
-    top_result = await session.execute(top_stmt)
-    top_skills = [TopSkill(skill_id=row.skill_id, count=row.count) for row in top_result.all()]
 
-    return UsageLogStatsResponse(
-        total_count=int(stats_row.total_count or 0),
-        success_count=int(stats_row.success_count or 0),
-        failure_count=int(stats_row.failure_count or 0),
-        avg_execution_ms=avg_execution_ms,
-        top_skills=top_skills,
+
+@router.get("/api/usage-logs/token-stats", response_model=list[TokenUsageGroup])
+async def get_token_usage_stats(
+    group_by: Literal["skill", "device", "day"] = Query("skill", description="分组维度"),
+    source: Literal["task", "skill"] = Query(
+        "task",
+        description="task=按任务统计（含 Planner/Executor，来自 usage_logs）；skill=只统计技能自身的模型调用（来自 skill_invocations）",
+    ),
+    device_id: str | None = Query(None, description="按设备 ID 过滤"),
+    skill_id: str | None = Query(None, description="按技能 ID 过滤"),
+    start_date: datetime | None = Query(None, description="筛选在此日期之后创建的日志"),
+    end_date: datetime | None = Query(None, description="筛选在此日期之前创建的日志"),
+    limit: int = Query(50, ge=1, le=500, description="最大返回数量"),
+    session: AsyncSession = Depends(get_session),
+) -> list[TokenUsageGroup]:
+    """按技能、设备或日期汇总 token 用量，按总 token 数降序"""
+    model = UsageLog if source == "task" else SkillInvocation
+    if group_by == "skill":
+        key_column = model.skill_id
+    elif group_by == "device":
+        key_column = model.device_id
+    else:
+        key_column = func.date(model.created_at)
+
+    total_tokens = func.sum(model.prompt_tokens + model.completion_tokens)
+    stmt = select(
+        key_column.label("key"),
+        func.count(model.id).label("count"),
+        func.sum(model.prompt_tokens).label("prompt_tokens"),
+        func.sum(model.completion_tokens).label("completion_tokens"),
+        func.sum(model.cached_tokens).label("cached_tokens"),
+        total_tokens.label("total_tokens"),
     )
+    if device_id is not None:
+        stmt = stmt.where(model.device_id == device_id)
+    if skill_id is not None:
+        stmt = stmt.where(model.skill_id == skill_id)
+    if start_date is not None:
+        stmt = stmt.where(model.created_at >= start_date)
+    if end_date is not None:
+        stmt = stmt.where(model.created_at <= end_date)
+    stmt = stmt.group_by(key_column).order_by(total_tokens.desc()).limit(limit)
+    rows = (await session.execute(stmt)).all()
+
+    groups = []
+    for row in rows:
+        count = int(row.count or 0)
+        prompt_tokens = int(row.prompt_tokens or 0)
+        cached_tokens = int(row.cached_tokens or 0)
+        total = int(row.total_tokens or 0)
+        groups.append(
+            TokenUsageGroup(
+                key=str(row.key),
+                count=count,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=int(row.completion_tokens or 0),
+                cached_tokens=cached_tokens,
+                total_tokens=total,
+                avg_tokens=total / count if count else 0.0,
+                cached_ratio=cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+            )
+        )
+    return groups
 
 
 @router.post("/api/device-sessions", response_model=DeviceSessionResponse, status_code=201)
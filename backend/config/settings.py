@@ -24,6 +24,71 @@ class Settings(BaseSettings):
     redis_db: int = 0
     admin_session_ttl_seconds: int = 60 * 60 * 24
     admin_session_secure_cookie: bool = False
+    model_http_timeout_seconds: float = 60.0
+    model_http_max_connections: int = 100
+    model_http_max_keepalive_connections: int = 20
+    model_http_keepalive_expiry: float = 30.0
+    model_http2: bool = True  # 需安装可选依赖 h2，未安装时使用 HTTP/1.1
+    model_stream_actions: bool = True
+    model_max_concurrency_per_provider: int = 16
+    model_min_concurrency_per_provider: int = 1
+    model_rate_limit_per_second: float = 0.0  # 0 表示不限速
+    model_rate_limit_burst: int = 10
+    model_max_retries: int = 2
+    model_retry_base_delay_seconds: float = 0.5
+    model_retry_max_delay_seconds: float = 8.0
+    model_circuit_failure_threshold: int = 5
+    model_circuit_cooldown_seconds: float = 30.0
+    model_latency_window: int = 200
+    model_hedge_min_samples: int = 20
+    model_hedge_min_delay_ms: int = 200
+    model_hedge_default_delay_ms: int = 3000
+    skill_max_concurrency: int = 4
+    speculative_executor: bool = True
+    session_store_backend: str = "memory"  # memory | redis
+    session_max_messages: int = 10
+    session_history_ttl_seconds: int = 60 * 60 * 24
+    session_max_sessions: int = 10000
+    session_idle_ttl_seconds: int = 60 * 60 * 2
+    session_sweep_interval_seconds: int = 60
+    plan_cache_backend: str = "memory"  # memory | redis
+    plan_cache_max_entries: int = 2048
+    plan_cache_ttl_seconds: int = 3600
+    # 截图发送给模型前的预处理（0 表示不限制）
+    screenshot_max_side: int = 1280
+    screenshot_format: str = "jpeg"  # jpeg | webp | png
+    screenshot_quality: int = 80
+    screenshot_max_bytes: int = 300_000
+    device_config_cache_ttl_seconds: int = 30
+    device_config_cache_max_entries: int = 4096
+    cache_bus_enabled: bool = True
+    cache_bus_channel: str = "cache:invalidate"
+    usage_log_queue_size: int = 10000
+    usage_log_batch_size: int = 200
+    usage_log_flush_interval_seconds: float = 1.0
+    # 使用日志按小时/按天汇总（统计接口读取汇总表 + 尚未汇总的尾部）
+    usage_rollup_enabled: bool = True
+    usage_rollup_interval_seconds: float = 30.0
+    usage_rollup_batch_size: int = 5000
+    usage_rollup_settle_seconds: int = 10
+    # 技能模型响应缓存（仅对声明了缓存时长的技能生效）
+    skill_cache_backend: str = "memory"  # memory | redis
+    skill_cache_max_entries: int = 1024
+    # Planner 快速路由：关键词 + 本地分类器置信度达到阈值时跳过 Planner 模型调用
+    planner_fast_path_enabled: bool = True
+    planner_fast_path_threshold: float = 0.85
+    # 须低于阈值：仅关键词命中不足以跳过 Planner，还需要分类器结论一致
+    planner_keyword_confidence: float = 0.6
+    intent_classifier_path: str = ""
+    # WS / 模型载荷日志（后台线程序列化，大载荷按比例采样）
+    payload_log_sample_rate: float = 0.1
+    payload_log_max_chars: int = 8000
+    payload_log_queue_size: int = 10000
+    # OpenTelemetry 链路追踪（需要安装 opentelemetry-sdk）
+    tracing_enabled: bool = False
+    tracing_exporter: str = "console"  # console | file | otlp
+    tracing_file_path: str = "traces.jsonl"
+    tracing_service_name: str = "phone-agent-backend"
 
     class Config:
         env_file = ".env"
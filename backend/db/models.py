@@ -158,6 +158,7 @@ class UsageLog(Base):
         Index("idx_usage_logs_device_time", "device_id", "created_at"),
         Index("idx_usage_logs_skill_time", "skill_id", "created_at"),
         Index("idx_usage_logs_status_time", "status", "created_at"),
+        Index("idx_usage_logs_created", "created_at"),
         {
             "mysql_charset": settings.db_charset,
             "mysql_collate": settings.db_collation,
@@ -171,6 +172,9 @@ class UsageLog(Base):
     task_text: Mapped[str | None] = mapped_column(Text)
     status: Mapped[int] = mapped_column(TINYINT, nullable=False)
     execution_ms: Mapped[int | None] = mapped_column(Integer)
+    prompt_tokens: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    completion_tokens: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    cached_tokens: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
     created_at: Mapped[object] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 
@@ -193,6 +197,9 @@ class SkillInvocation(Base):
     task_text: Mapped[str | None] = mapped_column(Text)
     status: Mapped[int] = mapped_column(TINYINT, nullable=False)
     execution_ms: Mapped[int | None] = mapped_column(Integer)
+    prompt_tokens: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    completion_tokens: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    cached_tokens: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
     created_at: Mapped[object] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 
@@ -216,3 +223,78 @@ class DeviceSession(Base):
     disconnected_at: Mapped[object | None] = mapped_column(DateTime(timezone=True))
     ip_address: Mapped[str | None] = mapped_column(String(45))
     user_agent: Mapped[str | None] = mapped_column(String(255))
+
+
+class UsageRollup(Base):
+    __tablename__ = "usage_rollups"
+    __table_args__ = (
+        Index("uq_usage_rollups_bucket", "granularity", "bucket_start", "device_id", "skill_id", unique=True),
+        Index("idx_usage_rollups_skill", "granularity", "skill_id", "bucket_start"),
+        Index("idx_usage_rollups_device", "granularity", "device_id", "bucket_start"),
+        {
+            "mysql_charset": settings.db_charset,
+            "mysql_collate": settings.db_collation,
+            "mysql_comment": "使用日志按小时/按天汇总（设备 + 技能）",
+        },
+    )
+
+    id: Mapped[int] = mapped_column(BIGINT(unsigned=True), primary_key=True, autoincrement=True)
+    granularity: Mapped[str] = mapped_column(String(8), nullable=False)  # hour | day
+    bucket_start: Mapped[object] = mapped_column(DateTime(timezone=True), nullable=False)
+    device_id: Mapped[str] = mapped_column(String(36), nullable=False)
+    skill_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    total_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    success_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    failure_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    execution_ms_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    execution_ms_sum: Mapped[int] = mapped_column(BIGINT(unsigned=True), nullable=False, server_default="0")
+    prompt_tokens: Mapped[int] = mapped_column(BIGINT(unsigned=True), nullable=False, server_default="0")
+    completion_tokens: Mapped[int] = mapped_column(BIGINT(unsigned=True), nullable=False, server_default="0")
+    cached_tokens: Mapped[int] = mapped_column(BIGINT(unsigned=True), nullable=False, server_default="0")
+
+
+class UsageRollupLatency(Base):
+    __tablename__ = "usage_rollup_latency"
+    __table_args__ = (
+        Index(
+            "uq_usage_rollup_latency_bucket",
+            "granularity",
+            "bucket_start",
+            "device_id",
+            "skill_id",
+            "le_ms",
+            unique=True,
+        ),
+        Index("idx_usage_rollup_latency_skill", "granularity", "skill_id", "bucket_start"),
+        Index("idx_usage_rollup_latency_device", "granularity", "device_id", "bucket_start"),
+        {
+            "mysql_charset": settings.db_charset,
+            "mysql_collate": settings.db_collation,
+            "mysql_comment": "使用日志执行耗时直方图（按汇总区间）",
+        },
+    )
+
+    id: Mapped[int] = mapped_column(BIGINT(unsigned=True), primary_key=True, autoincrement=True)
+    granularity: Mapped[str] = mapped_column(String(8), nullable=False)
+    bucket_start: Mapped[object] = mapped_column(DateTime(timezone=True), nullable=False)
+    device_id: Mapped[str] = mapped_column(String(36), nullable=False)
+    skill_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    le_ms: Mapped[int] = mapped_column(Integer, nullable=False)  # 桶上界（毫秒）
+    count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+
+
+class UsageRollupState(Base):
+    __tablename__ = "usage_rollup_state"
+    __table_args__ = {
+        "mysql_charset": settings.db_charset,
+        "mysql_collate": settings.db_collation,
+        "mysql_comment": "汇总进度（已汇总到的原始日志 ID）",
+    }
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    last_id: Mapped[int] = mapped_column(BIGINT(unsigned=True), nullable=False, server_default="0")
+    updated_at: Mapped[object | None] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        server_onupdate=func.now(),
+    )
@@ -0,0 +1,418 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, case, func, or_, select, text, true
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import settings
+from db.connection import AsyncSessionLocal
+from db.models import UsageLog, UsageRollup, UsageRollupLatency, UsageRollupState
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_STATE_NAME = "usage_logs"
+GRANULARITIES = ("hour", "day")
+# 执行耗时直方图的桶上界（毫秒），超出最后一个上界的记入溢出桶
+LATENCY_BUCKETS_MS = (
+    50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 15000, 20000, 30000, 60000, 120000,
+)
+LATENCY_OVERFLOW_MS = 2**31 - 1
+_COUNTER_FIELDS = (
+    "total_count",
+    "success_count",
+    "failure_count",
+    "execution_ms_count",
+    "execution_ms_sum",
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_tokens",
+)
+
+_Range = Tuple[Optional[datetime], Optional[datetime]]
+
+
+def latency_bucket(execution_ms: int) -> int:
+    """耗时所在桶的上界（le）"""
+    index = bisect.bisect_left(LATENCY_BUCKETS_MS, execution_ms)
+    return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else LATENCY_OVERFLOW_MS
+
+
+def histogram_percentile(histogram: Dict[int, int], quantile: float) -> Optional[float]:
+    """按 {桶上界: 数量} 估算分位数（桶内线性插值；落在溢出桶时返回最后一个上界）"""
+    total = sum(histogram.values())
+    if total <= 0:
+        return None
+    rank = quantile * total
+    cumulative = 0
+    lower = 0
+    for upper in sorted(histogram):
+        count = histogram[upper]
+        if count and cumulative + count >= rank:
+            if upper == LATENCY_OVERFLOW_MS:
+                return float(lower)
+            return lower + (upper - lower) * (rank - cumulative) / count
+        cumulative += count
+        if upper != LATENCY_OVERFLOW_MS:
+            lower = upper
+    return float(lower)
+
+
+def truncate(value: datetime, granularity: str) -> datetime:
+    value = value.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        value = value.replace(hour=0)
+    return value
+
+
+def _ceil(value: datetime, granularity: str) -> datetime:
+    floored = truncate(value, granularity)
+    if floored == value:
+        return floored
+    return floored + (timedelta(days=1) if granularity == "day" else timedelta(hours=1))
+
+
+def plan_ranges(
+    start: Optional[datetime],
+    end: Optional[datetime],
+) -> Tuple[Dict[str, List[_Range]], List[_Range]]:
+    """把 [start, end] 拆成可直接读汇总表的整区间和需要查原始表的边缘。
+
+    返回 ({粒度: [[lo, hi), ...]}, 原始表区间)；None 表示不限。
+    原始表区间中最后一段包含 end 本身，其余为左闭右开。
+    """
+    hour_lo = _ceil(start, "hour") if start is not None else None
+    hour_hi = truncate(end, "hour") if end is not None else None
+    if hour_lo is not None and hour_hi is not None and hour_lo >= hour_hi:
+        return {"hour": [], "day": []}, [(start, end)]
+
+    raw: List[_Range] = []
+    if start is not None and start < hour_lo:
+        raw.append((start, hour_lo))
+    if end is not None:
+        raw.append((hour_hi, end))
+
+    day_lo = _ceil(start, "day") if start is not None else None
+    day_hi = truncate(end, "day") if end is not None else None
+    if day_lo is not None and day_hi is not None and day_lo >= day_hi:
+        return {"hour": [(hour_lo, hour_hi)], "day": []}, raw
+
+    hours: List[_Range] = []
+    if day_lo is not None and hour_lo < day_lo:
+        hours.append((hour_lo, day_lo))
+    if day_hi is not None and day_hi < hour_hi:
+        hours.append((day_hi, hour_hi))
+    return {"hour": hours, "day": [(day_lo, day_hi)]}, raw
+
+
+@dataclass
+class _Totals:
+    counters: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(_COUNTER_FIELDS, 0))
+    latency: Dict[int, int] = field(default_factory=dict)
+
+    def add(self, row: Any) -> None:
+        counters = self.counters
+        counters["total_count"] += 1
+        if row.status == 1:
+            counters["success_count"] += 1
+        else:
+            counters["failure_count"] += 1
+        if row.execution_ms is not None:
+            counters["execution_ms_count"] += 1
+            counters["execution_ms_sum"] += row.execution_ms
+            bucket = latency_bucket(row.execution_ms)
+            self.latency[bucket] = self.latency.get(bucket, 0) + 1
+        counters["prompt_tokens"] += row.prompt_tokens or 0
+        counters["completion_tokens"] += row.completion_tokens or 0
+        counters["cached_tokens"] += row.cached_tokens or 0
+
+
+def aggregate_rows(rows: Sequence[Any]) -> Dict[Tuple[str, datetime, str, str], _Totals]:
+    """把原始日志按 (粒度, 区间开始, 设备, 技能) 汇总"""
+    groups: Dict[Tuple[str, datetime, str, str], _Totals] = {}
+    for row in rows:
+        for granularity in GRANULARITIES:
+            key = (granularity, truncate(row.created_at, granularity), row.device_id, row.skill_id)
+            totals = groups.get(key)
+            if totals is None:
+                totals = groups[key] = _Totals()
+            totals.add(row)
+    return groups
+
+
+class UsageRollupAggregator:
+    """后台增量汇总 usage_logs。
+
+    按 id 顺序读取水位线之后的原始日志，累加到按小时/按天的汇总表（ON DUPLICATE KEY UPDATE），
+    并在同一事务中推进水位线。水位线行加锁，多实例部署时同一时间只有一个实例在汇总。
+    创建时间不足 settle 秒的记录暂不汇总，避免并发事务晚提交的较小 id 被跳过。
+    """
+
+    def __init__(self, interval_seconds: float, batch_size: int, settle_seconds: int) -> None:
+        self._interval_seconds = interval_seconds
+        self._batch_size = max(1, batch_size)
+        self._settle_seconds = max(0, settle_seconds)
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if not settings.usage_rollup_enabled:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await self.run_once()
+            except Exception:
+                processed = 0
+                metrics.incr("usage_rollup_errors_total")
+                logger.exception("汇总使用日志失败")
+            # 有积压时立即处理下一批
+            if processed < self._batch_size:
+                await asyncio.sleep(self._interval_seconds)
+
+    async def run_once(self) -> int:
+        """汇总一批原始日志，返回处理的条数"""
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                state = await _lock_state(session)
+                settled = UsageLog.created_at < func.date_sub(
+                    func.now(), text(f"INTERVAL {self._settle_seconds} SECOND")
+                )
+                stmt = (
+                    select(
+                        UsageLog.id,
+                        UsageLog.device_id,
+                        UsageLog.skill_id,
+                        UsageLog.status,
+                        UsageLog.execution_ms,
+                        UsageLog.prompt_tokens,
+                        UsageLog.completion_tokens,
+                        UsageLog.cached_tokens,
+                        UsageLog.created_at,
+                        settled.label("settled"),
+                    )
+                    .where(UsageLog.id > state.last_id)
+                    .order_by(UsageLog.id)
+                    .limit(self._batch_size)
+                )
+                rows = []
+                for row in (await session.execute(stmt)).all():
+                    if not row.settled:
+                        break
+                    rows.append(row)
+                if not rows:
+                    return 0
+                await _apply(session, aggregate_rows(rows))
+                state.last_id = rows[-1].id
+        metrics.incr("usage_rollup_rows_total", len(rows))
+        return len(rows)
+
+
+async def _lock_state(session: AsyncSession) -> UsageRollupState:
+    stmt = select(UsageRollupState).where(UsageRollupState.name == _STATE_NAME).with_for_update()
+    state = (await session.execute(stmt)).scalar_one_or_none()
+    if state is None:
+        await session.execute(insert(UsageRollupState).prefix_with("IGNORE").values(name=_STATE_NAME, last_id=0))
+        state = (await session.execute(stmt)).scalar_one()
+    return state
+
+
+async def _apply(session: AsyncSession, groups: Dict[Tuple[str, datetime, str, str], _Totals]) -> None:
+    rollup_rows = []
+    latency_rows = []
+    for (granularity, bucket_start, device_id, skill_id), totals in groups.items():
+        key = {"granularity": granularity, "bucket_start": bucket_start, "device_id": device_id, "skill_id": skill_id}
+        rollup_rows.append({**key, **totals.counters})
+        for le_ms, count in totals.latency.items():
+            latency_rows.append({**key, "le_ms": le_ms, "count": count})
+
+    stmt = insert(UsageRollup)
+    await session.execute(
+        stmt.on_duplicate_key_update(
+            {name: getattr(UsageRollup, name) + getattr(stmt.inserted, name) for name in _COUNTER_FIELDS}
+        ),
+        rollup_rows,
+    )
+    if latency_rows:
+        stmt = insert(UsageRollupLatency)
+        await session.execute(
+            stmt.on_duplicate_key_update(count=UsageRollupLatency.count + stmt.inserted.count),
+            latency_rows,
+        )
+
+
+@dataclass
+class UsageStats:
+    counters: Dict[str, int]
+    latency: Dict[int, int]
+    skill_counts: Dict[str, int]
+
+    @property
+    def avg_execution_ms(self) -> Optional[float]:
+        count = self.counters["execution_ms_count"]
+        return self.counters["execution_ms_sum"] / count if count else None
+
+    def percentile(self, quantile: float) -> Optional[float]:
+        return histogram_percentile(self.latency, quantile)
+
+    def add_counters(self, skill_id: str, row: Any) -> None:
+        for name in _COUNTER_FIELDS:
+            self.counters[name] += int(getattr(row, name) or 0)
+        self.skill_counts[skill_id] = self.skill_counts.get(skill_id, 0) + int(row.total_count or 0)
+
+    def add_latency(self, le_ms: int, count: int) -> None:
+        self.latency[int(le_ms)] = self.latency.get(int(le_ms), 0) + int(count or 0)
+
+
+def _in_range(column: Any, lo: Optional[datetime], hi: Optional[datetime], inclusive: bool = False) -> Any:
+    conditions = []
+    if lo is not None:
+        conditions.append(column >= lo)
+    if hi is not None:
+        conditions.append(column <= hi if inclusive else column < hi)
+    return and_(true(), *conditions)
+
+
+async def query_usage_stats(
+    session: AsyncSession,
+    *,
+    device_id: Optional[str] = None,
+    skill_id: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> UsageStats:
+    """汇总统计：整区间读汇总表，边缘和尚未汇总的记录读原始表。
+
+    汇总未启用或尚未开始汇总时全部读原始表。
+    """
+    stats = UsageStats(dict.fromkeys(_COUNTER_FIELDS, 0), {}, {})
+
+    watermark = 0
+    if settings.usage_rollup_enabled:
+        watermark = (
+            await session.execute(select(UsageRollupState.last_id).where(UsageRollupState.name == _STATE_NAME))
+        ).scalar_one_or_none() or 0
+
+    raw_filters = [_in_range(UsageLog.created_at, start_date, end_date, inclusive=True)]
+    if device_id is not None:
+        raw_filters.append(UsageLog.device_id == device_id)
+    if skill_id is not None:
+        raw_filters.append(UsageLog.skill_id == skill_id)
+
+    if not watermark:
+        await _add_raw(session, stats, raw_filters)
+        return stats
+
+    rollup_ranges, raw_ranges = plan_ranges(start_date, end_date)
+    await _add_rollups(session, stats, rollup_ranges, device_id, skill_id)
+    # 原始表分成互不重叠的几段分别查询（每段都能走索引）：
+    # 水位线之后尚未汇总的记录，以及不构成整小时的区间边缘
+    await _add_raw(session, stats, [*raw_filters, UsageLog.id > watermark])
+    last = len(raw_ranges) - 1
+    for index, (lo, hi) in enumerate(raw_ranges):
+        edge = _in_range(UsageLog.created_at, lo, hi, inclusive=index == last and end_date is not None)
+        await _add_raw(session, stats, [*raw_filters, edge, UsageLog.id <= watermark])
+    return stats
+
+
+def _rollup_filters(
+    model: Any,
+    rollup_ranges: Dict[str, List[_Range]],
+    device_id: Optional[str],
+    skill_id: Optional[str],
+) -> List[Any]:
+    buckets = [
+        and_(model.granularity == granularity, _in_range(model.bucket_start, lo, hi))
+        for granularity, ranges in rollup_ranges.items()
+        for lo, hi in ranges
+    ]
+    filters = [or_(*buckets)]
+    if device_id is not None:
+        filters.append(model.device_id == device_id)
+    if skill_id is not None:
+        filters.append(model.skill_id == skill_id)
+    return filters
+
+
+async def _add_rollups(
+    session: AsyncSession,
+    stats: UsageStats,
+    rollup_ranges: Dict[str, List[_Range]],
+    device_id: Optional[str],
+    skill_id: Optional[str],
+) -> None:
+    if not any(rollup_ranges.values()):
+        return
+    stmt = (
+        select(UsageRollup.skill_id, *(func.sum(getattr(UsageRollup, name)).label(name) for name in _COUNTER_FIELDS))
+        .where(*_rollup_filters(UsageRollup, rollup_ranges, device_id, skill_id))
+        .group_by(UsageRollup.skill_id)
+    )
+    for row in (await session.execute(stmt)).all():
+        stats.add_counters(row.skill_id, row)
+
+    stmt = (
+        select(UsageRollupLatency.le_ms, func.sum(UsageRollupLatency.count).label("count"))
+        .where(*_rollup_filters(UsageRollupLatency, rollup_ranges, device_id, skill_id))
+        .group_by(UsageRollupLatency.le_ms)
+    )
+    for row in (await session.execute(stmt)).all():
+        stats.add_latency(row.le_ms, row.count)
+
+
+async def _add_raw(session: AsyncSession, stats: UsageStats, filters: List[Any]) -> None:
+    stmt = (
+        select(
+            UsageLog.skill_id,
+            func.count(UsageLog.id).label("total_count"),
+            func.sum(case((UsageLog.status == 1, 1), else_=0)).label("success_count"),
+            func.sum(case((UsageLog.status == 0, 1), else_=0)).label("failure_count"),
+            func.count(UsageLog.execution_ms).label("execution_ms_count"),
+            func.sum(UsageLog.execution_ms).label("execution_ms_sum"),
+            func.sum(UsageLog.prompt_tokens).label("prompt_tokens"),
+            func.sum(UsageLog.completion_tokens).label("completion_tokens"),
+            func.sum(UsageLog.cached_tokens).label("cached_tokens"),
+        )
+        .where(*filters)
+        .group_by(UsageLog.skill_id)
+    )
+    for row in (await session.execute(stmt)).all():
+        stats.add_counters(row.skill_id, row)
+
+    # 与汇总表相同的分桶，在数据库中完成计数
+    le_ms = case(
+        *((UsageLog.execution_ms <= bound, bound) for bound in LATENCY_BUCKETS_MS),
+        else_=LATENCY_OVERFLOW_MS,
+    ).label("le_ms")
+    stmt = (
+        select(le_ms, func.count(UsageLog.id).label("count"))
+        .where(*filters, UsageLog.execution_ms.is_not(None))
+        .group_by(le_ms)
+    )
+    for row in (await session.execute(stmt)).all():
+        stats.add_latency(row.le_ms, row.count)
+
+
+usage_rollup_aggregator = UsageRollupAggregator(
+    interval_seconds=settings.usage_rollup_interval_seconds,
+    batch_size=settings.usage_rollup_batch_size,
+    settle_seconds=settings.usage_rollup_settle_seconds,
+)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple, Type
+
+from sqlalchemy import insert
+
+from config.settings import settings
+from db.connection import AsyncSessionLocal
+from db.models import SkillInvocation, UsageLog
+from utils.metrics import metrics
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_Row = Tuple[Type[Any], Dict[str, Any]]
+
+
+class UsageLogWriter:
+    """使用日志的异步批量写入（write-behind）。
+
+    请求路径只把记录放入有界队列，不等待数据库；后台任务按条数或时间阈值
+    以多行 INSERT 批量写入。队列满时丢弃新记录并计数，关闭时写完队列中剩余记录。
+    """
+
+    def __init__(self, max_queue_size: int, batch_size: int, flush_interval_seconds: float) -> None:
+        self._max_queue_size = max(1, max_queue_size)
+        self._batch_size = max(1, batch_size)
+        self._flush_interval_seconds = flush_interval_seconds
+        self._queue: asyncio.Queue[_Row] | None = None
+        self._worker: asyncio.Task | None = None
+        self._closing = False
+        # 已从队列取出、尚未写入（或计入丢弃）的记录；关闭超时取消后台任务时一并计为丢弃
+        self._in_hand: List[_Row] = []
+
+    def start(self) -> None:
+        if self._worker is not None and not self._worker.done():
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._max_queue_size)
+        self._closing = False
+        self._worker = asyncio.create_task(self._run())
+
+    def add_usage_log(self, **values: Any) -> None:
+        self._enqueue(UsageLog, values)
+
+    def add_skill_invocation(self, **values: Any) -> None:
+        self._enqueue(SkillInvocation, values)
+
+    def _enqueue(self, model: Type[Any], values: Dict[str, Any]) -> None:
+        if self._closing:
+            metrics.incr("usage_log_dropped_total")
+            return
+        if self._worker is None or self._worker.done():
+            self.start()
+        try:
+            self._queue.put_nowait((model, values))
+        except asyncio.QueueFull:
+            metrics.incr("usage_log_dropped_total")
+            logger.warning("使用日志队列已满，丢弃一条记录")
+
+    async def _collect(self) -> List[_Row]:
+        batch: List[_Row] = []
+        self._in_hand = batch
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._flush_interval_seconds
+        while len(batch) < self._batch_size:
+            if self._closing:
+                # 关闭时不再等待，直接取走队列中剩余记录
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    break
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while not (self._closing and self._queue.empty()):
+            batch = await self._collect()
+            if batch:
+                await self._flush(batch)
+            self._in_hand = []
+
+    async def _flush(self, batch: List[_Row]) -> None:
+        rows_by_model: Dict[Type[Any], List[Dict[str, Any]]] = {}
+        for model, values in batch:
+            rows_by_model.setdefault(model, []).append(values)
+
+        with span("db.usage_log_flush", **{"db.rows": len(batch)}):
+            async with AsyncSessionLocal() as session:
+                try:
+                    for model, rows in rows_by_model.items():
+                        await session.execute(insert(model), rows)
+                    await session.commit()
+                except Exception:
+                    await session.rollback()
+                    metrics.incr("usage_log_dropped_total", len(batch))
+                    logger.exception(f"批量写入使用日志失败，丢弃 {len(batch)} 条记录")
+                    return
+        metrics.incr("usage_log_written_total", len(batch))
+
+    async def stop(self, timeout_seconds: float = 10.0) -> None:
+        """停止后台任务，先写完队列中剩余的记录（超时后放弃）。"""
+        if self._worker is None:
+            return
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._worker, timeout_seconds)
+        except asyncio.TimeoutError:
+            pending = (self._queue.qsize() if self._queue else 0) + len(self._in_hand)
+            self._in_hand = []
+            metrics.incr("usage_log_dropped_total", pending)
+            logger.warning(f"关闭时写入使用日志超时，丢弃 {pending} 条记录")
+        self._worker = None
+
+
+usage_writer = UsageLogWriter(
+    max_queue_size=settings.usage_log_queue_size,
+    batch_size=settings.usage_log_batch_size,
+    flush_interval_seconds=settings.usage_log_flush_interval_seconds,
+)
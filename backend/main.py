@@ -7,6 +7,7 @@ import logging
 from api.auth import router as auth_router
 from api.skills import router as skills_router
 from api.health import router as health_router
+from api.metrics import router as metrics_router
 from api.devices import router as devices_router
 from api.model_configs import router as model_configs_router
 from api.baidu_speech_configs import router as baidu_speech_configs_router
@@ -16,7 +17,14 @@ from config.settings import settings
 from websocket.server import register_websocket
 from db.connection import async_engine
 from db.redis_client import get_redis
+from db.usage_rollups import usage_rollup_aggregator
+from db.usage_writer import usage_writer
 from utils.auth_dependency import get_current_user
+from utils import cache_bus
+from utils import model_client
+from utils import payload_log
+from utils import session_store
+from utils import tracing
 from skills.builtin_loader import register_builtin_skills
 
 logging.basicConfig(
@@ -37,18 +45,33 @@ async def lifespan(app: FastAPI):
         logging.exception(f"加载内置技能失败: {e}")
         logging.warning("应用将继续启动，但内置技能可能不可用")
 
+    tracing.setup_tracing()
+    payload_log.start_listener()
+    session_store.start_sweeper()
+    cache_bus.start_listener()
+    usage_writer.start()
+    usage_rollup_aggregator.start()
+
     yield
 
     # 关闭
     logging.info("正在关闭...")
+    await cache_bus.stop_listener()
+    await usage_rollup_aggregator.stop()
+    await usage_writer.stop()
+    await session_store.stop_sweeper()
+    await model_client.aclose_clients()
     await async_engine.dispose()
     redis_client = get_redis()
     await redis_client.close()
+    payload_log.stop_listener()
+    tracing.shutdown_tracing()
 
 
 app = FastAPI(title=settings.app_name, lifespan=lifespan)
 app.include_router(auth_router)
 app.include_router(health_router)
+app.include_router(metrics_router)
 app.include_router(devices_router, dependencies=[Depends(get_current_user)])
 app.include_router(skills_router, dependencies=[Depends(get_current_user)])
 app.include_router(model_configs_router, dependencies=[Depends(get_current_user)])
@@ -11,6 +11,9 @@ USE xiaozhi;
 -- ============================================
 -- 清理已存在的表（按依赖顺序反向删除）
 -- ============================================
+DROP TABLE IF EXISTS usage_rollup_state;
+DROP TABLE IF EXISTS usage_rollup_latency;
+DROP TABLE IF EXISTS usage_rollups;
 DROP TABLE IF EXISTS device_sessions;
 DROP TABLE IF EXISTS skill_invocations;
 DROP TABLE IF EXISTS usage_logs;
@@ -112,10 +115,14 @@ CREATE TABLE usage_logs (
   task_text TEXT NULL COMMENT '任务描述文本',
   status TINYINT NOT NULL COMMENT '执行状态：1=成功，0=失败',
   execution_ms INT UNSIGNED NULL COMMENT '执行耗时（毫秒）',
+  prompt_tokens INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '输入 token 数（整个任务，含 Planner/Executor）',
+  completion_tokens INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '输出 token 数',
+  cached_tokens INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '命中服务端提示词缓存的输入 token 数',
   created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '记录时间',
   INDEX idx_usage_logs_device_time (device_id, created_at),
   INDEX idx_usage_logs_skill_time (skill_id, created_at),
-  INDEX idx_usage_logs_status_time (status, created_at)
+  INDEX idx_usage_logs_status_time (status, created_at),
+  INDEX idx_usage_logs_created (created_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='使用日志表（统计和审计）';
 
 -- 技能调用日志表（用于统计执行耗时 + 频率）
@@ -126,6 +133,9 @@ CREATE TABLE skill_invocations (
   task_text TEXT NULL COMMENT '任务描述文本',
   status TINYINT NOT NULL COMMENT '执行状态：1=成功，0=失败',
   execution_ms INT UNSIGNED NULL COMMENT '执行耗时（毫秒）',
+  prompt_tokens INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '输入 token 数（该技能的模型调用）',
+  completion_tokens INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '输出 token 数',
+  cached_tokens INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '命中服务端提示词缓存的输入 token 数',
   created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '记录时间',
   INDEX idx_skill_invocations_device_time (device_id, created_at),
   INDEX idx_skill_invocations_skill_time (skill_id, created_at),
@@ -146,10 +156,54 @@ CREATE TABLE device_sessions (
   INDEX idx_device_sessions_connected (connected_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='设备会话表（WebSocket连接跟踪）';
 
+-- 使用日志汇总表（按小时/按天，设备 + 技能；由后台任务增量维护）
+CREATE TABLE usage_rollups (
+  id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY COMMENT '汇总ID',
+  granularity VARCHAR(8) NOT NULL COMMENT '汇总粒度：hour / day',
+  bucket_start TIMESTAMP NOT NULL COMMENT '区间开始时间',
+  device_id CHAR(36) NOT NULL COMMENT '设备ID',
+  skill_id VARCHAR(64) NOT NULL COMMENT '技能ID',
+  total_count INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '任务数',
+  success_count INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '成功数',
+  failure_count INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '失败数',
+  execution_ms_count INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '有耗时记录的任务数',
+  execution_ms_sum BIGINT UNSIGNED NOT NULL DEFAULT 0 COMMENT '耗时合计（毫秒）',
+  prompt_tokens BIGINT UNSIGNED NOT NULL DEFAULT 0 COMMENT '输入 token 合计',
+  completion_tokens BIGINT UNSIGNED NOT NULL DEFAULT 0 COMMENT '输出 token 合计',
+  cached_tokens BIGINT UNSIGNED NOT NULL DEFAULT 0 COMMENT '缓存命中 token 合计',
+  UNIQUE KEY uq_usage_rollups_bucket (granularity, bucket_start, device_id, skill_id),
+  INDEX idx_usage_rollups_skill (granularity, skill_id, bucket_start),
+  INDEX idx_usage_rollups_device (granularity, device_id, bucket_start)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='使用日志汇总表（按小时/按天）';
+
+-- 使用日志执行耗时直方图（与 usage_rollups 同粒度，用于计算 p50/p95）
+CREATE TABLE usage_rollup_latency (
+  id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY COMMENT '记录ID',
+  granularity VARCHAR(8) NOT NULL COMMENT '汇总粒度：hour / day',
+  bucket_start TIMESTAMP NOT NULL COMMENT '区间开始时间',
+  device_id CHAR(36) NOT NULL COMMENT '设备ID',
+  skill_id VARCHAR(64) NOT NULL COMMENT '技能ID',
+  le_ms INT UNSIGNED NOT NULL COMMENT '直方图桶上界（毫秒）',
+  count INT UNSIGNED NOT NULL DEFAULT 0 COMMENT '落入该桶的任务数',
+  UNIQUE KEY uq_usage_rollup_latency_bucket (granularity, bucket_start, device_id, skill_id, le_ms),
+  INDEX idx_usage_rollup_latency_skill (granularity, skill_id, bucket_start),
+  INDEX idx_usage_rollup_latency_device (granularity, device_id, bucket_start)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='使用日志耗时直方图';
+
+-- 汇总进度（已汇总到的 usage_logs.id）
+CREATE TABLE usage_rollup_state (
+  name VARCHAR(64) NOT NULL PRIMARY KEY COMMENT '汇总任务名',
+  last_id BIGINT UNSIGNED NOT NULL DEFAULT 0 COMMENT '已汇总到的原始日志ID',
+  updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='使用日志汇总进度';
+
 -- ============================================
 -- 初始化数据
 -- ============================================
 
+-- 汇总进度
+INSERT INTO usage_rollup_state (name, last_id) VALUES ('usage_logs', 0);
+
 -- 默认管理员用户（密码：admin123）
 INSERT INTO users (id, username, password_hash, display_name, email, status)
 VALUES (1, 'admin', '$2b$12$Lko0kNY5oMejHZPRlbSkYuXmhaU2BCj0nquzSnYpH0iRgmTMXmuXK', '系统管理员', NULL, 1);
@@ -6,6 +6,7 @@ from config.skill_prompts import ANTI_SCAM_PROMPT
 from skills.base import Skill, SkillEffect, SkillResult, SkillSchemaMetadata
 from skills.model_helpers import call_skill_model
 from skills.registry import registry
+from utils.keyword_matcher import KeywordMatcher
 
 
 HIGH_RISK_KEYWORDS = (
@@ -28,9 +29,11 @@ def _normalize_text(text: str) -> str:
     return re.sub(r"\s+", "", text.lower())
 
 
-def _collect_hits(text: str, keywords: tuple[str, ...]) -> list[str]:
-    """收集文本中出现的所有关键词。"""
-    return [keyword for keyword in keywords if keyword and keyword in text]
+_RISK_MATCHER = KeywordMatcher(
+    [(keyword, "high") for keyword in HIGH_RISK_KEYWORDS]
+    + [(keyword, "medium") for keyword in MEDIUM_RISK_KEYWORDS],
+    normalize=_normalize_text,
+)
 
 
 class AntiScamSkill(Skill):
@@ -41,6 +44,7 @@ class AntiScamSkill(Skill):
         "中奖/退税/退款、冒充客服/公安/法院、刷单兼职、可疑链接/二维码、"
         "远程控制软件诱导等。任何涉及资金与账号安全的可疑内容都适用。"
     )
+    response_cache_ttl_seconds = 3600
     schema = SkillSchemaMetadata(
         input_schema={
             "$schema": "http://json-schema.org/draft-07/schema#",
@@ -82,20 +86,18 @@ class AntiScamSkill(Skill):
         version="1.0.0",
     )
 
-    def analyze(self, task: str, context: dict) -> SkillResult:
-        normalized = _normalize_text(task or "")
-        signals = []
-        signals.extend(_collect_hits(normalized, HIGH_RISK_KEYWORDS))
-        signals.extend(_collect_hits(normalized, MEDIUM_RISK_KEYWORDS))
+    async def analyze(self, task: str, context: dict) -> SkillResult:
+        hits = _RISK_MATCHER.search(task or "")
+        signals = hits.get("high", []) + hits.get("medium", [])
 
         risk_level = "low"
-        if any(keyword in normalized for keyword in HIGH_RISK_KEYWORDS):
+        if hits.get("high"):
             risk_level = "high"
         elif signals:
             risk_level = "medium"
 
         message = ""
-        parsed = call_skill_model(task, context, ANTI_SCAM_PROMPT)
+        parsed = await call_skill_model(task, context, ANTI_SCAM_PROMPT)
 
         if parsed:
             level_value = parsed.get("risk_level")
@@ -35,6 +35,8 @@ class Skill(ABC):
     icon: Optional[str] = None
     deletable: bool = False
     schema: SkillSchemaMetadata | None = None
+    # 模型响应缓存时长（秒），None 表示不缓存；仅适用于同样输入应得到同样结果的技能
+    response_cache_ttl_seconds: int | None = None
 
     def metadata(self) -> Dict[str, Any]:
         data = {
@@ -49,5 +51,5 @@ class Skill(ABC):
         return data
 
     @abstractmethod
-    def analyze(self, task: str, context: Dict[str, Any]) -> SkillResult:
+    async def analyze(self, task: str, context: Dict[str, Any]) -> SkillResult:
         raise NotImplementedError
@@ -16,6 +16,7 @@ class DoudizhuSkill(Skill):
         "分析斗地主牌局并给出出牌建议。适用于对局过程中的牌型判断、出牌时机、"
         "控牌与风险评估（地主/农民策略不同）。"
     )
+    response_cache_ttl_seconds = 600
     schema = SkillSchemaMetadata(
         input_schema={
             "$schema": "http://json-schema.org/draft-07/schema#",
@@ -57,11 +58,11 @@ class DoudizhuSkill(Skill):
         version="1.0.0",
     )
 
-    def analyze(self, task: str, context: dict) -> SkillResult:
+    async def analyze(self, task: str, context: dict) -> SkillResult:
         suggestion = "建议出最小单牌。"
         play_type = "single"
         risk = "medium"
-        parsed = call_skill_model(task, context, DOUDIZHU_PROMPT)
+        parsed = await call_skill_model(task, context, DOUDIZHU_PROMPT)
 
         if parsed:
             text_value = parsed.get("text")
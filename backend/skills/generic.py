@@ -26,6 +26,7 @@ class GenericSkill(Skill):
         effects: List[Dict[str, Any]] | None = None,
         sub_skills: List[Dict[str, Any]] | None = None,
         db_skill_id: str | None = None,
+        response_cache_ttl_seconds: int | None = None,
     ):
         self.id = skill_id
         self.name = name
@@ -37,6 +38,7 @@ class GenericSkill(Skill):
         self.default_effects = self._coerce_effects(effects or [])
         self.sub_skills = self._normalize_sub_skills(sub_skills)
         self.db_skill_id = db_skill_id
+        self.response_cache_ttl_seconds = response_cache_ttl_seconds
 
     def _coerce_effects(self, raw: Any) -> list[SkillEffect]:
         """将原始 effects 数据转换为 SkillEffect 对象。"""
@@ -91,7 +93,7 @@ class GenericSkill(Skill):
                 return fallback
         return None
 
-    def _execute_sub_skills(
+    async def _execute_sub_skills(
         self,
         task: str,
         context: Dict[str, Any],
@@ -128,7 +130,7 @@ class GenericSkill(Skill):
             # 调用子技能模型
             call_count["count"] += 1
             try:
-                parsed = call_skill_model(task, sub_context, system_prompt)
+                parsed = await call_skill_model(task, sub_context, system_prompt)
                 if parsed:
                     text_value = parsed.get("text") or parsed.get("message") or parsed.get("response")
                     if isinstance(text_value, str) and text_value.strip():
@@ -140,13 +142,13 @@ class GenericSkill(Skill):
 
         return effects, messages
 
-    def analyze(self, task: str, context: Dict[str, Any]) -> SkillResult:
+    async def analyze(self, task: str, context: Dict[str, Any]) -> SkillResult:
         """执行用户自定义技能。"""
         message = "已执行用户技能。"
         effects = list(self.default_effects)
 
         # 执行主技能
-        parsed = call_skill_model(task, context, self.system_prompt)
+        parsed = await call_skill_model(task, context, self.system_prompt)
 
         if parsed:
             text_value = parsed.get("text") or parsed.get("message") or parsed.get("response")
@@ -156,7 +158,7 @@ class GenericSkill(Skill):
 
         # 执行子技能
         if self.sub_skills:
-            sub_effects, sub_messages = self._execute_sub_skills(task, context)
+            sub_effects, sub_messages = await self._execute_sub_skills(task, context)
             effects.extend(sub_effects)
             if sub_messages:
                 if message == "已执行用户技能。":
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import asyncio
 from typing import Any, Dict, Optional
 import json
 
 from utils import model_client
+from utils.image_utils import Screenshot
+from utils.metrics import metrics
+from utils.response_cache import make_response_key, skill_response_cache
 from utils.validators import validate_model_config
 
 
@@ -25,7 +29,7 @@ def _extract_json(raw: str) -> Optional[Any]:
         return None
 
 
-def call_skill_model(
+async def call_skill_model(
     task: str,
     context: Dict[str, Any],
     system_prompt: str,
@@ -37,22 +41,46 @@ def call_skill_model(
     if not valid:
         return None
     content = [{"type": "text", "text": task}]
-    screenshot = context.get("screenshot")
-    if screenshot:
+    # 优先使用任务内共享的 Screenshot，避免每个技能重复解码和编码
+    image = context.get("screenshot_image") or Screenshot.coerce(context.get("screenshot"))
+
+    # 技能声明了缓存时长时，相同模型 + 提示词 + 任务 + 截图直接复用上次的结果
+    cache_ttl = context.get("response_cache_ttl")
+    cache_key = None
+    if cache_ttl:
+        digest = await asyncio.to_thread(lambda: image.digest) if image else None
+        cache_key = make_response_key(model_config, system_prompt, task, digest)
+        cached = await skill_response_cache.get(cache_key)
+        if cached is not None:
+            stats = context.get("model_call_stats")
+            if stats is not None:
+                stats["cache_hits"] = stats.get("cache_hits", 0) + 1
+            return cached
+
+    if image:
         content.append({
             "type": "image_url",
-            "image_url": {"url": f"data:image/jpeg;base64,{screenshot}"},
+            "image_url": {"url": await asyncio.to_thread(image.data_url)},
         })
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": content},
     ]
-    response = model_client.chat_completions(
-        base_url=model_config["base_url"],
-        api_key=model_config["api_key"],
-        model=model_config["model"],
-        messages=messages,
-    )
+    # 用户技能数量不固定，统一归为 user，避免指标标签无限增长
+    skill_id = str(context.get("skill_id") or "unknown")
+    skill_label = "user" if skill_id.startswith("user:") else skill_id
+    with metrics.timer("skill_model_latency_seconds", {"skill": skill_label}):
+        response = await model_client.achat_completions(
+            base_url=model_config["base_url"],
+            api_key=model_config["api_key"],
+            model=model_config["model"],
+            messages=messages,
+            config=model_config.get("config"),
+        )
     raw = model_client.extract_content(response) or ""
     parsed = _extract_json(raw)
-    return parsed if isinstance(parsed, dict) else None
+    if not isinstance(parsed, dict):
+        return None
+    if cache_key:
+        await skill_response_cache.set(cache_key, parsed, int(cache_ttl))
+    return parsed
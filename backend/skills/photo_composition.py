@@ -71,12 +71,12 @@ class PhotoCompositionSkill(Skill):
         version="1.0.0",
     )
 
-    def analyze(self, task: str, context: dict) -> SkillResult:
+    async def analyze(self, task: str, context: dict) -> SkillResult:
         screenshot = context.get("screenshot")
 
         # 如果有截图，尝试坐标模式（自动选择）
         if screenshot:
-            parsed = call_skill_model(task, context, PHOTO_COMPOSITION_COORDINATE_PROMPT)
+            parsed = await call_skill_model(task, context, PHOTO_COMPOSITION_COORDINATE_PROMPT)
             if parsed and all(k in parsed for k in ["x_norm", "y_norm", "confidence"]):
                 x_norm = parsed.get("x_norm")
                 y_norm = parsed.get("y_norm")
@@ -111,7 +111,7 @@ class PhotoCompositionSkill(Skill):
         region = "center"
         direction = "none"
         hint = "保持主体居中并保持画面水平。"
-        parsed = call_skill_model(task, context, PHOTO_COMPOSITION_PROMPT)
+        parsed = await call_skill_model(task, context, PHOTO_COMPOSITION_PROMPT)
 
         if parsed:
             region_value = parsed.get("region")
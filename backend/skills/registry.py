@@ -8,9 +8,16 @@ from skills.base import Skill
 class SkillRegistry:
     def __init__(self) -> None:
         self._skills: Dict[str, Skill] = {}
+        self._version = 0
+
+    @property
+    def version(self) -> int:
+        """注册表版本号，每次注册技能后递增，用于让依赖技能集合的缓存失效。"""
+        return self._version
 
     def register(self, skill: Skill) -> None:
         self._skills[skill.id] = skill
+        self._version += 1
 
     def get(self, skill_id: str) -> Skill:
         return self._skills[skill_id]
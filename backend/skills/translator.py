@@ -1,12 +1,20 @@
 from __future__ import annotations
 
+import asyncio
 import re
+from typing import Optional, Tuple
 
 from config.skill_prompts import TRANSLATOR_PROMPT
 from skills.base import Skill, SkillEffect, SkillResult, SkillSchemaMetadata
 from skills.model_helpers import call_skill_model
 from skills.registry import registry
-from utils.image_utils import crop_base64_image
+from utils.image_utils import Screenshot
+
+
+def _crop_screenshot(image: Screenshot, region: dict) -> Tuple[Optional[Screenshot], str]:
+    """裁剪并编码截图（CPU 密集，在线程中执行）。"""
+    cropped = image.crop(region)
+    return cropped, cropped.base64 if cropped else ""
 
 
 def _detect_language(text: str) -> str:
@@ -83,7 +91,7 @@ class TranslatorSkill(Skill):
         version="1.0.0",
     )
 
-    def analyze(self, task: str, context: dict) -> SkillResult:
+    async def analyze(self, task: str, context: dict) -> SkillResult:
         region = context.get("translation_region")
         screenshot = context.get("screenshot")
         needs_region = bool(screenshot) and not region and _is_generic_request(task)
@@ -93,14 +101,15 @@ class TranslatorSkill(Skill):
             return SkillResult(message="请选择要翻译的区域。", effects=effects)
 
         if screenshot and region:
-            cropped = crop_base64_image(screenshot, region)
+            image = context.get("screenshot_image") or Screenshot.coerce(screenshot)
+            cropped, cropped_base64 = await asyncio.to_thread(_crop_screenshot, image, region)
             if cropped:
-                context = {**context, "screenshot": cropped}
+                context = {**context, "screenshot": cropped_base64, "screenshot_image": cropped}
 
         text = ""
         source_language = ""
         target_language = ""
-        parsed = call_skill_model(task, context, TRANSLATOR_PROMPT)
+        parsed = await call_skill_model(task, context, TRANSLATOR_PROMPT)
 
         if parsed:
             parsed_text = parsed.get("text")
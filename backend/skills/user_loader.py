@@ -1,10 +1,9 @@
 from __future__ import annotations
 
 import logging
-from typing import List
+from typing import Iterable, List
 
 from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.models import Skill as SkillModel
 from skills.generic import GenericSkill
@@ -12,19 +11,10 @@ from utils.validators import validate_model_config
 
 logger = logging.getLogger(__name__)
 
-_user_skills_cache: dict[str, list[GenericSkill]] = {}
 
-
-async def load_user_skills(device_id: str | None, session: AsyncSession) -> List[GenericSkill]:
-    """从数据库加载用户自定义技能"""
-    if not device_id:
-        return []
-
-    if device_id in _user_skills_cache:
-        logger.debug(f"设备 {device_id} 的用户技能命中缓存")
-        return _user_skills_cache[device_id]
-
-    stmt = (
+def user_skills_query(device_id: str):
+    """设备自定义技能的查询语句（供批量加载复用）"""
+    return (
         select(SkillModel)
         .where(
             SkillModel.owner_device_id == device_id,
@@ -34,9 +24,9 @@ async def load_user_skills(device_id: str | None, session: AsyncSession) -> List
         .order_by(SkillModel.created_at.desc())
     )
 
-    result = await session.execute(stmt)
-    db_skills = result.scalars().all()
 
+def build_user_skills(db_skills: Iterable[SkillModel]) -> List[GenericSkill]:
+    """将数据库技能记录转换为 GenericSkill"""
     user_skills = []
     for db_skill in db_skills:
         definition = db_skill.definition or {}
@@ -55,6 +45,9 @@ async def load_user_skills(device_id: str | None, session: AsyncSession) -> List
 
         effects = definition.get("effects") or []
         sub_skills = definition.get("skills") or []
+        cache_ttl = definition.get("cache_ttl_seconds")
+        if not isinstance(cache_ttl, int) or isinstance(cache_ttl, bool) or cache_ttl <= 0:
+            cache_ttl = None
 
         generic_skill = GenericSkill(
             skill_id=f"user:{db_skill.id}",
@@ -66,28 +59,8 @@ async def load_user_skills(device_id: str | None, session: AsyncSession) -> List
             effects=effects,
             sub_skills=sub_skills,
             db_skill_id=db_skill.id,
+            response_cache_ttl_seconds=cache_ttl,
         )
         user_skills.append(generic_skill)
 
-    _user_skills_cache[device_id] = user_skills
-    logger.info(f"已为设备 {device_id} 加载 {len(user_skills)} 个用户技能")
-
     return user_skills
-
-
-def clear_user_skills_cache(device_id: str | None = None):
-    """清除用户技能缓存"""
-    global _user_skills_cache
-    if device_id:
-        _user_skills_cache.pop(device_id, None)
-        logger.info(f"已清除设备 {device_id} 的用户技能缓存")
-    else:
-        _user_skills_cache.clear()
-        logger.info("已清除所有用户技能缓存")
-
-
-def get_cached_user_skills(device_id: str | None) -> List[GenericSkill]:
-    """获取缓存的用户技能（不触发数据库查询）"""
-    if not device_id:
-        return []
-    return _user_skills_cache.get(device_id, [])
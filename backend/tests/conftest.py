@@ -4,3 +4,71 @@ from pathlib import Path
 backend_root = Path(__file__).resolve().parents[1]
 if str(backend_root) not in sys.path:
     sys.path.insert(0, str(backend_root))
+
+import asyncio
+import json
+
+import httpx
+import pytest
+import pytest_asyncio
+
+
+@pytest.fixture(autouse=True)
+def clear_plan_cache():
+    from utils.session_store import plan_cache
+
+    plan_cache.clear()
+    yield
+    plan_cache.clear()
+
+
+@pytest.fixture
+def model_config():
+    return {"base_url": "https://api.example.com/v1", "api_key": "sk-test", "model": "test-model"}
+
+
+@pytest_asyncio.fixture
+async def model_http(monkeypatch):
+    """让模型请求经过 httpx.MockTransport：model_http(handler) 安装并返回客户端，测试结束时关闭"""
+    from utils import model_client
+
+    clients = []
+
+    def install(handler, **client_kwargs):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler), **client_kwargs)
+        clients.append(client)
+        monkeypatch.setattr(model_client, "get_async_client", lambda base_url: client)
+        return client
+
+    yield install
+    for client in clients:
+        await client.aclose()
+
+
+@pytest.fixture
+def fake_model(model_http):
+    """按系统提示词区分 planner / executor / skill 调用的假模型服务，返回记录调用角色的列表。
+
+    planner 回复 planner_reply，其余调用回复 reply；流式请求以 SSE 返回，末尾附带 usage。
+    """
+
+    def install(planner_reply='{"skills": []}', reply='do(action="Home")', delay=0.0, usage=None):
+        calls = []
+
+        async def handler(request):
+            body = json.loads(request.content)
+            system_prompt = body["messages"][0]["content"]
+            role = "planner" if "规划器" in system_prompt else "executor" if "智能体分析专家" in system_prompt else "skill"
+            calls.append(role)
+            await asyncio.sleep(delay)
+            content = planner_reply if role == "planner" else reply
+            if not body.get("stream"):
+                return httpx.Response(200, json={"choices": [{"message": {"content": content}}], "usage": usage})
+            chunks = [{"choices": [{"delta": {"content": content}}]}, {"choices": [], "usage": usage}]
+            sse = "".join(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+            return httpx.Response(200, content=sse.encode("utf-8"), headers={"content-type": "text/event-stream"})
+
+        model_http(handler)
+        return calls
+
+    return install
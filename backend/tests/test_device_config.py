@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from utils import device_config
+from utils.device_config import DeviceConfigCache, DeviceRuntimeConfig
+
+
+@pytest.mark.asyncio
+async def test_device_config_cache_coalesces_loads_and_invalidates(monkeypatch):
+    loads = []
+
+    async def fake_load(device_id):
+        loads.append(device_id)
+        await asyncio.sleep(0.01)
+        return DeviceRuntimeConfig(default_model={"model": f"m{len(loads)}"})
+
+    monkeypatch.setattr(device_config, "load_device_runtime_config", fake_load)
+    cache = DeviceConfigCache(max_entries=8, ttl_seconds=60)
+
+    first, second = await asyncio.gather(cache.get("d1"), cache.get("d1"))
+    assert first is second
+    assert await cache.get("d1") is first
+    assert loads == ["d1"]
+
+    cache.invalidate("d1")
+    refreshed = await cache.get("d1")
+    assert refreshed.default_model == {"model": "m2"}
+    assert loads == ["d1", "d1"]
+
+
+@pytest.mark.asyncio
+async def test_cache_bus_applies_remote_invalidations_only(monkeypatch):
+    import json
+
+    from utils import cache_bus
+
+    loads = []
+
+    async def fake_load(device_id):
+        loads.append(device_id)
+        return DeviceRuntimeConfig()
+
+    monkeypatch.setattr(device_config, "load_device_runtime_config", fake_load)
+    cache = DeviceConfigCache(max_entries=8, ttl_seconds=60)
+    cache_bus.subscribe(cache.invalidate)
+    try:
+        await cache.get("d1")
+        await cache.get("d2")
+
+        # 本进程发布的消息已在发布前处理，收到时忽略
+        cache_bus._handle_message(json.dumps({"device_id": "d1", "origin": cache_bus._WORKER_ID}))
+        await cache.get("d1")
+        assert loads == ["d1", "d2"]
+
+        cache_bus._handle_message(json.dumps({"device_id": "d1", "origin": "other-worker"}))
+        await cache.get("d1")
+        await cache.get("d2")
+        assert loads == ["d1", "d2", "d1"]
+    finally:
+        cache_bus.unsubscribe(cache.invalidate)
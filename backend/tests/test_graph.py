@@ -1,7 +1,246 @@
-from agents.graph import run_task
+import pytest
+
+from agents.graph import arun_task, run_task
 
 
 def test_run_task_returns_effects_for_translation():
     result = run_task({"task": "请翻译"})
     assert "effects" in result
     assert any(effect["type"] == "translation" for effect in result["effects"])
+
+
+@pytest.mark.asyncio
+async def test_arun_task_runs_inside_event_loop():
+    result = await arun_task({"task": "请翻译"})
+    assert result["done"] is True
+    assert any(effect["type"] == "translation" for effect in result["effects"])
+
+
+def test_compiled_graph_is_reused_until_registry_changes():
+    from agents.graph import get_graph
+    from skills.registry import registry
+    from utils.metrics import metrics
+
+    graph = get_graph()
+    compiles = metrics.get("graph_compiles_total")
+    assert get_graph() is graph
+    assert metrics.get("graph_compiles_total") == compiles
+
+    registry.register(registry.get("translator"))
+    assert get_graph() is not graph
+    assert metrics.get("graph_compiles_total") == compiles + 1
+
+
+class _SleepySkill:
+    def __init__(self, skill_id, name, delay, fail=False):
+        self.id = skill_id
+        self.name = name
+        self.description = name
+        self.model_config = None
+        self._delay = delay
+        self._fail = fail
+
+    async def analyze(self, task, context):
+        import asyncio
+
+        from skills.base import SkillEffect, SkillResult
+
+        await asyncio.sleep(self._delay)
+        if self._fail:
+            raise RuntimeError("boom")
+        return SkillResult(message=self.name, effects=[SkillEffect(type="overlay", payload={"text": self.name})])
+
+
+@pytest.mark.asyncio
+async def test_selected_skills_run_concurrently_and_merge_in_order():
+    import gc
+    import time
+
+    user_skills = [
+        _SleepySkill("user:1", "甲技能", 0.2),
+        _SleepySkill("user:2", "乙技能", 0.05),
+        _SleepySkill("user:3", "丙技能", 0.1, fail=True),
+    ]
+    # 避免测试集较大时完整 GC 落在计时区间内
+    gc.collect()
+    start = time.perf_counter()
+    result = await arun_task({"task": "甲技能 乙技能 丙技能", "user_skills": user_skills})
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.3
+    assert [effect["payload"]["text"] for effect in result["effects"]] == ["甲技能", "乙技能"]
+    timings = {timing["skill_id"]: timing for timing in result["skill_timings"]}
+    assert timings["user:1"]["status"] == 1
+    assert timings["user:3"]["status"] == 0
+    assert timings["user:3"]["error"] == "boom"
+
+
+@pytest.mark.asyncio
+async def test_executor_runs_speculatively_alongside_planner(fake_model, model_config):
+    import time
+
+    calls = fake_model(delay=0.2)
+    start = time.perf_counter()
+    result = await arun_task({"task": "打开设置", "default_model": model_config})
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.35
+    assert sorted(calls) == ["executor", "planner"]
+    assert result["actions"] == [{"_metadata": "do", "action": "Home"}]
+
+
+@pytest.mark.asyncio
+async def test_speculative_executor_is_discarded_when_plan_overrides_it(monkeypatch, fake_model, model_config):
+    from config.settings import settings
+
+    monkeypatch.setattr(settings, "planner_fast_path_enabled", False)
+    calls = fake_model('{"skills": ["translator"]}', delay=0.05)
+    result = await arun_task({"task": "翻译这段话", "default_model": model_config})
+
+    assert calls.count("executor") == 1
+    assert result["actions"] == []
+    assert any(effect["type"] == "translation" for effect in result["effects"])
+
+
+@pytest.fixture
+def translation_classifier():
+    from utils import intent_classifier
+    from utils.intent_classifier import IntentClassifier
+
+    samples = [("帮我翻译这段话", "translator"), ("把菜单翻成中文", "translator"), ("这手牌该怎么打", "doudizhu")]
+    intent_classifier.set_intent_classifier(IntentClassifier.train(samples * 3))
+    yield
+    intent_classifier.set_intent_classifier(None)
+
+
+@pytest.mark.asyncio
+async def test_confident_local_route_skips_planner_model(fake_model, model_config, translation_classifier):
+    calls = fake_model()
+    result = await arun_task({"task": "帮我翻译这段话", "default_model": model_config})
+
+    assert "planner" not in calls
+    assert result["selected_skills"] == ["translator"]
+
+
+@pytest.mark.asyncio
+async def test_keyword_hit_with_competing_user_skill_goes_through_planner(
+    fake_model, model_config, translation_classifier
+):
+    from utils import intent_classifier
+
+    calls = fake_model('{"skills": ["user:1"]}')
+    user_skills = [_SleepySkill("user:1", "合同审阅", 0.0)]
+    result = await arun_task({"task": "帮我翻译这段话", "default_model": model_config, "user_skills": user_skills})
+
+    # 用户技能可能按描述更匹配，交给 Planner 模型决定
+    assert "planner" in calls
+    assert result["selected_skills"] == ["user:1"]
+
+    # 仅有关键词命中、分类器没有给出结论时同样不走快速路由
+    intent_classifier.set_intent_classifier(None)
+    calls = fake_model()
+    await arun_task({"task": "帮我翻译这段话", "default_model": model_config})
+    assert "planner" in calls
+
+
+@pytest.mark.asyncio
+async def test_plan_cache_is_scoped_by_planner_model_and_skill_descriptions(monkeypatch, fake_model, model_config):
+    from config.settings import settings
+    from utils import cache_bus
+
+    monkeypatch.setattr(settings, "cache_bus_enabled", False)
+    skill = _SleepySkill("user:1", "合同审阅", 0.0)
+
+    async def planner_calls(payload):
+        calls = fake_model('{"skills": ["user:1"]}')
+        await arun_task({"task": "打开设置", "user_skills": [skill], **payload})
+        return calls.count("planner")
+
+    assert await planner_calls({"default_model": model_config}) == 1
+    assert await planner_calls({"default_model": model_config}) == 0
+    # 不同的 Planner 模型不共享规划结果
+    assert await planner_calls({"default_model": model_config, "manager_model": {**model_config, "model": "other"}}) == 1
+    # 修改技能描述后不再命中旧的规划结果
+    skill.description = "审阅合同条款"
+    assert await planner_calls({"default_model": model_config}) == 1
+    # 配置变更的失效消息会清除本地规划缓存
+    await cache_bus.invalidate_device("device-1")
+    assert await planner_calls({"default_model": model_config}) == 1
+
+    # Planner 模型返回无法解析的结果时回退到关键词匹配，回退结果不缓存
+    for _ in range(2):
+        calls = fake_model("不是 JSON")
+        await arun_task({"task": "打开相册", "default_model": model_config})
+        assert calls.count("planner") == 1
+
+
+@pytest.mark.asyncio
+async def test_actions_are_streamed_before_slow_skills_finish(fake_model, model_config):
+    import time
+
+    fake_model('{"skills": ["user:1"]}', delay=0.01)
+    events = []
+    start = time.perf_counter()
+
+    async def on_event(kind, items):
+        events.append((kind, time.perf_counter() - start, items))
+
+    result = await arun_task(
+        {"task": "打开设置", "default_model": model_config, "user_skills": [_SleepySkill("user:1", "慢技能", 0.3)]},
+        on_event=on_event,
+    )
+
+    assert [kind for kind, _, _ in events] == ["actions", "effects"]
+    assert events[0][1] < 0.2
+    assert events[0][2] == result["actions"]
+    assert events[1][2][0]["payload"]["text"] == "慢技能"
+
+
+@pytest.mark.asyncio
+async def test_cacheable_skill_reuses_model_response(fake_model, model_config):
+    from agents.graph import _run_skill
+    from skills.anti_scam import AntiScamSkill
+    from utils.response_cache import skill_response_cache
+
+    calls = fake_model(reply='{"risk_level": "high", "message": "疑似诈骗"}')
+    skill_response_cache.clear()
+    context = {"screenshot": None, "model_config": model_config}
+
+    first = await _run_skill(AntiScamSkill(), "anti_scam", "您的账户异常请点击链接", context)
+    second = await _run_skill(AntiScamSkill(), "anti_scam", "您的账户异常请点击链接", context)
+
+    assert len(calls) == 1
+    assert first["effects"] == second["effects"]
+    assert first["skill_timings"][0]["cache_hits"] == 0
+    assert second["skill_timings"][0]["cache_hits"] == 1
+    skill_response_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_token_usage_is_attributed_to_task_and_skill(fake_model, model_config):
+    from agents.graph import _run_skill
+    from skills.anti_scam import AntiScamSkill
+    from utils import token_usage
+    from utils.response_cache import skill_response_cache
+
+    usage = {"prompt_tokens": 100, "completion_tokens": 20, "prompt_tokens_details": {"cached_tokens": 64}}
+    fake_model(reply='{"risk_level": "high", "message": "疑似诈骗"}', usage=usage)
+    skill_response_cache.clear()
+    context = {"screenshot": None, "model_config": model_config}
+
+    with token_usage.track() as total:
+        first = await _run_skill(AntiScamSkill(), "anti_scam", "您的账户异常请点击链接", context)
+        second = await _run_skill(AntiScamSkill(), "anti_scam", "您的账户异常请点击链接", context)
+    skill_response_cache.clear()
+
+    assert first["skill_timings"][0]["prompt_tokens"] == 100
+    assert first["skill_timings"][0]["cached_tokens"] == 64
+    # 命中响应缓存不再消耗 token
+    assert second["skill_timings"][0]["prompt_tokens"] == 0
+    assert total.as_dict() == {"prompt_tokens": 100, "completion_tokens": 20, "cached_tokens": 64, "model_calls": 1, "estimated_calls": 0}
+
+    fake_model(usage=usage)
+    result = await arun_task({"task": "打开设置", "default_model": model_config})
+    usage = result["token_usage"]
+    assert usage["model_calls"] >= 1
+    assert usage["prompt_tokens"] == 100 * usage["model_calls"]
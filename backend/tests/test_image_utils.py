@@ -0,0 +1,47 @@
+import base64
+import io
+import os
+
+from PIL import Image
+
+from utils.image_utils import Screenshot
+
+
+def _noisy_screenshot(width: int, height: int) -> str:
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def test_data_url_downscales_and_respects_byte_budget(monkeypatch):
+    from config.settings import settings
+
+    monkeypatch.setattr(settings, "screenshot_max_side", 800)
+    monkeypatch.setattr(settings, "screenshot_format", "webp")
+    monkeypatch.setattr(settings, "screenshot_quality", 80)
+    monkeypatch.setattr(settings, "screenshot_max_bytes", 60_000)
+
+    header, data = Screenshot(_noisy_screenshot(540, 1200)).data_url().split(",", 1)
+    raw = base64.b64decode(data)
+    image = Image.open(io.BytesIO(raw))
+    assert header == "data:image/webp;base64"
+    assert max(image.size) <= 800
+    assert len(raw) <= 60_000
+
+
+def test_data_url_passes_through_undecodable_data():
+    assert Screenshot("not-an-image").data_url() == "data:image/jpeg;base64,not-an-image"
+
+
+def test_screenshot_decodes_once_and_caches_derived_images():
+    screenshot = Screenshot(_noisy_screenshot(100, 200))
+    region = {"x": 0, "y": 0, "width": 50, "height": 50, "screen_width": 100, "screen_height": 200}
+
+    assert screenshot.image is screenshot.image
+    assert screenshot.data_url() is screenshot.data_url()
+    cropped = screenshot.crop(region)
+    assert cropped is screenshot.crop(dict(region))
+    assert cropped.image.size == (50, 50)
+    assert Screenshot.coerce(screenshot) is screenshot
+    assert Screenshot.coerce("") is None
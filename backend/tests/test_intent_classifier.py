@@ -0,0 +1,50 @@
+import skills.doudizhu  # noqa: F401  注册内置技能
+from agents.planner import PlannerAgent
+from utils import intent_classifier
+from utils.intent_classifier import IntentClassifier
+
+SAMPLES = [
+    ("这条短信是不是诈骗", "anti_scam"),
+    ("帮我看看这个链接安全吗", "anti_scam"),
+    ("对方让我下载会议软件共享屏幕", "anti_scam"),
+    ("这句话用英文怎么说", "translator"),
+    ("把菜单翻成中文", "translator"),
+    ("这段日文是什么意思", "translator"),
+    ("这手牌该怎么打", "doudizhu"),
+    ("我是地主下一步出什么", "doudizhu"),
+    ("帮我算算对手还剩什么牌", "doudizhu"),
+] * 3
+
+
+def test_classifier_learns_intents_and_round_trips():
+    classifier = IntentClassifier.train(SAMPLES)
+    restored = IntentClassifier.from_dict(classifier.to_dict())
+
+    label, confidence = restored.predict("这手牌怎么打")
+    assert label == "doudizhu"
+    assert confidence > 0.3
+    # 词表之外的任务置信度低
+    assert restored.predict("打开微信设置页面")[1] < 0.1
+
+
+def test_route_combines_keywords_and_classifier(monkeypatch):
+    planner = PlannerAgent()
+    intent_classifier.set_intent_classifier(IntentClassifier.train(SAMPLES))
+    try:
+        decision = planner.route("我是地主下一步出什么")
+        assert decision["keyword_skills"] == ["doudizhu"]
+        assert decision["classifier_label"] == "doudizhu"
+        assert decision["confidence"] > 0.9
+
+        # 没有关键词命中时即使分类器很确定也交给 Planner 模型
+        decision = planner.route("这手牌该怎么打")
+        assert decision["keyword_skills"] == []
+        assert decision["classifier_label"] == "doudizhu"
+        assert decision["classifier_confidence"] > 0.5
+        assert decision["confidence"] == 0.0
+
+        # 有用户智能体但未按名称命中时必须交给 Planner 模型
+        decision = planner.route("我是地主下一步出什么", user_agents=[{"id": "a1", "name": "助理"}])
+        assert decision["confidence"] == 0.0
+    finally:
+        intent_classifier.set_intent_classifier(None)
@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+from agents.planner import PlannerAgent
+from utils.keyword_matcher import KeywordMatcher
+
+
+def test_matcher_finds_overlapping_keywords_in_one_pass():
+    matcher = KeywordMatcher(
+        [("刷流水", "high"), ("流水", "medium"), ("he", "a"), ("she", "b"), ("hers", "b"), ("Verification Code", "high")],
+        normalize=lambda text: text.lower().replace(" ", ""),
+    )
+
+    hits = matcher.search("请帮忙刷流水，ushers 的 verification code")
+
+    assert hits == {
+        "high": ["刷流水", "Verification Code"],
+        "medium": ["流水"],
+        "a": ["he"],
+        "b": ["she", "hers"],
+    }
+    assert matcher.search("没有命中") == {}
+
+
+def test_planner_keyword_fallback_matches_builtin_and_user_skills():
+    planner = PlannerAgent()
+    user_skills = [SimpleNamespace(id="user:1", name="记账 助手"), SimpleNamespace(id="user:2", name="")]
+
+    selected = planner.select_skills("收到 验证码 短信，顺便打开记账助手", user_skills)
+
+    assert selected == ["anti_scam", "user:1"]
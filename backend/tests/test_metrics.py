@@ -0,0 +1,39 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from utils.metrics import MetricsRegistry
+
+
+def test_render_prometheus_exposition():
+    registry = MetricsRegistry()
+    registry.incr("requests_total", 3)
+    registry.set_gauge("tasks_in_flight", 2)
+    registry.register_gauge("cache_hit_ratio", lambda: {"plan": 0.5}, label="cache", help_text="命中率")
+    registry.describe("latency_seconds", "延迟", buckets=(0.1, 1.0))
+    registry.observe("latency_seconds", 0.05, {"skill": "anti_scam"})
+    registry.observe("latency_seconds", 0.5, {"skill": "anti_scam"})
+    registry.observe("latency_seconds", 3.0, {"skill": "anti_scam"})
+
+    lines = registry.render_prometheus().splitlines()
+
+    assert "# TYPE requests_total counter" in lines
+    assert "requests_total 3" in lines
+    assert "tasks_in_flight 2" in lines
+    assert "# HELP cache_hit_ratio 命中率" in lines
+    assert 'cache_hit_ratio{cache="plan"} 0.5' in lines
+    assert 'latency_seconds_bucket{skill="anti_scam",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{skill="anti_scam",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{skill="anti_scam",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{skill="anti_scam"} 3' in lines
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    from main import app
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'cache_hit_ratio{cache="plan"}' in response.text
@@ -0,0 +1,289 @@
+import pytest
+
+from utils import model_client
+
+
+@pytest.mark.asyncio
+async def test_async_client_is_pooled_per_base_url():
+    first = model_client.get_async_client("https://api.example.com/v1")
+    assert model_client.get_async_client("https://api.example.com/v1/") is first
+    assert model_client.get_async_client("https://other.example.com/v1") is not first
+    await model_client.aclose_clients()
+    assert first.is_closed
+
+
+@pytest.mark.asyncio
+async def test_streaming_stops_once_answer_action_is_complete(model_http):
+    import json
+
+    import httpx
+
+    from utils.action_parser import extract_answer_action
+
+    deltas = ["<think>点击</think><answer>do(action=", '"Tap", element=[1', ',2])', "多余的内容", "</answer>"]
+    body = "".join(
+        f"data: {json.dumps({'choices': [{'delta': {'content': delta}}]}, ensure_ascii=False)}\n\n"
+        for delta in deltas
+    ) + "data: [DONE]\n\n"
+
+    def handler(request):
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, content=body.encode("utf-8"), headers={"content-type": "text/event-stream"})
+
+    model_http(handler)
+
+    response = await model_client.achat_completions(
+        base_url="https://api.example.com/v1",
+        api_key="sk-test",
+        model="test-model",
+        messages=[{"role": "user", "content": "点一下"}],
+        stop_when=lambda content: extract_answer_action(content) is not None,
+    )
+
+    content = model_client.extract_content(response)
+    assert response["stopped_early"] is True
+    assert extract_answer_action(content) == 'do(action="Tap", element=[1,2])'
+    assert "多余" not in content
+
+
+@pytest.mark.asyncio
+async def test_streaming_records_usage_and_estimates_it_when_stopped_early(model_http):
+    import json
+
+    import httpx
+
+    from utils import token_usage
+    from utils.action_parser import extract_answer_action
+
+    def sse(chunk):
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+    answer = '<answer>do(action="Back")</answer>'
+    usage_chunk = sse({"choices": [], "usage": {"prompt_tokens": 1200, "completion_tokens": 9}})
+    bodies = {
+        # 完整读到末尾的 usage 块
+        "full": sse({"choices": [{"delta": {"content": answer}}]}) + usage_chunk + "data: [DONE]\n\n",
+        # 动作完整后提前断开，收不到 usage 块
+        "early": sse({"choices": [{"delta": {"content": answer}}]}) + sse({"choices": [{"delta": {"content": "多余"}}]})
+        + usage_chunk + "data: [DONE]\n\n",
+    }
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(
+            200, content=bodies[request.headers["x-case"]].encode("utf-8"), headers={"content-type": "text/event-stream"}
+        )
+
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "返回上一页"},
+                {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+            ],
+        }
+    ]
+
+    async def call(case, stop_when):
+        model_http(handler, headers={"x-case": case})
+        with token_usage.track() as usage:
+            await model_client.achat_completions(
+                base_url="https://api.example.com/v1",
+                api_key="sk-test",
+                model="test-model",
+                messages=messages,
+                stop_when=stop_when,
+            )
+        return usage
+
+    usage = await call("full", stop_when=lambda content: False)
+    assert (usage.prompt_tokens, usage.completion_tokens, usage.estimated_calls) == (1200, 9, 0)
+
+    usage = await call("early", stop_when=lambda content: extract_answer_action(content) is not None)
+    assert usage.prompt_tokens > 1000 and usage.completion_tokens > 0
+    assert usage.estimated_calls == 1
+    assert all(request["stream_options"] == {"include_usage": True} for request in requests)
+
+
+def test_answer_action_waits_for_answer_end_on_free_text_actions():
+    from utils.action_parser import extract_answer_action
+
+    assert extract_answer_action('<answer>do(action="Type", text="a)b")') is None
+    assert extract_answer_action('<answer>do(action="Type", text="a)b")</answer>') == 'do(action="Type", text="a)b")'
+    # finish 的消息中引号个数为奇数时括号配对会提前结束，同样等待 </answer>
+    assert extract_answer_action('<answer>finish(message="他说"好的)"') is None
+    assert extract_answer_action('<answer>finish(message="他说"好的)，已完成")</answer>') == 'finish(message="他说"好的)，已完成")'
+    assert extract_answer_action('<answer>do(action="Back")') == 'do(action="Back")'
+
+
+@pytest.mark.asyncio
+async def test_throttled_requests_are_retried_and_shrink_the_provider_limit(monkeypatch, model_http):
+    import httpx
+
+    from utils.rate_limiter import get_limiter
+
+    responses = iter([
+        httpx.Response(429, headers={"retry-after": "0"}, json={"error": "rate limited"}),
+        httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]}),
+    ])
+    model_http(lambda request: next(responses))
+    monkeypatch.setattr(model_client.settings, "model_retry_base_delay_seconds", 0.01)
+
+    response = await model_client.achat_completions(
+        base_url="https://limited.example.com/v1",
+        api_key="sk-test",
+        model="test-model",
+        messages=[{"role": "user", "content": "hi"}],
+    )
+
+    limiter = get_limiter("https://limited.example.com/v1", "sk-test")
+    assert model_client.extract_content(response) == "ok"
+    assert limiter.limit < model_client.settings.model_max_concurrency_per_provider
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_provider_limiter_bounds_concurrency():
+    import asyncio
+
+    from utils.rate_limiter import ProviderLimiter
+
+    limiter = ProviderLimiter(max_concurrency=2)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        await limiter.acquire()
+        peak = max(peak, limiter.in_flight)
+        await asyncio.sleep(0.01)
+        await limiter.release()
+
+    await asyncio.gather(*(call() for _ in range(6)))
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_to_fallback_endpoint_wins_over_slow_primary(model_http):
+    import asyncio
+
+    import httpx
+
+    seen = []
+
+    async def handler(request):
+        seen.append(request.url.host)
+        if request.url.host == "slow.example.com":
+            await asyncio.sleep(1)
+        return httpx.Response(200, json={"choices": [{"message": {"content": request.url.host}}]})
+
+    model_http(handler)
+
+    response = await model_client.achat_completions(
+        base_url="https://slow.example.com/v1",
+        api_key="sk-test",
+        model="test-model",
+        messages=[{"role": "user", "content": "hi"}],
+        config={"fallbacks": [{"base_url": "https://fast.example.com/v1"}], "hedge": {"delay_ms": 50}},
+    )
+
+    assert model_client.extract_content(response) == "fast.example.com"
+    assert seen == ["slow.example.com", "fast.example.com"]
+
+
+@pytest.mark.asyncio
+async def test_failed_endpoint_fails_over_and_opens_its_circuit(monkeypatch, model_http):
+    import httpx
+
+    from utils.endpoint_health import get_breaker
+
+    def handler(request):
+        if request.url.host == "broken.example.com":
+            return httpx.Response(500, json={"error": "down"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    model_http(handler)
+    monkeypatch.setattr(model_client.settings, "model_circuit_failure_threshold", 1)
+
+    response = await model_client.achat_completions(
+        base_url="https://broken.example.com/v1",
+        api_key="sk-test",
+        model="test-model",
+        messages=[{"role": "user", "content": "hi"}],
+        config='{"fallbacks": [{"base_url": "https://backup.example.com/v1"}]}',
+    )
+
+    assert model_client.extract_content(response) == "ok"
+    assert get_breaker("https://broken.example.com/v1").state == "open"
+
+
+@pytest.mark.asyncio
+async def test_unused_half_open_fallback_keeps_its_probe_slot(monkeypatch, model_http):
+    import asyncio
+
+    import httpx
+
+    from utils import endpoint_health
+
+    seen = []
+
+    async def handler(request):
+        seen.append(request.url.host)
+        if request.url.host == "primary.example.com":
+            await asyncio.sleep(0.2)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    model_http(handler)
+    # 冷却时间为 0：打开后立即进入半开状态
+    standby = endpoint_health.CircuitBreaker(failure_threshold=1, cooldown_seconds=0)
+    standby.record_failure()
+    primary = endpoint_health.CircuitBreaker(failure_threshold=1, cooldown_seconds=0)
+    primary.record_failure()
+    monkeypatch.setitem(endpoint_health._breakers, "https://standby.example.com/v1", standby)
+    monkeypatch.setitem(endpoint_health._breakers, "https://primary.example.com/v1", primary)
+
+    await model_client.achat_completions(
+        base_url="https://fast.example.com/v1",
+        api_key="sk-test",
+        model="test-model",
+        messages=[{"role": "user", "content": "hi"}],
+        config={"fallbacks": [{"base_url": "https://standby.example.com/v1"}]},
+    )
+    assert seen == ["fast.example.com"]
+    # 未被使用的半开备用端点下次仍可探测
+    assert standby.state == "half_open"
+    assert standby.allow()
+    standby.abandon()
+
+    # 只有一个半开端点时，对冲不会再发第二个探测请求
+    seen.clear()
+    await model_client.achat_completions(
+        base_url="https://primary.example.com/v1",
+        api_key="sk-test",
+        model="test-model",
+        messages=[{"role": "user", "content": "hi"}],
+        config={"hedge": {"delay_ms": 20}},
+    )
+    assert seen == ["primary.example.com"]
+    assert primary.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_latency_samples_exclude_retry_backoff(monkeypatch, model_http):
+    import httpx
+
+    from utils.endpoint_health import get_latency_tracker
+
+    responses = iter([httpx.Response(503, json={"error": "busy"}), httpx.Response(200, json={"choices": []})])
+    model_http(lambda request: next(responses))
+    monkeypatch.setattr(model_client, "_backoff_delay", lambda attempt, retry_after: 0.2)
+
+    await model_client.achat_completions(
+        base_url="https://backoff.example.com/v1",
+        api_key="sk-test",
+        model="test-model",
+        messages=[{"role": "user", "content": "hi"}],
+    )
+
+    # 只记录成功请求的往返耗时，不包含 0.2 秒的退避等待
+    assert get_latency_tracker("https://backoff.example.com/v1").percentile(1.0, 1) < 0.1
@@ -0,0 +1,62 @@
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from db.models import UsageLog
+from utils import pagination
+
+
+def test_cursor_round_trips_datetime_and_id():
+    created_at = datetime(2026, 1, 31, 23, 59, 59)
+    cursor = pagination.encode_cursor(created_at, 123)
+
+    assert pagination.decode_cursor(cursor, 2) == [created_at, 123]
+    with pytest.raises(HTTPException) as exc_info:
+        pagination.decode_cursor(cursor, 1)
+    assert exc_info.value.status_code == 400
+    with pytest.raises(HTTPException):
+        pagination.decode_cursor("not-a-cursor", 2)
+
+
+@pytest.mark.asyncio
+async def test_export_streams_rows_in_batches(monkeypatch):
+    rows = [
+        SimpleNamespace(id=index, skill_id="translator", created_at=datetime(2026, 1, 1, 0, 0, index))
+        for index in range(5)
+    ]
+
+    class FakeResult:
+        async def partitions(self):
+            yield rows[:3]
+            yield rows[3:]
+
+    class FakeSession:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def stream(self, stmt):
+            assert stmt.get_execution_options()["yield_per"] == pagination.EXPORT_BATCH_SIZE
+            return FakeResult()
+
+    monkeypatch.setattr(pagination, "AsyncSessionLocal", FakeSession)
+    stmt = select(UsageLog.id, UsageLog.skill_id, UsageLog.created_at)
+    columns = ["id", "skill_id", "created_at"]
+
+    response = pagination.stream_export(stmt, columns, "ndjson", "usage_logs")
+    body = "".join([chunk async for chunk in response.body_iterator])
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert response.media_type == "application/x-ndjson"
+    assert [line["id"] for line in lines] == [0, 1, 2, 3, 4]
+    assert lines[1]["created_at"] == "2026-01-01T00:00:01"
+
+    response = pagination.stream_export(stmt, columns, "csv", "usage_logs")
+    body = "".join([chunk async for chunk in response.body_iterator])
+    assert body.splitlines()[:2] == ["id,skill_id,created_at", "0,translator,2026-01-01T00:00:00"]
+    assert 'filename="usage_logs.csv"' in response.headers["content-disposition"]
@@ -0,0 +1,33 @@
+import logging
+
+from utils import payload_log
+
+
+def test_payload_log_is_lazy_and_sampled(monkeypatch, caplog):
+    calls = []
+    real_redact = payload_log.redact
+    monkeypatch.setattr(payload_log, "redact", lambda value, key=None: calls.append(1) or real_redact(value, key))
+    logger = payload_log.get_payload_logger("test")
+
+    logger.setLevel(logging.WARNING)
+    payload_log.log_payload(logger, "事件", {"messages": [{"content": "x"}]})
+    assert calls == []
+
+    logger.setLevel(logging.INFO)
+    monkeypatch.setattr(payload_log.settings, "payload_log_sample_rate", 0.0)
+    with caplog.at_level(logging.INFO, logger="payload.test"):
+        payload_log.log_payload(logger, "事件", {"type": "task", "messages": [{"api_key": "sk"}]})
+        payload_log.log_payload(logger, "事件", {"type": "ping", "api_key": "sk"})
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages[0] == '事件 {"sampled_out":true,"keys":["messages","type"],"type":"task"}'
+    assert messages[1] == '事件 {"type":"ping","api_key":"***"}'
+
+    # 记录后调用方再增删顶层字段（如 handle_task 补充模型配置）不影响日志内容
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger="payload.test"):
+        payload = {"type": "task", "task": "打开设置", "user_agents": []}
+        payload_log.log_payload(logger, "事件", payload)
+        payload["default_model"] = {"api_key": "sk"}
+        payload.pop("user_agents")
+    assert caplog.records[0].getMessage() == '事件 {"sampled_out":true,"keys":["task","type","user_agents"],"type":"task"}'
+    logger.setLevel(logging.NOTSET)
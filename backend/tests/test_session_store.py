@@ -0,0 +1,78 @@
+import pytest
+
+from utils.session_store import PlanCache
+
+
+@pytest.mark.asyncio
+async def test_plan_cache_is_shared_across_phrasings_and_scoped_by_skills():
+    cache = PlanCache(max_entries=8, ttl_seconds=60)
+    await cache.set("帮我翻译。", ["translator", "anti_scam"], ["p"], ["translator"], None)
+
+    hit = await cache.get(" 帮我 翻译 ", ["anti_scam", "translator"])
+    assert hit["selected_skills"] == ["translator"]
+    assert await cache.get("帮我翻译", ["translator"]) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_in_memory_session_backend_caps_history():
+    from utils.session_store import InMemorySessionBackend, SessionStore
+
+    store = SessionStore(InMemorySessionBackend(max_messages=3))
+    await store.append_turn("s1", "任务1", "回复1")
+    await store.append_turn("s1", "任务2", "回复2")
+
+    history = await store.get_history("s1")
+    assert [message["content"] for message in history] == ["回复1", "任务2", "回复2"]
+    assert await store.get_history("") == []
+
+
+@pytest.mark.asyncio
+async def test_in_memory_session_backend_evicts_lru_and_idle_sessions(monkeypatch):
+    import time
+    from types import SimpleNamespace
+
+    from utils import session_store
+    from utils.session_store import InMemorySessionBackend, SessionStore
+
+    backend = InMemorySessionBackend(max_messages=4, max_sessions=2, idle_ttl_seconds=60)
+    store = SessionStore(backend)
+    await store.append_turn("s1", "任务1", "回复1")
+    await store.append_turn("s2", "任务2", "回复2")
+    await store.get_history("s1")
+    await store.append_turn("s3", "任务3", "回复3")
+
+    assert await store.get_history("s2") == []
+    assert store.stats()["sessions"] == 2
+
+    assert store.sweep() == 0
+    now = time.monotonic()
+    # 只替换本模块看到的时钟，不影响事件循环
+    monkeypatch.setattr(session_store, "time", SimpleNamespace(monotonic=lambda: now + 61))
+    assert store.sweep() == 2
+    assert store.stats() == {"sessions": 0, "messages": 0, "content_bytes": 0}
+
+
+@pytest.mark.asyncio
+async def test_sweeper_purges_expired_skill_responses(monkeypatch):
+    import asyncio
+    import time
+    from types import SimpleNamespace
+
+    from utils import cache, session_store
+    from utils.response_cache import skill_response_cache
+
+    skill_response_cache.clear()
+    await skill_response_cache.set("expired", {"result": "ok"}, 60)
+    now = time.monotonic()
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: now + 61))
+
+    task = asyncio.create_task(session_store._sweep_loop(0))
+    try:
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert skill_response_cache.stats()["entries"] == 0
+    finally:
+        task.cancel()
+        skill_response_cache.clear()
@@ -0,0 +1,64 @@
+import logging
+
+import pytest
+
+from utils import tracing
+
+
+@pytest.mark.asyncio
+async def test_spans_are_noops_when_tracing_is_disabled():
+    assert not tracing.is_enabled()
+
+    @tracing.traced("test.node")
+    async def node(value):
+        return value + 1
+
+    with tracing.span("test.span", attr=1) as current:
+        current.set_attribute("key", "value")
+        assert await node(1) == 2
+
+
+@pytest.mark.asyncio
+async def test_task_spans_cover_graph_nodes_and_model_calls(fake_model, model_config):
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    from agents.graph import arun_task
+
+    fake_model(usage={"prompt_tokens": 12})
+    exporter = InMemorySpanExporter()
+    assert tracing.setup_tracing(exporter)
+    try:
+        with tracing.span("ws.task"):
+            await arun_task({"task": "打开设置", "default_model": model_config})
+    finally:
+        tracing.shutdown_tracing()
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert {"ws.task", "graph.planner", "graph.executor", "model.chat_completions"} <= set(spans)
+    root = spans["ws.task"]
+    assert spans["graph.executor"].context.trace_id == root.context.trace_id
+    assert spans["model.chat_completions"].attributes["gen_ai.usage.input_tokens"] == 12
+
+
+def test_log_context_wraps_and_restores_handler_formatters():
+    pytest.importorskip("opentelemetry.sdk")
+    import io
+
+    handler = logging.StreamHandler(io.StringIO())
+    formatter = logging.Formatter("%(asctime)s %(message)s", datefmt="%H:%M")
+    handler.setFormatter(formatter)
+    root = logging.getLogger()
+    root.addHandler(handler)
+    try:
+        tracing._install_log_context()
+        record = logging.getLogger("test").makeRecord("test", logging.INFO, __file__, 1, "hello", None, None)
+        text = handler.format(record)
+    finally:
+        tracing._uninstall_log_context()
+        root.removeHandler(handler)
+
+    # 保留原 formatter 的时间格式，并在末尾附加追踪上下文
+    assert text[2] == ":" and len(text.split(" ", 1)[0]) == 5
+    assert text.endswith("hello [trace_id=- span_id=-]")
+    assert handler.formatter is formatter
@@ -0,0 +1,189 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import mysql
+
+from config.settings import settings
+from db.usage_rollups import (
+    _COUNTER_FIELDS,
+    LATENCY_OVERFLOW_MS,
+    aggregate_rows,
+    histogram_percentile,
+    latency_bucket,
+    plan_ranges,
+    query_usage_stats,
+)
+
+
+def test_plan_ranges_uses_whole_days_and_hours_and_leaves_edges_raw():
+    rollups, raw = plan_ranges(datetime(2026, 1, 1, 10, 30), datetime(2026, 1, 5, 3, 15))
+
+    assert rollups["day"] == [(datetime(2026, 1, 2), datetime(2026, 1, 5))]
+    assert rollups["hour"] == [
+        (datetime(2026, 1, 1, 11), datetime(2026, 1, 2)),
+        (datetime(2026, 1, 5), datetime(2026, 1, 5, 3)),
+    ]
+    assert raw == [
+        (datetime(2026, 1, 1, 10, 30), datetime(2026, 1, 1, 11)),
+        (datetime(2026, 1, 5, 3), datetime(2026, 1, 5, 3, 15)),
+    ]
+
+    # 不足一个整小时的区间全部读原始表
+    rollups, raw = plan_ranges(datetime(2026, 1, 1, 10, 5), datetime(2026, 1, 1, 10, 50))
+    assert rollups == {"hour": [], "day": []}
+    assert raw == [(datetime(2026, 1, 1, 10, 5), datetime(2026, 1, 1, 10, 50))]
+
+    # 不限时间时全部读按天汇总
+    assert plan_ranges(None, None) == ({"hour": [], "day": [(None, None)]}, [])
+
+
+def test_aggregate_rows_builds_hourly_and_daily_buckets_with_latency_histogram():
+    def row(hour, status, execution_ms, skill_id="translator"):
+        return SimpleNamespace(
+            device_id="device-1",
+            skill_id=skill_id,
+            status=status,
+            execution_ms=execution_ms,
+            prompt_tokens=10,
+            completion_tokens=2,
+            cached_tokens=0,
+            created_at=datetime(2026, 1, 1, hour, 15),
+        )
+
+    groups = aggregate_rows([row(9, 1, 120), row(9, 0, None), row(10, 1, 900)])
+
+    hourly = groups[("hour", datetime(2026, 1, 1, 9), "device-1", "translator")]
+    assert hourly.counters["total_count"] == 2
+    assert hourly.counters["failure_count"] == 1
+    assert hourly.counters["execution_ms_count"] == 1
+    assert hourly.latency == {200: 1}
+
+    daily = groups[("day", datetime(2026, 1, 1), "device-1", "translator")]
+    assert daily.counters["total_count"] == 3
+    assert daily.counters["prompt_tokens"] == 30
+    assert daily.counters["execution_ms_sum"] == 1020
+    assert daily.latency == {200: 1, 1000: 1}
+
+
+def test_histogram_percentile_interpolates_within_buckets():
+    assert latency_bucket(50) == 50
+    assert latency_bucket(51) == 100
+    assert latency_bucket(10**6) == LATENCY_OVERFLOW_MS
+
+    histogram = {100: 50, 200: 40, 500: 10}
+    assert histogram_percentile(histogram, 0.5) == 100
+    assert 100 < histogram_percentile(histogram, 0.8) < 200
+    assert 200 < histogram_percentile(histogram, 0.95) <= 500
+    assert histogram_percentile({}, 0.5) is None
+    assert histogram_percentile({120000: 1, LATENCY_OVERFLOW_MS: 9}, 0.95) == 120000
+
+
+class _FakeResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def all(self):
+        return self._rows
+
+    def scalar_one_or_none(self):
+        return self._rows[0] if self._rows else None
+
+
+class _FakeSession:
+    """按语句编译后的 SQL 返回预设结果，并记录执行过的语句"""
+
+    def __init__(self, watermark, responder):
+        self.watermark = watermark
+        self.responder = responder
+        self.statements = []
+
+    async def execute(self, stmt):
+        sql = str(stmt.compile(dialect=mysql.dialect(), compile_kwargs={"literal_binds": True}))
+        self.statements.append(sql)
+        if "FROM usage_rollup_state" in sql:
+            return _FakeResult([self.watermark])
+        return _FakeResult(self.responder(sql))
+
+
+def _counters(skill_id, **values):
+    return SimpleNamespace(skill_id=skill_id, **{name: values.get(name, 0) for name in _COUNTER_FIELDS})
+
+
+@pytest.mark.asyncio
+async def test_query_usage_stats_stitches_rollups_with_raw_edges_and_unrolled_tail(monkeypatch):
+    monkeypatch.setattr(settings, "usage_rollup_enabled", True)
+
+    def responder(sql):
+        latency = "le_ms" in sql
+        if "FROM usage_rollup_latency" in sql:
+            return [SimpleNamespace(le_ms=200, count=8)]
+        if "FROM usage_rollups" in sql:
+            return [_counters("translator", total_count=10, success_count=9, failure_count=1, prompt_tokens=100)]
+        if "usage_logs.id > 100" in sql:
+            if latency:
+                return [SimpleNamespace(le_ms=200, count=1), SimpleNamespace(le_ms=1000, count=1)]
+            return [_counters("translator", total_count=2, success_count=2, prompt_tokens=20)]
+        assert "usage_logs.id <= 100" in sql
+        if latency:
+            return [SimpleNamespace(le_ms=100, count=1)]
+        return [_counters("weather", total_count=1, success_count=1, prompt_tokens=5)]
+
+    session = _FakeSession(100, responder)
+    stats = await query_usage_stats(
+        session,
+        device_id="device-1",
+        start_date=datetime(2026, 1, 1, 10, 30),
+        end_date=datetime(2026, 1, 5, 3, 15),
+    )
+
+    rollup_sql = [sql for sql in session.statements if "FROM usage_rollups" in sql]
+    assert len(rollup_sql) == 1
+    for bucket in (
+        "usage_rollups.granularity = 'day' AND usage_rollups.bucket_start >= '2026-01-02 00:00:00' "
+        "AND usage_rollups.bucket_start < '2026-01-05 00:00:00'",
+        "usage_rollups.granularity = 'hour' AND usage_rollups.bucket_start >= '2026-01-01 11:00:00' "
+        "AND usage_rollups.bucket_start < '2026-01-02 00:00:00'",
+        "usage_rollups.granularity = 'hour' AND usage_rollups.bucket_start >= '2026-01-05 00:00:00' "
+        "AND usage_rollups.bucket_start < '2026-01-05 03:00:00'",
+    ):
+        assert bucket in rollup_sql[0]
+    assert "usage_rollups.device_id = 'device-1'" in rollup_sql[0]
+
+    # 水位线之后的记录覆盖整个查询区间，不按汇总区间切分
+    tail_sql = [sql for sql in session.statements if "usage_logs.id > 100" in sql]
+    assert len(tail_sql) == 2
+    for sql in tail_sql:
+        assert "usage_logs.created_at >= '2026-01-01 10:30:00' AND usage_logs.created_at <= '2026-01-05 03:15:00'" in sql
+
+    # 水位线之前只读不足整小时的边缘，最后一段包含结束时间
+    edge_sql = [sql for sql in session.statements if "usage_logs.id <= 100" in sql and "le_ms" not in sql]
+    assert len(edge_sql) == 2
+    assert "usage_logs.created_at >= '2026-01-01 10:30:00' AND usage_logs.created_at < '2026-01-01 11:00:00'" in edge_sql[0]
+    assert "usage_logs.created_at >= '2026-01-05 03:00:00' AND usage_logs.created_at <= '2026-01-05 03:15:00'" in edge_sql[1]
+
+    assert stats.counters["total_count"] == 14
+    assert stats.counters["success_count"] == 13
+    assert stats.counters["failure_count"] == 1
+    assert stats.counters["prompt_tokens"] == 130
+    assert stats.skill_counts == {"translator": 12, "weather": 2}
+    assert stats.latency == {100: 2, 200: 9, 1000: 1}
+
+
+@pytest.mark.asyncio
+async def test_query_usage_stats_reads_only_raw_logs_before_first_rollup(monkeypatch):
+    monkeypatch.setattr(settings, "usage_rollup_enabled", True)
+
+    def responder(sql):
+        assert "usage_logs.id" not in sql.split("WHERE", 1)[-1]
+        if "le_ms" in sql:
+            return [SimpleNamespace(le_ms=300, count=3)]
+        return [_counters("translator", total_count=3, execution_ms_count=3, execution_ms_sum=750)]
+
+    session = _FakeSession(None, responder)
+    stats = await query_usage_stats(session, start_date=datetime(2026, 1, 1), end_date=datetime(2026, 1, 5))
+
+    assert not any("FROM usage_rollups" in sql or "FROM usage_rollup_latency" in sql for sql in session.statements)
+    assert stats.counters["total_count"] == 3
+    assert stats.avg_execution_ms == 250
+    assert stats.latency == {300: 3}
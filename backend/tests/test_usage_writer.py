@@ -0,0 +1,44 @@
+import pytest
+
+from db.usage_writer import UsageLogWriter
+from utils.metrics import metrics
+
+
+@pytest.mark.asyncio
+async def test_usage_writer_batches_drops_on_overflow_and_drains_on_stop(monkeypatch):
+    batches = []
+
+    async def fake_flush(batch):
+        batches.append([values["skill_id"] for _, values in batch])
+
+    writer = UsageLogWriter(max_queue_size=3, batch_size=2, flush_interval_seconds=60)
+    monkeypatch.setattr(writer, "_flush", fake_flush)
+    dropped_before = metrics.get("usage_log_dropped_total")
+
+    for index in range(4):
+        writer.add_usage_log(device_id="d1", skill_id=f"s{index}", status=1)
+    await writer.stop()
+
+    assert metrics.get("usage_log_dropped_total") - dropped_before == 1
+    assert [skill for batch in batches for skill in batch] == ["s0", "s1", "s2"]
+    assert all(len(batch) <= 2 for batch in batches)
+
+
+@pytest.mark.asyncio
+async def test_usage_writer_counts_the_in_flight_batch_when_stop_times_out(monkeypatch):
+    import asyncio
+
+    async def stuck_flush(batch):
+        await asyncio.sleep(10)
+
+    writer = UsageLogWriter(max_queue_size=10, batch_size=2, flush_interval_seconds=60)
+    monkeypatch.setattr(writer, "_flush", stuck_flush)
+    dropped_before = metrics.get("usage_log_dropped_total")
+
+    for index in range(3):
+        writer.add_usage_log(device_id="d1", skill_id=f"s{index}", status=1)
+    await asyncio.sleep(0.01)
+    await writer.stop(timeout_seconds=0.05)
+
+    # 正在写入的一批（2 条）和队列中剩余的 1 条都计为丢弃
+    assert metrics.get("usage_log_dropped_total") - dropped_before == 3
@@ -1,7 +1,12 @@
 from __future__ import annotations
 
 import ast
-from typing import Any, Tuple
+from typing import Any, Optional, Tuple
+
+_ACTION_PREFIXES = ("do(", "finish(")
+# 参数为自由文本（可能包含未转义的引号和括号）的动作，只有 </answer> 才能确定结束
+_FREE_TEXT_PREFIXES = ('do(action="Type"', 'do(action="Type_Name"', "finish(")
+_CLOSING = {"(": ")", "[": "]", "{": "}"}
 
 
 def parse_response(content: str) -> Tuple[str, str]:
@@ -51,3 +56,56 @@ def parse_action(response: str) -> dict[str, Any]:
         }
 
     raise ValueError(f"解析动作失败：{response}")
+
+
+def _find_call_end(text: str, start: int) -> int:
+    """返回从 start 开始的函数调用的右括号位置，调用尚未结束时返回 -1。"""
+    stack: list[str] = []
+    quote: str | None = None
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+            continue
+        if char in "\"'":
+            quote = char
+        elif char in _CLOSING:
+            stack.append(_CLOSING[char])
+        elif stack and char == stack[-1]:
+            stack.pop()
+            if not stack:
+                return index
+    return -1
+
+
+def extract_answer_action(content: str) -> Optional[str]:
+    """从（可能仍在生成中的）响应里提取 <answer> 中已完整的动作调用。
+
+    流式接收时用于提前结束生成：出现 </answer>，或 do(...) 的括号已闭合即视为完整；
+    Type 和 finish 的参数是自由文本，只在出现 </answer> 后才视为完整。
+    尚不完整时返回 None。只依赖传入文本，可被多个并发请求共用。
+    """
+    answer_start = content.find("<answer>")
+    if answer_start == -1:
+        return None
+    answer = content[answer_start + len("<answer>"):]
+    answer_end = answer.find("</answer>")
+    if answer_end != -1:
+        return answer[:answer_end].strip()
+    starts = [answer.find(prefix) for prefix in _ACTION_PREFIXES]
+    starts = [index for index in starts if index != -1]
+    if not starts:
+        return None
+    start = min(starts)
+    if answer.startswith(_FREE_TEXT_PREFIXES, start):
+        return None
+    end = _find_call_end(answer, start)
+    if end == -1:
+        return None
+    return answer[start : end + 1]
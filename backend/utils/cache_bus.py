@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import uuid
+from typing import Callable, List, Optional
+
+from redis.exceptions import RedisError
+
+from config.settings import settings
+from db.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# 本进程标识，用于忽略自己发布的消息（本地缓存已在发布前清除）
+_WORKER_ID = uuid.uuid4().hex
+_RECONNECT_DELAY_SECONDS = 1.0
+
+_handlers: List[Callable[[Optional[str]], None]] = []
+_listener_task: asyncio.Task | None = None
+
+
+def subscribe(handler: Callable[[Optional[str]], None]) -> None:
+    """注册按设备失效的本地缓存清理函数，device_id 为 None 表示清除全部。"""
+    _handlers.append(handler)
+
+
+def unsubscribe(handler: Callable[[Optional[str]], None]) -> None:
+    if handler in _handlers:
+        _handlers.remove(handler)
+
+
+def _apply(device_id: Optional[str]) -> None:
+    for handler in _handlers:
+        try:
+            handler(device_id)
+        except Exception:
+            logger.exception("清除本地缓存失败")
+
+
+async def invalidate_device(device_id: Optional[str] = None) -> None:
+    """清除本进程缓存，并通知其他 worker 清除同一设备的缓存。"""
+    _apply(device_id)
+    if not settings.cache_bus_enabled:
+        return
+    message = json.dumps({"device_id": device_id, "origin": _WORKER_ID})
+    try:
+        await get_redis().publish(settings.cache_bus_channel, message)
+    except Exception as exc:
+        # Redis 不可用时其他 worker 的缓存依靠 TTL 过期
+        logger.warning(f"发布缓存失效消息失败: {exc}")
+
+
+def _handle_message(data: str) -> None:
+    try:
+        message = json.loads(data)
+    except (TypeError, json.JSONDecodeError):
+        return
+    if not isinstance(message, dict) or message.get("origin") == _WORKER_ID:
+        return
+    device_id = message.get("device_id")
+    _apply(str(device_id) if device_id else None)
+
+
+async def _listen() -> None:
+    while True:
+        pubsub = get_redis().pubsub()
+        try:
+            await pubsub.subscribe(settings.cache_bus_channel)
+            # 断线期间可能错过失效消息，重新订阅后清除全部本地缓存
+            _apply(None)
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _handle_message(message.get("data"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning(f"缓存失效订阅中断，{_RECONNECT_DELAY_SECONDS} 秒后重连: {exc}")
+            await asyncio.sleep(_RECONNECT_DELAY_SECONDS)
+        finally:
+            # PubSub.aclose() 自 redis 5.0.1 起提供（requirements.txt 据此固定下限）；
+            # 只忽略连接层面的错误，其他异常（如低版本缺少 aclose）不能被吞掉，否则每次重连都会泄漏连接
+            try:
+                await pubsub.aclose()
+            except (RedisError, OSError) as exc:
+                logger.warning(f"关闭缓存失效订阅连接失败: {exc}")
+
+
+def start_listener() -> None:
+    """启动缓存失效订阅（应用启动时调用）。"""
+    global _listener_task
+    if not settings.cache_bus_enabled:
+        return
+    if _listener_task is None or _listener_task.done():
+        _listener_task = asyncio.create_task(_listen())
+
+
+async def stop_listener() -> None:
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import or_, select
+
+from config.settings import settings
+from db.connection import get_session
+from db.models import ModelConfig
+from skills.generic import GenericSkill
+from skills.user_loader import build_user_skills, user_skills_query
+from utils import cache_bus
+from utils.cache import TTLCache
+from utils.metrics import metrics
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+BUILTIN_SKILL_IDS = ("default", "translator", "anti_scam", "doudizhu", "photo_composition")
+MANAGER_SKILL_ID = "manager"
+
+
+@dataclass
+class DeviceRuntimeConfig:
+    """执行任务所需的设备配置快照（模型配置 + 用户技能）"""
+
+    default_model: Optional[Dict[str, Any]] = None
+    builtin_models: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    manager_model: Optional[Dict[str, Any]] = None
+    user_skills: List[GenericSkill] = field(default_factory=list)
+
+
+def _model_config_to_dict(config: ModelConfig) -> Dict[str, Any]:
+    """将 ModelConfig ORM 对象转换为字典"""
+    return {
+        "provider": config.provider,
+        "base_url": config.base_url,
+        "api_key": config.api_key,
+        "model": config.model,
+        "config": config.config,
+    }
+
+
+async def load_device_runtime_config(device_id: str) -> DeviceRuntimeConfig:
+    """在同一个数据库会话中加载设备的全部运行配置。
+
+    model_configs 一次查询取回默认模型、内置技能模型和 manager 模型（按更新时间取最新），
+    再查询一次用户技能。
+    """
+    model_stmt = (
+        select(ModelConfig)
+        .where(
+            ModelConfig.owner_device_id == device_id,
+            or_(
+                ModelConfig.skill_id.in_(BUILTIN_SKILL_IDS + (MANAGER_SKILL_ID,)),
+                ModelConfig.skill_id.is_(None),
+            ),
+        )
+        .order_by(ModelConfig.updated_at.desc())
+    )
+
+    with metrics.timer("db_query_seconds", {"query": "device_runtime_config"}), span("db.device_runtime_config"):
+        async for session in get_session():
+            model_rows = (await session.execute(model_stmt)).scalars().all()
+            skill_rows = (await session.execute(user_skills_query(device_id))).scalars().all()
+            break
+
+    snapshot = DeviceRuntimeConfig(user_skills=build_user_skills(skill_rows))
+    for row in model_rows:
+        if row.skill_id is None:
+            if snapshot.default_model is None:
+                snapshot.default_model = _model_config_to_dict(row)
+        elif row.skill_id == MANAGER_SKILL_ID:
+            if snapshot.manager_model is None:
+                snapshot.manager_model = _model_config_to_dict(row)
+        else:
+            skill_id = str(row.skill_id)
+            if skill_id not in snapshot.builtin_models:
+                snapshot.builtin_models[skill_id] = _model_config_to_dict(row)
+
+    metrics.incr("device_config_loads_total")
+    logger.info(f"已为设备 {device_id} 加载运行配置（{len(snapshot.user_skills)} 个用户技能）")
+    return snapshot
+
+
+class DeviceConfigCache:
+    """设备配置快照的进程内缓存。
+
+    同一设备的并发请求共享一次加载；管理接口写入后经 cache_bus 通知所有 worker 调用 invalidate，
+    加载期间发生的失效会阻止旧结果写回缓存。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int) -> None:
+        self._cache = TTLCache(max_entries, ttl_seconds)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._generation = 0
+
+    async def get(self, device_id: str) -> DeviceRuntimeConfig:
+        cached = self._cache.get(device_id)
+        if cached is not None:
+            return cached
+
+        inflight = self._inflight.get(device_id)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._load(device_id))
+            self._inflight[device_id] = inflight
+            inflight.add_done_callback(lambda future: self._forget(device_id, future))
+        # shield：某个调用方被取消时不影响其他等待同一次加载的请求
+        return await asyncio.shield(inflight)
+
+    async def _load(self, device_id: str) -> DeviceRuntimeConfig:
+        generation = self._generation
+        snapshot = await load_device_runtime_config(device_id)
+        if generation == self._generation:
+            self._cache.set(device_id, snapshot)
+        return snapshot
+
+    def _forget(self, device_id: str, future: asyncio.Future) -> None:
+        if self._inflight.get(device_id) is future:
+            del self._inflight[device_id]
+        if not future.cancelled():
+            future.exception()
+
+    def invalidate(self, device_id: str | None = None) -> None:
+        """使设备（或全部设备）的配置快照失效"""
+        self._generation += 1
+        if device_id:
+            self._cache.pop(device_id)
+            self._inflight.pop(device_id, None)
+        else:
+            self._cache.clear()
+            self._inflight.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+device_config_cache = DeviceConfigCache(
+    max_entries=settings.device_config_cache_max_entries,
+    ttl_seconds=settings.device_config_cache_ttl_seconds,
+)
+cache_bus.subscribe(device_config_cache.invalidate)
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from config.settings import settings
+from utils.metrics import metrics
+
+
+class CircuitBreaker:
+    """单个模型端点的熔断器。
+
+    连续失败达到阈值后打开，冷却期内不再向该端点发送请求；
+    冷却结束后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float) -> None:
+        self._failure_threshold = max(1, failure_threshold)
+        self._cooldown_seconds = cooldown_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self._cooldown_seconds:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self._cooldown_seconds or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def abandon(self) -> None:
+        """请求被取消（如对冲请求的输家）时不计入结果，释放半开探测名额。"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self._failure_threshold):
+                metrics.incr("model_circuit_opened_total")
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class LatencyTracker:
+    """记录端点最近的请求耗时，用于计算对冲请求的触发延迟。"""
+
+    def __init__(self, window: int) -> None:
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+
+_lock = threading.Lock()
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[str, LatencyTracker] = {}
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    with _lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                settings.model_circuit_failure_threshold,
+                settings.model_circuit_cooldown_seconds,
+            )
+            _breakers[endpoint] = breaker
+        return breaker
+
+
+def get_latency_tracker(endpoint: str) -> LatencyTracker:
+    with _lock:
+        tracker = _latencies.get(endpoint)
+        if tracker is None:
+            tracker = LatencyTracker(settings.model_latency_window)
+            _latencies[endpoint] = tracker
+        return tracker
@@ -1,22 +1,24 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 import base64
+import hashlib
 import io
+import threading
 
 from PIL import Image
 
+from config.settings import settings
+
+_MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+# 超出字节预算时逐级降低画质，仍超出则继续缩小尺寸
+_MIN_QUALITY = 40
+_QUALITY_STEP = 15
+_SCALE_STEP = 0.75
+_MIN_SIDE = 320
 
-def crop_base64_image(
-    base64_data: str,
-    region: Dict[str, Any],
-) -> Optional[str]:
-    try:
-        raw = base64.b64decode(base64_data)
-        image = Image.open(io.BytesIO(raw))
-    except Exception:
-        return None
 
+def _crop_image(image: Image.Image, region: Dict[str, Any]) -> Optional[Image.Image]:
     try:
         x = int(region.get("x", 0))
         y = int(region.get("y", 0))
@@ -39,7 +41,147 @@ def crop_base64_image(
     crop_right = max(crop_left + 1, min(image.width, int((x + width) * scale_x)))
     crop_bottom = max(crop_top + 1, min(image.height, int((y + height) * scale_y)))
 
-    cropped = image.crop((crop_left, crop_top, crop_right, crop_bottom))
+    return image.crop((crop_left, crop_top, crop_right, crop_bottom))
+
+
+def _encode(image: Image.Image, image_format: str, quality: int) -> bytes:
     buffer = io.BytesIO()
-    cropped.convert("RGB").save(buffer, format="JPEG", quality=85)
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    if image_format == "png":
+        image.save(buffer, format="PNG", optimize=True)
+    else:
+        image.save(buffer, format=image_format.upper(), quality=quality)
+    return buffer.getvalue()
+
+
+def _prepare_image(
+    image: Image.Image,
+    max_side: int,
+    image_format: str,
+    quality: int,
+    max_bytes: int,
+) -> Tuple[bytes, str]:
+    """压缩截图后再发送给模型，返回 (编码后的字节, mime 类型)。
+
+    - max_side: 最长边上限（像素），0 表示不缩放
+    - image_format / quality: 重新编码的格式（jpeg | webp | png）和画质
+    - max_bytes: 单张图片的字节预算，0 表示不限制；超出时先降画质再缩小尺寸
+    """
+    image_format = (image_format or "jpeg").lower()
+    if image_format not in _MIME_TYPES:
+        image_format = "jpeg"
+
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    encoded = _encode(image, image_format, quality)
+    while max_bytes and len(encoded) > max_bytes:
+        if image_format != "png" and quality > _MIN_QUALITY:
+            quality = max(_MIN_QUALITY, quality - _QUALITY_STEP)
+        elif max(image.size) > _MIN_SIDE:
+            width = max(1, int(image.width * _SCALE_STEP))
+            height = max(1, int(image.height * _SCALE_STEP))
+            image = image.resize((width, height), Image.LANCZOS)
+        else:
+            break
+        encoded = _encode(image, image_format, quality)
+
+    return encoded, _MIME_TYPES[image_format]
+
+
+class Screenshot:
+    """单个任务内共享的截图。
+
+    首次使用时才解码，之后缓存 PIL 图像、原始字节、发送给模型的 data URL，
+    以及按区域裁剪的结果，多个技能并发使用时不重复解码和编码。
+    """
+
+    def __init__(self, base64_data: Optional[str] = None, image: Optional[Image.Image] = None) -> None:
+        self._base64 = base64_data
+        self._image = image
+        self._decoded = image is not None
+        self._raw: Optional[bytes] = None
+        self._data_url: Optional[str] = None
+        self._digest: Optional[str] = None
+        self._crops: Dict[Tuple[Any, ...], Optional[Screenshot]] = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def coerce(cls, value: Any) -> Optional["Screenshot"]:
+        """兼容旧调用方：base64 字符串包装为 Screenshot，空值返回 None。"""
+        if not value:
+            return None
+        if isinstance(value, Screenshot):
+            return value
+        return cls(value)
+
+    @property
+    def base64(self) -> str:
+        with self._lock:
+            if self._base64 is None:
+                self._base64 = base64.b64encode(_encode(self._image, "jpeg", 85)).decode("utf-8")
+            return self._base64
+
+    @property
+    def raw(self) -> Optional[bytes]:
+        with self._lock:
+            if self._raw is None:
+                if self._base64 is None:
+                    self._raw = _encode(self._image, "jpeg", 85)
+                else:
+                    try:
+                        self._raw = base64.b64decode(self._base64)
+                    except Exception:
+                        return None
+            return self._raw
+
+    @property
+    def image(self) -> Optional[Image.Image]:
+        with self._lock:
+            if not self._decoded:
+                self._decoded = True
+                raw = self.raw
+                if raw is not None:
+                    try:
+                        self._image = Image.open(io.BytesIO(raw)).convert("RGB")
+                    except Exception:
+                        self._image = None
+            return self._image
+
+    @property
+    def digest(self) -> Optional[str]:
+        """截图内容摘要，用于缓存键。"""
+        with self._lock:
+            if self._digest is None:
+                raw = self.raw
+                if raw is not None:
+                    self._digest = hashlib.sha256(raw).hexdigest()
+            return self._digest
+
+    def data_url(self) -> str:
+        """按全局配置压缩后的 data URL（CPU 密集，异步调用方应放到线程中执行）。"""
+        with self._lock:
+            if self._data_url is None:
+                image = self.image
+                if image is None:
+                    self._data_url = f"data:image/jpeg;base64,{self.base64}"
+                else:
+                    encoded, mime = _prepare_image(
+                        image,
+                        settings.screenshot_max_side,
+                        settings.screenshot_format,
+                        settings.screenshot_quality,
+                        settings.screenshot_max_bytes,
+                    )
+                    self._data_url = f"data:{mime};base64,{base64.b64encode(encoded).decode('utf-8')}"
+            return self._data_url
+
+    def crop(self, region: Dict[str, Any]) -> Optional["Screenshot"]:
+        """按区域裁剪，同一区域只裁剪一次。"""
+        key = tuple(sorted((str(k), str(v)) for k, v in region.items()))
+        with self._lock:
+            if key not in self._crops:
+                image = self.image
+                cropped = _crop_image(image, region) if image is not None else None
+                self._crops[key] = Screenshot(image=cropped) if cropped is not None else None
+            return self._crops[key]
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class KeywordMatcher:
+    """基于 Aho–Corasick 自动机的多关键词匹配。
+
+    构建时把全部关键词（按类别）编入一个自动机，匹配时只扫描一遍文本，
+    耗时与文本长度（加命中数）成正比，与关键词数量无关。
+    normalize 同时用于关键词和待匹配文本，返回的是原始关键词。
+    """
+
+    def __init__(
+        self,
+        entries: Iterable[Tuple[str, Hashable]],
+        normalize: Optional[Callable[[str], str]] = None,
+    ) -> None:
+        self._normalize = normalize
+        self._keywords: List[Tuple[str, Hashable]] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[int, ...]] = [()]
+
+        seen = set()
+        for keyword, category in entries:
+            pattern = normalize(keyword) if normalize else keyword
+            if not pattern or (pattern, category) in seen:
+                continue
+            seen.add((pattern, category))
+            self._add(pattern, len(self._keywords))
+            self._keywords.append((keyword, category))
+        self._link()
+
+    def _add(self, pattern: str, index: int) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = next_state
+        self._output[state] += (index,)
+
+    def _link(self) -> None:
+        """按层构建失败指针，并把失败链上的输出合并到当前状态。"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def __len__(self) -> int:
+        return len(self._keywords)
+
+    def search(self, text: str) -> Dict[Hashable, List[str]]:
+        """返回 {类别: 命中的关键词}，同一类别内按关键词的定义顺序排列。"""
+        if self._normalize:
+            text = self._normalize(text)
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        found = set()
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+
+        hits: Dict[Hashable, List[str]] = {}
+        for index in sorted(found):
+            keyword, category = self._keywords[index]
+            hits.setdefault(category, []).append(keyword)
+        return hits
@@ -1,38 +1,44 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
-import urllib.request
-import urllib.error
-from typing import Any, Dict, List, Optional
+import random
+import threading
+import weakref
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
+import httpx
 
-logger = logging.getLogger(__name__)
+from config.settings import settings
+from utils.endpoint_health import get_breaker, get_latency_tracker
+from utils.metrics import metrics
+from utils.payload_log import get_payload_logger, log_payload
+from utils.rate_limiter import get_limiter
+from utils.token_usage import estimate_usage
+from utils.token_usage import record as record_token_usage
+from utils.tracing import span
+
+try:
+    import h2
+except ImportError:
+    h2 = None
 
 
-def _redact(value: Any, key: str | None = None) -> Any:
-    if isinstance(value, dict):
-        redacted: Dict[str, Any] = {}
-        for entry_key, entry_value in value.items():
-            if entry_key.lower() in {"api_key", "apikey", "authorization"}:
-                redacted[entry_key] = "***"
-            else:
-                redacted[entry_key] = _redact(entry_value, key=entry_key)
-        return redacted
-    if isinstance(value, list):
-        return [_redact(item) for item in value]
-    if isinstance(value, str):
-        lowered_key = (key or "").lower()
-        if lowered_key in {"screenshot", "image", "image_base64"} and value:
-            return f"<已省略图片 {len(value)} 个字符>"
-        if value.startswith("data:image"):
-            return f"<已省略图片 {len(value)} 个字符>"
-    return value
+logger = logging.getLogger(__name__)
+payload_logger = get_payload_logger("model")
 
+# 按 base_url 共享连接池，避免每次模型调用都重新进行 TCP/TLS 握手
+_clients_lock = threading.Lock()
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = (
+    weakref.WeakKeyDictionary()
+)
 
-def _log_json(prefix: str, payload: Dict[str, Any]) -> None:
-    safe_payload = _redact(payload)
-    logger.info("%s %s", prefix, json.dumps(safe_payload, ensure_ascii=False))
+
+def _log_json(prefix: str, payload: Dict[str, Any], always_full: bool = False) -> None:
+    log_payload(payload_logger, prefix, payload, always_full=always_full)
 
 
 def _normalize_base_url(base_url: str) -> str:
@@ -51,38 +57,409 @@ def _build_url(base_url: str) -> str:
         return base + "/chat/completions"
     return _normalize_base_url(base_url) + "/chat/completions"
 
-def chat_completions(
+def _build_payload(model: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.2,
+    }
+
+
+def _http2_enabled() -> bool:
+    return settings.model_http2 and h2 is not None
+
+
+def _pool_key(base_url: str) -> str:
+    return base_url.rstrip("/")
+
+
+def _client_options() -> Dict[str, Any]:
+    return {
+        "http2": _http2_enabled(),
+        "limits": httpx.Limits(
+            max_connections=settings.model_http_max_connections,
+            max_keepalive_connections=settings.model_http_max_keepalive_connections,
+            keepalive_expiry=settings.model_http_keepalive_expiry,
+        ),
+        "timeout": httpx.Timeout(settings.model_http_timeout_seconds),
+    }
+
+
+def get_async_client(base_url: str) -> httpx.AsyncClient:
+    """获取 base_url 对应的共享异步连接池。
+
+    连接池绑定到当前事件循环，同一 worker 内的所有模型调用复用同一组连接。
+    """
+    loop = asyncio.get_running_loop()
+    key = _pool_key(base_url)
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(**_client_options())
+            clients[key] = client
+        return client
+
+
+async def aclose_clients() -> None:
+    """关闭所有共享连接池（应用关闭时调用）。"""
+    with _clients_lock:
+        async_clients = []
+        for clients in _async_clients.values():
+            async_clients.extend(clients.values())
+        _async_clients.clear()
+    for client in async_clients:
+        await client.aclose()
+
+
+def _build_headers(api_key: str) -> Dict[str, str]:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}",
+    }
+
+
+def _handle_response(response: httpx.Response) -> Dict[str, Any]:
+    if response.is_error:
+        if response.text:
+            _log_json("模型错误：", {"status": response.status_code, "body": response.text}, always_full=True)
+        response.raise_for_status()
+    result = response.json()
+    _log_json("模型响应：", result)
+    return result
+
+
+async def achat_completions(
     *,
     base_url: str,
     api_key: str,
     model: str,
     messages: List[Dict[str, Any]],
-    timeout: int = 60,
+    timeout: float | None = None,
+    stop_when: Callable[[str], bool] | None = None,
+    config: Dict[str, Any] | str | None = None,
 ) -> Dict[str, Any]:
-    url = _build_url(base_url)
-    payload = {
-        "model": model,
-        "messages": messages,
-        "temperature": 0.2,
-    }
+    """调用 OpenAI 兼容的 chat/completions 接口，等待模型响应时不阻塞事件循环。
+
+    传入 stop_when 时以 SSE 流式接收，新内容中出现 ")" 或 ">"（动作调用或 </answer> 可能在此结束）时
+    以累计文本调用 stop_when，返回 True 即停止接收并关闭连接（不再为剩余 token 付费），返回已收到的内容。
+    stop_when 只能依赖传入的文本：对冲时多个请求会同时调用它。
+
+    config 为 model_configs.config，可配置备用端点和对冲请求，见 _resolve_endpoints。
+    每次调用的 token 用量计入当前任务/技能的统计，见 utils.token_usage。
+    """
+    options = _parse_options(config)
+    endpoints = _resolve_endpoints(base_url, api_key, model, options)
+
+    async def call(endpoint: Dict[str, str]) -> Dict[str, Any]:
+        url = _build_url(endpoint["base_url"])
+        payload = _build_payload(endpoint["model"], messages)
+        _log_json("模型请求：", {"url": url, "payload": payload})
+
+        async def send() -> Dict[str, Any]:
+            if stop_when is not None:
+                return await _astream_chat_completions(
+                    endpoint["base_url"], url, payload, endpoint["api_key"], timeout, stop_when
+                )
+            response = await get_async_client(endpoint["base_url"]).post(
+                url,
+                json=payload,
+                headers=_build_headers(endpoint["api_key"]),
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+            )
+            return _handle_response(response)
+
+        with span(
+            "model.chat_completions",
+            **{
+                "gen_ai.request.model": endpoint["model"],
+                "server.address": httpx.URL(url).host,
+                "gen_ai.request.streaming": stop_when is not None,
+            },
+        ) as current:
+            result = await _send_with_limiter(endpoint["base_url"], endpoint["api_key"], send)
+            usage = record_token_usage(result.get("usage"))
+            current.set_attributes({
+                "gen_ai.usage.input_tokens": usage.prompt_tokens,
+                "gen_ai.usage.output_tokens": usage.completion_tokens,
+                "gen_ai.usage.cache_read.input_tokens": usage.cached_tokens,
+                "gen_ai.response.stopped_early": bool(result.get("stopped_early")),
+                "gen_ai.usage.estimated": bool(usage.estimated_calls),
+            })
+            return result
+
+    if len(endpoints) == 1 and not options.get("hedge"):
+        return await call(endpoints[0])
+    return await _call_endpoints(endpoints, options, call)
+
 
-    _log_json("模型请求：", {"url": url, "payload": payload})
+def _parse_options(config: Dict[str, Any] | str | None) -> Dict[str, Any]:
+    if isinstance(config, dict):
+        return config
+    if isinstance(config, str) and config:
+        try:
+            parsed = json.loads(config)
+        except json.JSONDecodeError:
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
+    return {}
 
-    data = json.dumps(payload).encode("utf-8")
-    request = urllib.request.Request(url, data=data, method="POST")
-    request.add_header("Content-Type", "application/json")
-    request.add_header("Authorization", f"Bearer {api_key}")
 
+def _resolve_endpoints(base_url: str, api_key: str, model: str, options: Dict[str, Any]) -> List[Dict[str, str]]:
+    """主端点加上 config["fallbacks"] 中的备用端点，按顺序尝试。
+
+    备用端点格式：{"base_url": ..., "api_key": 可选, "model": 可选}，
+    未填写的 api_key / model 沿用主端点。
+    """
+    endpoints = [{"base_url": base_url, "api_key": api_key, "model": model}]
+    for fallback in options.get("fallbacks") or []:
+        if not isinstance(fallback, dict) or not fallback.get("base_url"):
+            continue
+        endpoints.append({
+            "base_url": fallback["base_url"],
+            "api_key": fallback.get("api_key") or api_key,
+            "model": fallback.get("model") or model,
+        })
+    return endpoints
+
+
+def _hedge_delay(endpoint: Dict[str, str], options: Dict[str, Any]) -> float:
+    """对冲请求的触发延迟：取端点最近耗时的 p95，样本不足时使用配置值。"""
+    hedge = options.get("hedge")
+    configured_ms = hedge.get("delay_ms") if isinstance(hedge, dict) else None
+    p95 = get_latency_tracker(_pool_key(endpoint["base_url"])).percentile(
+        0.95, settings.model_hedge_min_samples
+    )
+    if p95 is not None:
+        return max(settings.model_hedge_min_delay_ms / 1000, p95)
+    return (configured_ms or settings.model_hedge_default_delay_ms) / 1000
+
+
+def _is_client_error(exc: BaseException) -> bool:
+    """请求本身有误（4xx，除 408/429）时换端点也无济于事。"""
+    if not isinstance(exc, httpx.HTTPStatusError):
+        return False
+    status = exc.response.status_code
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+async def _call_endpoints(
+    endpoints: List[Dict[str, str]],
+    options: Dict[str, Any],
+    call: Callable[[Dict[str, str]], Awaitable[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """按顺序在端点间故障转移，并可选发送对冲请求。
+
+    - 熔断中的端点被跳过（全部熔断时仍尝试主端点）
+    - 请求失败时立即转向下一个端点
+    - 开启对冲时，第一个请求超过 p95 耗时仍未返回则向下一个端点（只有一个端点时为同一端点）
+      再发一个请求，先成功的结果胜出，其余请求被取消
+
+    熔断器在端点真正被尝试时才检查（allow 会占用半开探测名额），
+    未用到的备用端点不占用名额。
+    """
+    hedge_enabled = bool(options.get("hedge"))
+    order = endpoints * 2 if hedge_enabled and len(endpoints) == 1 else endpoints
+
+    async def attempt(endpoint: Dict[str, str]) -> Dict[str, Any]:
+        key = _pool_key(endpoint["base_url"])
+        breaker = get_breaker(key)
+        try:
+            result = await call(endpoint)
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except Exception as exc:
+            if not _is_client_error(exc):
+                breaker.record_failure()
+            raise
+        breaker.record_success()
+        return result
+
+    pending: set[asyncio.Task] = set()
+    next_index = 0
+    hedged = False
+    last_error: BaseException | None = None
+
+    def launch() -> bool:
+        """尝试下一个熔断器放行的端点，没有可用端点时返回 False"""
+        nonlocal next_index
+        while next_index < len(order):
+            endpoint = order[next_index]
+            next_index += 1
+            if get_breaker(_pool_key(endpoint["base_url"])).allow():
+                pending.add(asyncio.create_task(attempt(endpoint)))
+                return True
+        return False
+
+    if not launch():
+        pending.add(asyncio.create_task(attempt(endpoints[0])))
+    try:
+        while pending:
+            timeout = None
+            if hedge_enabled and not hedged and next_index < len(order):
+                timeout = _hedge_delay(order[0], options)
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                metrics.incr("model_hedged_requests_total")
+                launch()
+                continue
+            for task in done:
+                pending.discard(task)
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+                if _is_client_error(last_error):
+                    raise last_error
+            if not pending and next_index < len(order):
+                logger.warning(f"模型端点请求失败，切换到下一个端点: {last_error}")
+                metrics.incr("model_endpoint_failovers_total")
+                launch()
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+_RETRYABLE_STATUS = {429, 502, 503, 504}
+
+
+def _parse_retry_after(response: httpx.Response) -> float | None:
+    """解析 Retry-After（秒数或 HTTP 日期）"""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
     try:
-        with urllib.request.urlopen(request, timeout=timeout) as response:
-            body = response.read().decode("utf-8")
-    except urllib.error.HTTPError as exc:
-        body = exc.read().decode("utf-8") if exc.fp else ""
-        if body:
-            _log_json("模型错误：", {"status": exc.code, "body": body})
-        raise
-
-    result = json.loads(body)
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _backoff_delay(attempt: int, retry_after: float | None) -> float:
+    """指数退避加随机抖动，避免多个请求同时重试；Retry-After 更长时以其为准。"""
+    delay = min(settings.model_retry_max_delay_seconds, settings.model_retry_base_delay_seconds * 2**attempt)
+    delay *= random.uniform(0.5, 1.0)
+    return max(delay, retry_after or 0.0)
+
+
+async def _send_with_limiter(
+    base_url: str,
+    api_key: str,
+    send: Callable[[], Awaitable[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """在提供方限流器内发送请求；429/5xx/连接失败时按退避策略重试。
+
+    成功请求的往返耗时（不含限流等待和退避）计入端点延迟统计，用于对冲触发延迟。
+    """
+    limiter = get_limiter(base_url, api_key)
+    latency = get_latency_tracker(_pool_key(base_url))
+    loop = asyncio.get_running_loop()
+    attempt = 0
+    while True:
+        await limiter.acquire()
+        throttled = False
+        retry_after: float | None = None
+        try:
+            started_at = loop.time()
+            result = await send()
+            latency.add(loop.time() - started_at)
+            return result
+        except httpx.HTTPStatusError as exc:
+            status = exc.response.status_code
+            throttled = status == 429
+            retry_after = _parse_retry_after(exc.response)
+            if throttled:
+                metrics.incr("model_requests_throttled_total")
+            if status not in _RETRYABLE_STATUS or attempt >= settings.model_max_retries:
+                raise
+        except httpx.ConnectError:
+            if attempt >= settings.model_max_retries:
+                raise
+        finally:
+            await limiter.release(throttled=throttled, retry_after=retry_after)
+
+        delay = _backoff_delay(attempt, retry_after)
+        attempt += 1
+        metrics.incr("model_request_retries_total")
+        logger.warning(f"模型请求失败，{delay:.2f} 秒后第 {attempt} 次重试")
+        await asyncio.sleep(delay)
+
+
+async def _astream_chat_completions(
+    base_url: str,
+    url: str,
+    payload: Dict[str, Any],
+    api_key: str,
+    timeout: float | None,
+    stop_when: Callable[[str], bool],
+) -> Dict[str, Any]:
+    parts: List[str] = []
+    finish_reason: str | None = None
+    usage: Dict[str, Any] | None = None
+    stopped_early = False
+
+    async with get_async_client(base_url).stream(
+        "POST",
+        url,
+        # 兼容 OpenAI 的服务只有设置 include_usage 才会在流末尾返回用量
+        json={**payload, "stream": True, "stream_options": {"include_usage": True}},
+        headers=_build_headers(api_key),
+        timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+    ) as response:
+        if response.is_error:
+            await response.aread()
+            if response.text:
+                _log_json("模型错误：", {"status": response.status_code, "body": response.text}, always_full=True)
+            response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            usage = chunk.get("usage") or usage
+            choices = chunk.get("choices") or []
+            if not choices:
+                continue
+            finish_reason = choices[0].get("finish_reason") or finish_reason
+            delta = (choices[0].get("delta") or {}).get("content")
+            if not delta:
+                continue
+            parts.append(delta)
+            # 只在可能结束动作的字符到达时检查，避免每个分片都重新扫描全部内容
+            if (")" in delta or ">" in delta) and stop_when("".join(parts)):
+                # 退出 stream 上下文会关闭连接，服务端随之停止生成
+                stopped_early = True
+                break
+
+    content = "".join(parts)
+
+    result: Dict[str, Any] = {
+        "choices": [
+            {
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop" if stopped_early else finish_reason,
+            }
+        ],
+        "stopped_early": stopped_early,
+    }
+    if usage:
+        result["usage"] = usage
+    elif stopped_early:
+        # 提前断开时收不到末尾的 usage 块，按内容估算（带 estimated 标记）
+        result["usage"] = estimate_usage(payload["messages"], content)
     _log_json("模型响应：", result)
     return result
 
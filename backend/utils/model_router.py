@@ -1,14 +1,27 @@
 from __future__ import annotations
 
+import json
 from typing import Any, Dict, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 
 
 class ModelConfig(BaseModel):
     base_url: Optional[str] = None
     api_key: Optional[str] = None
     model: Optional[str] = None
+    # model_configs.config：备用端点（fallbacks）与对冲请求（hedge）等选项
+    config: Optional[Dict[str, Any]] = None
+
+    @field_validator("config", mode="before")
+    @classmethod
+    def _parse_config(cls, value: Any) -> Optional[Dict[str, Any]]:
+        if isinstance(value, str):
+            try:
+                value = json.loads(value) if value else None
+            except json.JSONDecodeError:
+                return None
+        return value if isinstance(value, dict) else None
 
 
 class ModelRouter:
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+
+from db.connection import AsyncSessionLocal
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+EXPORT_BATCH_SIZE = 1000
+
+
+def encode_cursor(*values: Any) -> str:
+    """把排序键编码为不透明的游标（datetime 以 ISO 格式保存）"""
+    items = [{"t": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(items, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """解析游标，格式不对时返回 400"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        items = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(items, list) or len(items) != size:
+            raise ValueError(cursor)
+        return [datetime.fromisoformat(item["t"]) if isinstance(item, dict) else item for item in items]
+    except (ValueError, TypeError, KeyError, UnicodeError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+
+def _format_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def stream_export(
+    stmt: Select,
+    columns: Sequence[str],
+    export_format: str,
+    filename: str,
+    to_row: Callable[[Any], Dict[str, Any]] | None = None,
+) -> StreamingResponse:
+    """以 NDJSON 或 CSV 流式导出查询结果。
+
+    使用独立会话和服务端游标（stream_results）分批读取，内存占用与结果总量无关；
+    响应开始后才执行查询，因此不依赖请求级的数据库会话。
+    """
+    to_row = to_row or (lambda row: {column: getattr(row, column) for column in columns})
+
+    async def generate() -> AsyncIterator[str]:
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            yield buffer.getvalue()
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+            async for partition in result.partitions():
+                rows = [to_row(item) for item in partition]
+                if export_format == "csv":
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer)
+                    writer.writerows([[_format_value(row[column]) for column in columns] for row in rows])
+                    yield buffer.getvalue()
+                else:
+                    yield "".join(
+                        json.dumps(row, ensure_ascii=False, default=_format_value) + "\n" for row in rows
+                    )
+
+    if export_format == "csv":
+        media_type = "text/csv; charset=utf-8"
+        filename = f"{filename}.csv"
+    else:
+        media_type = "application/x-ndjson"
+        filename = f"{filename}.ndjson"
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional
+
+from config.settings import settings
+from utils.metrics import metrics
+
+# 所有载荷日志都挂在 "payload" 之下，后台线程只接管这一支，不影响其他日志
+_ROOT_NAME = "payload"
+_SECRET_KEYS = {"api_key", "apikey", "authorization"}
+_IMAGE_KEYS = {"screenshot", "image", "image_base64"}
+# 不超过这个长度的扁平载荷（ping、ack、错误消息等）总是完整记录
+_SMALL_VALUE_CHARS = 256
+
+
+def redact(value: Any, key: str | None = None) -> Any:
+    """隐藏密钥并省略图片内容"""
+    if isinstance(value, dict):
+        redacted: Dict[str, Any] = {}
+        for entry_key, entry_value in value.items():
+            if str(entry_key).lower() in _SECRET_KEYS:
+                redacted[entry_key] = "***"
+            else:
+                redacted[entry_key] = redact(entry_value, key=entry_key)
+        return redacted
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        lowered_key = (key or "").lower()
+        if lowered_key in _IMAGE_KEYS and value:
+            return f"<已省略图片 {len(value)} 个字符>"
+        if value.startswith("data:image"):
+            return f"<已省略图片 {len(value)} 个字符>"
+    return value
+
+
+def _is_small(payload: Dict[str, Any]) -> bool:
+    for value in payload.values():
+        if isinstance(value, (dict, list)):
+            return False
+        if isinstance(value, str) and len(value) > _SMALL_VALUE_CHARS:
+            return False
+    return True
+
+
+class _LazyPayload:
+    """在真正格式化日志时才执行脱敏和 JSON 编码（启用队列后在后台线程中执行）"""
+
+    __slots__ = ("payload", "sampled")
+
+    def __init__(self, payload: Dict[str, Any], sampled: bool) -> None:
+        self.payload = payload
+        self.sampled = sampled
+
+    def __str__(self) -> str:
+        if self.sampled:
+            body: Any = redact(self.payload)
+        else:
+            # 未采样的大载荷只记录结构摘要
+            body = {"sampled_out": True, "keys": sorted(str(key) for key in self.payload)}
+            if "type" in self.payload:
+                body["type"] = self.payload["type"]
+        text = json.dumps(body, ensure_ascii=False, separators=(",", ":"), default=str)
+        max_chars = settings.payload_log_max_chars
+        if max_chars and len(text) > max_chars:
+            text = f"{text[:max_chars]}…<截断，共 {len(text)} 个字符>"
+        return text
+
+
+def get_payload_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{_ROOT_NAME}.{name}")
+
+
+def log_payload(
+    logger: logging.Logger,
+    event: str,
+    payload: Dict[str, Any],
+    *,
+    always_full: bool = False,
+    **fields: Any,
+) -> None:
+    """记录一条结构化载荷日志。
+
+    日志级别未启用时不做任何处理；大载荷按 payload_log_sample_rate 采样完整内容，
+    其余只记录摘要（always_full 时总是完整记录，用于错误）。
+    fields 作为结构化字段附加到日志记录上。
+    载荷可能在后台线程中才序列化，因此这里浅拷贝一份：调用方之后可以增删顶层字段，
+    但不要原地修改嵌套的值。
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    sampled = always_full or _is_small(payload) or random.random() < settings.payload_log_sample_rate
+    logger.info(
+        "%s %s",
+        event,
+        _LazyPayload(dict(payload), sampled),
+        extra={"event": event, "fields": fields, "sampled": sampled},
+    )
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """放入队列时不格式化，由后台线程中的实际 handler 完成格式化"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr("payload_log_dropped_total")
+
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[_DeferredQueueHandler] = None
+
+
+def start_listener() -> None:
+    """把载荷日志的格式化和输出移到后台线程（应用启动时调用）"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    root = logging.getLogger()
+    handlers: List[logging.Handler] = list(root.handlers)
+    if not handlers:
+        return
+    log_queue: queue.Queue = queue.Queue(maxsize=max(1, settings.payload_log_queue_size))
+    _queue_handler = _DeferredQueueHandler(log_queue)
+    payload_root = logging.getLogger(_ROOT_NAME)
+    payload_root.addHandler(_queue_handler)
+    payload_root.propagate = False
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_listener() -> None:
+    """停止后台线程并写完队列中的日志"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    payload_root = logging.getLogger(_ROOT_NAME)
+    payload_root.removeHandler(_queue_handler)
+    payload_root.propagate = True
+    _listener.stop()
+    _listener = None
+    _queue_handler = None
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+from config.settings import settings
+from utils.metrics import metrics
+
+# AIMD：限流（429）时并发上限减半，成功时每个窗口约加 1
+_DECREASE_FACTOR = 0.5
+
+
+class ProviderLimiter:
+    """单个模型提供方（base_url + api_key）的限流器。
+
+    - 令牌桶：rate_per_second > 0 时限制请求速率，允许 burst 个突发请求
+    - 并发上限：按 AIMD 自适应，在 min_concurrency 与 max_concurrency 之间调整
+    - Retry-After：收到后在指定时间内暂停发送新请求
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        rate_per_second: float = 0.0,
+        burst: int = 1,
+    ) -> None:
+        self._max_concurrency = max(1, max_concurrency)
+        self._min_concurrency = max(1, min(min_concurrency, self._max_concurrency))
+        self._limit = float(self._max_concurrency)
+        self._rate = rate_per_second
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._refilled_at: Optional[float] = None
+        self._blocked_until = 0.0
+        self._in_flight = 0
+        self._cond = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _refill(self, now: float) -> None:
+        if not self._rate:
+            return
+        if self._refilled_at is not None:
+            self._tokens = min(self._burst, self._tokens + (now - self._refilled_at) * self._rate)
+        self._refilled_at = now
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        async with self._cond:
+            while True:
+                now = loop.time()
+                self._refill(now)
+                delay = max(self._blocked_until - now, 0.0)
+                if not delay and self._rate and self._tokens < 1:
+                    delay = (1 - self._tokens) / self._rate
+                if not delay and self._in_flight < int(self._limit):
+                    break
+                try:
+                    # 等待其他请求释放名额，或等到令牌/Retry-After 到期
+                    await asyncio.wait_for(self._cond.wait(), delay or None)
+                except asyncio.TimeoutError:
+                    pass
+            self._in_flight += 1
+            if self._rate:
+                self._tokens -= 1
+        waited = loop.time() - started_at
+        metrics.observe("model_limiter_wait_seconds", waited)
+        waited_ms = int(waited * 1000)
+        if waited_ms:
+            metrics.incr("model_limiter_waits_total")
+            metrics.incr("model_limiter_wait_ms_total", waited_ms)
+
+    async def release(self, throttled: bool = False, retry_after: Optional[float] = None) -> None:
+        async with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self._limit = max(float(self._min_concurrency), self._limit * _DECREASE_FACTOR)
+                if retry_after:
+                    self._blocked_until = max(self._blocked_until, asyncio.get_running_loop().time() + retry_after)
+            else:
+                self._limit = min(float(self._max_concurrency), self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+
+_limiters_lock = threading.Lock()
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str], ProviderLimiter]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_limiter(base_url: str, api_key: str) -> ProviderLimiter:
+    """获取 (base_url, api_key) 对应的限流器，与连接池一样按事件循环隔离。"""
+    loop = asyncio.get_running_loop()
+    key = (base_url.rstrip("/"), api_key)
+    with _limiters_lock:
+        limiters = _limiters.setdefault(loop, {})
+        limiter = limiters.get(key)
+        if limiter is None:
+            limiter = ProviderLimiter(
+                max_concurrency=settings.model_max_concurrency_per_provider,
+                min_concurrency=settings.model_min_concurrency_per_provider,
+                rate_per_second=settings.model_rate_limit_per_second,
+                burst=settings.model_rate_limit_burst,
+            )
+            limiters[key] = limiter
+        return limiter
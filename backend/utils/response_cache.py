@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from config.settings import settings
+from db.redis_client import get_redis
+from utils.cache import TTLCache
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def make_response_key(
+    model_config: Dict[str, Any],
+    system_prompt: str,
+    task: str,
+    image_digest: Optional[str],
+) -> str:
+    """按模型与消息内容生成缓存键（图片只取内容摘要；api_key 不参与计算）"""
+    raw = json.dumps(
+        {
+            "base_url": str(model_config.get("base_url") or "").rstrip("/"),
+            "model": model_config.get("model"),
+            "config": model_config.get("config"),
+            "system": system_prompt,
+            "task": task,
+            "image": image_digest,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SkillResponseCache:
+    """技能模型调用的响应缓存
+
+    只缓存启用了 response_cache_ttl_seconds 的技能；本进程 LRU 为一级缓存，
+    配置 Redis 后端时作为二级缓存在多个 worker 之间共享。
+    """
+
+    def __init__(self, max_entries: int, use_redis: bool = False) -> None:
+        self._local = TTLCache(max_entries)
+        self._use_redis = use_redis
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        cached = self._local.get(key)
+        if cached is None and self._use_redis:
+            try:
+                raw = await get_redis().get(f"skill_cache:{key}")
+            except Exception as exc:
+                logger.warning(f"读取 Redis 技能响应缓存失败: {exc}")
+                raw = None
+            if raw:
+                try:
+                    cached = json.loads(raw)
+                except json.JSONDecodeError:
+                    cached = None
+                if cached is not None:
+                    ttl = await self._remaining_ttl(key)
+                    self._local.set(key, cached, ttl)
+        metrics.incr("skill_cache_hits_total" if cached is not None else "skill_cache_misses_total")
+        return cached
+
+    async def _remaining_ttl(self, key: str) -> Optional[int]:
+        try:
+            ttl = await get_redis().ttl(f"skill_cache:{key}")
+        except Exception:
+            return None
+        return ttl if ttl and ttl > 0 else None
+
+    async def set(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> None:
+        self._local.set(key, value, ttl_seconds)
+        if not self._use_redis:
+            return
+        try:
+            await get_redis().set(f"skill_cache:{key}", json.dumps(value, ensure_ascii=False), ex=ttl_seconds)
+        except Exception as exc:
+            logger.warning(f"写入 Redis 技能响应缓存失败: {exc}")
+
+    def clear(self) -> None:
+        self._local.clear()
+
+    def sweep(self) -> int:
+        return self._local.purge_expired()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._local.stats()
+
+
+skill_response_cache = SkillResponseCache(
+    max_entries=settings.skill_cache_max_entries,
+    use_redis=settings.skill_cache_backend == "redis",
+)
@@ -1,80 +1,362 @@
 from __future__ import annotations
 
-from collections import deque
-from typing import Any, Deque, Dict, List
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
 
+from config.settings import settings
+from db.redis_client import get_redis
+from utils import cache_bus
+from utils.cache import TTLCache
+from utils.metrics import metrics
+from utils.response_cache import skill_response_cache
 
-class SessionStore:
-    def __init__(self, max_messages: int = 10) -> None:
+logger = logging.getLogger(__name__)
+
+
+class SessionBackend(ABC):
+    """会话历史存储后端"""
+
+    @abstractmethod
+    async def get_history(self, session_id: str) -> List[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def append(self, session_id: str, messages: List[dict]) -> None:
+        raise NotImplementedError
+
+    def sweep(self) -> int:
+        """清理空闲会话，返回清理数量。由后端自行过期的实现无需处理。"""
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InMemorySessionBackend(SessionBackend):
+    """进程内存储（默认），单 worker 部署使用。
+
+    会话数量有上限（超出时淘汰最久未访问的会话），空闲超过 idle_ttl_seconds 的会话由 sweep 清理。
+    """
+
+    def __init__(
+        self,
+        max_messages: int,
+        max_sessions: int = 10000,
+        idle_ttl_seconds: float | None = None,
+    ) -> None:
         self._max_messages = max_messages
-        self._store: Dict[str, Deque[dict]] = {}
+        self._max_sessions = max(1, max_sessions)
+        self._idle_ttl_seconds = idle_ttl_seconds
+        # session_id -> (最后访问时间, 历史消息)，按访问顺序排列
+        self._store: "OrderedDict[str, Tuple[float, Deque[dict]]]" = OrderedDict()
 
-    def get_history(self, session_id: str) -> List[dict]:
-        if not session_id:
-            return []
-        history = self._store.get(session_id)
-        if not history:
+    async def get_history(self, session_id: str) -> List[dict]:
+        entry = self._store.get(session_id)
+        if not entry:
             return []
+        history = entry[1]
+        self._store[session_id] = (time.monotonic(), history)
+        self._store.move_to_end(session_id)
         return list(history)
 
-    def append_user(self, session_id: str, text: str) -> None:
+    async def append(self, session_id: str, messages: List[dict]) -> None:
+        entry = self._store.get(session_id)
+        history = entry[1] if entry else deque(maxlen=self._max_messages)
+        history.extend(messages)
+        self._store[session_id] = (time.monotonic(), history)
+        self._store.move_to_end(session_id)
+        while len(self._store) > self._max_sessions:
+            self._store.popitem(last=False)
+            metrics.incr("session_store_evictions_total")
+
+    def sweep(self) -> int:
+        if not self._idle_ttl_seconds:
+            return 0
+        deadline = time.monotonic() - self._idle_ttl_seconds
+        expired = 0
+        # 按访问顺序排列，遇到未过期的会话即可停止
+        while self._store:
+            session_id, (last_access, _) = next(iter(self._store.items()))
+            if last_access > deadline:
+                break
+            del self._store[session_id]
+            expired += 1
+        if expired:
+            metrics.incr("session_store_expired_total", expired)
+        return expired
+
+    def stats(self) -> Dict[str, Any]:
+        messages = 0
+        content_bytes = 0
+        for _, history in self._store.values():
+            messages += len(history)
+            for message in history:
+                content_bytes += len(str(message.get("content", "")).encode("utf-8"))
+        return {"sessions": len(self._store), "messages": messages, "content_bytes": content_bytes}
+
+
+class RedisSessionBackend(SessionBackend):
+    """Redis 存储，多 worker / 多实例共享会话历史。
+
+    每个 session 一个 list，写入时 LTRIM 截断到 max_messages 并刷新 TTL。
+    """
+
+    def __init__(self, max_messages: int, ttl_seconds: int) -> None:
+        self._max_messages = max_messages
+        self._ttl_seconds = ttl_seconds
+
+    def _key(self, session_id: str) -> str:
+        return f"session:history:{session_id}"
+
+    async def get_history(self, session_id: str) -> List[dict]:
+        key = self._key(session_id)
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                pipe.lrange(key, 0, -1)
+                pipe.expire(key, self._ttl_seconds)
+                raw_items, _ = await pipe.execute()
+        except Exception as exc:
+            logger.warning(f"读取 Redis 会话历史失败: {exc}")
+            return []
+        history = []
+        for raw in raw_items or []:
+            try:
+                history.append(json.loads(raw))
+            except json.JSONDecodeError:
+                continue
+        return history
+
+    async def append(self, session_id: str, messages: List[dict]) -> None:
+        key = self._key(session_id)
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                pipe.rpush(key, *(json.dumps(message, ensure_ascii=False) for message in messages))
+                pipe.ltrim(key, -self._max_messages, -1)
+                pipe.expire(key, self._ttl_seconds)
+                await pipe.execute()
+        except Exception as exc:
+            logger.warning(f"写入 Redis 会话历史失败: {exc}")
+
+
+class SessionStore:
+    def __init__(self, backend: SessionBackend) -> None:
+        self._backend = backend
+
+    def sweep(self) -> int:
+        return self._backend.sweep()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._backend.stats()
+
+    async def get_history(self, session_id: str) -> List[dict]:
+        if not session_id:
+            return []
+        return await self._backend.get_history(session_id)
+
+    async def append_user(self, session_id: str, text: str) -> None:
         if not session_id:
             return
-        self._append(session_id, {"role": "user", "content": text})
+        await self._backend.append(session_id, [{"role": "user", "content": text}])
 
-    def append_assistant(self, session_id: str, text: str) -> None:
+    async def append_assistant(self, session_id: str, text: str) -> None:
         if not session_id:
             return
-        self._append(session_id, {"role": "assistant", "content": text})
+        await self._backend.append(session_id, [{"role": "assistant", "content": text}])
 
-    def _append(self, session_id: str, message: dict) -> None:
-        history = self._store.setdefault(session_id, deque(maxlen=self._max_messages))
-        history.append(message)
+    async def append_turn(self, session_id: str, user_text: str, assistant_text: str) -> None:
+        """一次写入一问一答，Redis 后端只需一次往返。"""
+        if not session_id:
+            return
+        await self._backend.append(
+            session_id,
+            [
+                {"role": "user", "content": user_text},
+                {"role": "assistant", "content": assistant_text},
+            ],
+        )
+
+
+def normalize_task(task: str) -> str:
+    """规范化任务文本：小写、去除空白和常见中英文标点，使同一说法的不同写法命中同一缓存。"""
+    text = (task or "").lower()
+    text = re.sub(r"\s+", "", text)
+    return re.sub(r"[,.!?;:，。、！？；：~～…\"'“”‘’]", "", text)
+
+
+class PlanCacheBackend(ABC):
+    """规划缓存的共享存储后端（本地 LRU 之后的二级缓存）"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set(self, key: str, value: dict, ttl_seconds: int) -> None:
+        raise NotImplementedError
+
+
+class RedisPlanCacheBackend(PlanCacheBackend):
+    async def get(self, key: str) -> Optional[dict]:
+        try:
+            raw = await get_redis().get(f"plan_cache:{key}")
+        except Exception as exc:
+            logger.warning(f"读取 Redis 规划缓存失败: {exc}")
+            return None
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            return None
+
+    async def set(self, key: str, value: dict, ttl_seconds: int) -> None:
+        try:
+            await get_redis().set(
+                f"plan_cache:{key}",
+                json.dumps(value, ensure_ascii=False),
+                ex=ttl_seconds,
+            )
+        except Exception as exc:
+            logger.warning(f"写入 Redis 规划缓存失败: {exc}")
 
 
 class PlanCache:
-    """缓存 session 的规划结果，避免重复调用 Planner"""
+    """进程级规划缓存，避免重复调用 Planner
 
-    def __init__(self) -> None:
-        self._store: Dict[str, dict] = {}
+    以规范化任务文本 + 缓存范围（Planner 模型、可用技能与智能体及其描述）为键，跨 session 共享；
+    配置共享后端（Redis）时作为二级缓存，在多个 worker 之间共享。
+    """
 
-    def get(self, session_id: str, task: str) -> dict | None:
-        """获取缓存的规划结果"""
-        if not session_id or not task:
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl_seconds: int = 3600,
+        backend: PlanCacheBackend | None = None,
+    ) -> None:
+        self._local = TTLCache(max_entries, ttl_seconds)
+        self._ttl_seconds = ttl_seconds
+        self._backend = backend
+
+    def make_key(self, task: str, scope: Iterable[str]) -> str | None:
+        normalized_task = normalize_task(task)
+        if not normalized_task:
             return None
-        # 规范化 task 文本（去除首尾空格、统一标点）
-        normalized_task = task.strip()
-        cached = self._store.get(session_id)
-        if not cached or cached.get("task") != normalized_task:
+        raw = normalized_task + "|" + ",".join(sorted(scope))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, task: str, scope: Iterable[str]) -> dict | None:
+        """获取缓存的规划结果"""
+        key = self.make_key(task, scope)
+        if not key:
             return None
+        cached = self._local.get(key)
+        if cached is None and self._backend is not None:
+            cached = await self._backend.get(key)
+            if cached is not None:
+                self._local.set(key, cached)
+        metrics.incr("plan_cache_hits_total" if cached is not None else "plan_cache_misses_total")
         return cached
 
-    def set(
+    async def set(
         self,
-        session_id: str,
         task: str,
+        scope: Iterable[str],
         plan: List[str],
         selected_skills: List[str],
-        selected_agent: dict | None,
+        selected_agent_id: str | None,
     ) -> None:
-        """缓存规划结果"""
-        if not session_id:
+        """缓存规划结果（只保存智能体 ID，不保存其模型配置）"""
+        key = self.make_key(task, scope)
+        if not key:
             return
-        # 规范化 task 文本
-        normalized_task = task.strip()
-        self._store[session_id] = {
-            "task": normalized_task,
+        value = {
             "plan": list(plan),
             "selected_skills": list(selected_skills),
-            "selected_agent": selected_agent,
+            "selected_agent_id": selected_agent_id,
         }
+        self._local.set(key, value)
+        if self._backend is not None:
+            await self._backend.set(key, value, self._ttl_seconds)
+
+    def clear(self) -> None:
+        """清除本进程缓存"""
+        self._local.clear()
+
+    def invalidate(self, device_id: str | None = None) -> None:
+        """设备的技能、智能体或模型配置变更时清除本进程缓存。
+
+        缓存键不区分设备，因此总是全部清除；共享后端中的旧条目因键包含描述摘要而不再命中。
+        """
+        self.clear()
+
+    def sweep(self) -> int:
+        return self._local.purge_expired()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._local.stats()
+
+
+def _create_session_backend() -> SessionBackend:
+    if settings.session_store_backend == "redis":
+        return RedisSessionBackend(settings.session_max_messages, settings.session_history_ttl_seconds)
+    return InMemorySessionBackend(
+        settings.session_max_messages,
+        max_sessions=settings.session_max_sessions,
+        idle_ttl_seconds=settings.session_idle_ttl_seconds,
+    )
+
+
+def _create_plan_cache_backend() -> PlanCacheBackend | None:
+    if settings.plan_cache_backend == "redis":
+        return RedisPlanCacheBackend()
+    return None
+
+
+session_store = SessionStore(_create_session_backend())
+plan_cache = PlanCache(
+    max_entries=settings.plan_cache_max_entries,
+    ttl_seconds=settings.plan_cache_ttl_seconds,
+    backend=_create_plan_cache_backend(),
+)
+cache_bus.subscribe(plan_cache.invalidate)
+
+
+async def _sweep_loop(interval_seconds: float) -> None:
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            sessions = session_store.sweep()
+            plans = plan_cache.sweep()
+            responses = skill_response_cache.sweep()
+            if sessions or plans or responses:
+                logger.info(f"已清理 {sessions} 个空闲会话、{plans} 条过期规划缓存、{responses} 条过期技能响应缓存")
+        except Exception:
+            logger.exception("清理会话缓存失败")
+
+
+_sweeper_task: asyncio.Task | None = None
 
-    def clear(self, session_id: str) -> None:
-        """清除指定 session 的缓存"""
-        if session_id in self._store:
-            del self._store[session_id]
 
+def start_sweeper() -> None:
+    """启动后台清理任务（应用启动时调用）。"""
+    global _sweeper_task
+    if _sweeper_task is None or _sweeper_task.done():
+        _sweeper_task = asyncio.create_task(_sweep_loop(settings.session_sweep_interval_seconds))
 
-session_store = SessionStore(max_messages=10)
-plan_cache = PlanCache()
 
+async def stop_sweeper() -> None:
+    global _sweeper_task
+    if _sweeper_task is not None:
+        _sweeper_task.cancel()
+        try:
+            await _sweeper_task
+        except asyncio.CancelledError:
+            pass
+        _sweeper_task = None
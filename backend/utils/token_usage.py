@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+from utils.metrics import metrics
+
+
+@dataclass
+class TokenUsage:
+    """一次或多次模型调用的 token 用量"""
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    model_calls: int = 0
+    # 其中用量为本地估算（流式提前结束，服务端未返回 usage）的调用数
+    estimated_calls: int = 0
+
+    def add(self, other: "TokenUsage") -> None:
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cached_tokens += other.cached_tokens
+        self.model_calls += other.model_calls
+        self.estimated_calls += other.estimated_calls
+
+    def as_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+
+def _as_int(value: Any) -> int:
+    try:
+        return max(0, int(value or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_usage(usage: Optional[Dict[str, Any]]) -> TokenUsage:
+    """解析响应中的 usage 块（兼容 OpenAI / 智谱 / DeepSeek 等格式）。
+
+    命中服务端提示词缓存的 token 数在不同服务商中字段不同：
+    prompt_tokens_details.cached_tokens、prompt_cache_hit_tokens 或 cache_read_input_tokens。
+    """
+    if not isinstance(usage, dict):
+        return TokenUsage(model_calls=1)
+    details = usage.get("prompt_tokens_details")
+    cached = details.get("cached_tokens") if isinstance(details, dict) else None
+    if cached is None:
+        cached = usage.get("prompt_cache_hit_tokens", usage.get("cache_read_input_tokens"))
+    return TokenUsage(
+        prompt_tokens=_as_int(usage.get("prompt_tokens", usage.get("input_tokens"))),
+        completion_tokens=_as_int(usage.get("completion_tokens", usage.get("output_tokens"))),
+        cached_tokens=_as_int(cached),
+        model_calls=1,
+        estimated_calls=1 if usage.get("estimated") else 0,
+    )
+
+
+# 图片输入的 token 数因服务商和分辨率而异，估算时按固定值计
+_ESTIMATED_IMAGE_TOKENS = 1000
+
+
+def _estimate_text_tokens(text: str) -> int:
+    """粗略估算：CJK 字符约 1 token/字，其他字符约 4 字符/token"""
+    cjk = sum(1 for char in text if "\u2e80" <= char <= "\u9fff" or "\uf900" <= char <= "\uffef")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_usage(messages: List[Dict[str, Any]], completion: str) -> Dict[str, Any]:
+    """服务端未返回 usage 时（流式提前结束）按消息内容估算，结果带 estimated 标记"""
+    prompt_tokens = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            prompt_tokens += _estimate_text_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    prompt_tokens += _ESTIMATED_IMAGE_TOKENS
+                else:
+                    prompt_tokens += _estimate_text_tokens(str(part.get("text") or ""))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": _estimate_text_tokens(completion),
+        "estimated": True,
+    }
+
+
+class _Scope:
+    __slots__ = ("usage", "parent")
+
+    def __init__(self, parent: Optional["_Scope"]) -> None:
+        self.usage = TokenUsage()
+        self.parent = parent
+
+
+_current_scope: ContextVar[Optional[_Scope]] = ContextVar("token_usage_scope", default=None)
+
+
+@contextmanager
+def track() -> Iterator[TokenUsage]:
+    """统计代码块内（含其中创建的子任务）所有模型调用的用量。
+
+    可以嵌套：内层（如单个技能）的用量同时计入外层（整个任务）。
+    """
+    token = _current_scope.set(_Scope(_current_scope.get()))
+    try:
+        yield _current_scope.get().usage
+    finally:
+        _current_scope.reset(token)
+
+
+def record(usage: Optional[Dict[str, Any]]) -> TokenUsage:
+    """记录一次模型调用的用量，计入当前所有统计范围和全局计数器"""
+    parsed = parse_usage(usage)
+    scope = _current_scope.get()
+    while scope is not None:
+        scope.usage.add(parsed)
+        scope = scope.parent
+    metrics.incr("model_prompt_tokens_total", parsed.prompt_tokens)
+    metrics.incr("model_completion_tokens_total", parsed.completion_tokens)
+    metrics.incr("model_cached_tokens_total", parsed.cached_tokens)
+    if parsed.estimated_calls:
+        metrics.incr("model_estimated_usage_total")
+    return parsed
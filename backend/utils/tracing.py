@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import functools
+import logging
+from contextlib import contextmanager
+from typing import IO, Any, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+from config.settings import settings
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor,
+        ConsoleSpanExporter,
+        SimpleSpanProcessor,
+        SpanExporter,
+    )
+except ImportError:
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+_tracer = None
+_provider = None
+_original_record_factory = None
+# 安装日志上下文前各 handler 原有的 formatter，关闭追踪时原样恢复
+_original_formatters: Dict[logging.Handler, Optional[logging.Formatter]] = {}
+# file 导出器写入的文件，关闭追踪时关闭
+_exporter_file: Optional[IO[str]] = None
+
+
+class _NoopSpan:
+    """未启用追踪时使用的空 span，调用方不需要判断是否启用"""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: dict) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def is_enabled() -> bool:
+    return _tracer is not None
+
+
+def _create_exporter() -> "SpanExporter":
+    global _exporter_file
+    if settings.tracing_exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        # 端点等参数读取标准环境变量 OTEL_EXPORTER_OTLP_*
+        return OTLPSpanExporter()
+    if settings.tracing_exporter == "file":
+        # 每个 span 一行 JSON，便于离线分析
+        _exporter_file = open(settings.tracing_file_path, "a", encoding="utf-8")
+        return ConsoleSpanExporter(
+            out=_exporter_file,
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    return ConsoleSpanExporter()
+
+
+def setup_tracing(exporter: Optional["SpanExporter"] = None) -> bool:
+    """按配置启用 OpenTelemetry（应用启动时调用）。
+
+    未启用或未安装 opentelemetry-sdk 时返回 False，所有埋点保持为空操作。
+    传入 exporter 时同步导出（测试中使用 InMemorySpanExporter）。
+    """
+    global _tracer, _provider
+    if exporter is None and not settings.tracing_enabled:
+        return False
+    if trace is None:
+        logger.warning("已开启链路追踪，但未安装 opentelemetry-sdk，跳过")
+        return False
+    if _tracer is not None:
+        return True
+
+    provider = TracerProvider(resource=Resource.create({"service.name": settings.tracing_service_name}))
+    if exporter is not None:
+        provider.add_span_processor(SimpleSpanProcessor(exporter))
+    else:
+        try:
+            provider.add_span_processor(BatchSpanProcessor(_create_exporter()))
+        except (ImportError, OSError) as exc:
+            logger.warning(f"创建追踪导出器失败，跳过: {exc}")
+            return False
+    _provider = provider
+    _tracer = provider.get_tracer("phone-agent")
+    _install_log_context()
+    logger.info(f"链路追踪已启用（{settings.tracing_exporter if exporter is None else '自定义'} 导出）")
+    return True
+
+
+def shutdown_tracing() -> None:
+    """导出剩余 span 并关闭（应用关闭时调用）"""
+    global _tracer, _provider, _exporter_file
+    if _provider is not None:
+        _provider.shutdown()
+    if _exporter_file is not None:
+        _exporter_file.close()
+        _exporter_file = None
+    _uninstall_log_context()
+    _tracer = None
+    _provider = None
+
+
+class _TraceContextFormatter(logging.Formatter):
+    """包装 handler 原有的 formatter，在其输出后附加 trace_id / span_id。
+
+    原 formatter 的格式、时间格式和子类行为都保持不变。
+    """
+
+    def __init__(self, inner: Optional[logging.Formatter]) -> None:
+        super().__init__()
+        self.inner = inner or logging.Formatter()
+
+    def format(self, record: logging.LogRecord) -> str:
+        trace_id = getattr(record, "trace_id", "-")
+        span_id = getattr(record, "span_id", "-")
+        return f"{self.inner.format(record)} [trace_id={trace_id} span_id={span_id}]"
+
+
+def _install_log_context() -> None:
+    """在日志记录创建时写入当前 trace_id / span_id（后台线程格式化时也能取到）"""
+    global _original_record_factory
+    if _original_record_factory is not None:
+        return
+    original = logging.getLogRecordFactory()
+
+    def factory(*args: Any, **kwargs: Any) -> logging.LogRecord:
+        record = original(*args, **kwargs)
+        context = trace.get_current_span().get_span_context()
+        if context.is_valid:
+            record.trace_id = format(context.trace_id, "032x")
+            record.span_id = format(context.span_id, "016x")
+        else:
+            record.trace_id = record.span_id = "-"
+        return record
+
+    logging.setLogRecordFactory(factory)
+    _original_record_factory = original
+    for handler in logging.getLogger().handlers:
+        formatter = handler.formatter
+        if "%(trace_id)s" in (getattr(formatter, "_fmt", None) or ""):
+            continue
+        _original_formatters[handler] = formatter
+        handler.setFormatter(_TraceContextFormatter(formatter))
+
+
+def _uninstall_log_context() -> None:
+    global _original_record_factory
+    if _original_record_factory is None:
+        return
+    logging.setLogRecordFactory(_original_record_factory)
+    _original_record_factory = None
+    for handler, formatter in _original_formatters.items():
+        # 期间被其他代码替换过的 formatter 不再覆盖
+        if isinstance(handler.formatter, _TraceContextFormatter):
+            handler.formatter = formatter
+    _original_formatters.clear()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """创建子 span；未启用追踪时返回空 span"""
+    if _tracer is None:
+        yield _NOOP_SPAN
+        return
+    with _tracer.start_as_current_span(name) as current:
+        for key, value in attributes.items():
+            if value is not None:
+                current.set_attribute(key, value)
+        yield current
+
+
+def traced(name: str) -> Callable[[Callable[..., Awaitable[_T]]], Callable[..., Awaitable[_T]]]:
+    """为异步函数（如 LangGraph 节点）创建 span 的装饰器"""
+
+    def decorator(func: Callable[..., Awaitable[_T]]) -> Callable[..., Awaitable[_T]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> _T:
+            if _tracer is None:
+                return await func(*args, **kwargs)
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
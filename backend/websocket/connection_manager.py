@@ -34,6 +34,10 @@ class ConnectionManager:
         if session_id:
             self._session_to_device.pop(session_id, None)
 
+    def device_count(self) -> int:
+        """当前已连接（已绑定）的设备数"""
+        return len(self._device_to_ws)
+
     def device_for_session(self, session_id: str) -> Optional[str]:
         """根据 session_id 查找对应的设备"""
         return self._session_to_device.get(session_id)
@@ -2,12 +2,14 @@ from __future__ import annotations
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 
+from utils.metrics import metrics
 from websocket.connection_manager import ConnectionManager
 from websocket.handlers import handle_bind, handle_disconnect, handle_message
 
 
 def register_websocket(app: FastAPI, path: str = "/ws") -> None:
     manager = ConnectionManager()
+    metrics.register_gauge("ws_connected_devices", manager.device_count, help_text="已连接的设备数")
 
     @app.websocket(path)
     async def websocket_endpoint(websocket: WebSocket) -> None: